@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import pandas as pd
+from sqlalchemy import MetaData, Table, Column, String, DateTime, Integer, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+from findy.interface import Region
+from findy.utils.pd import pd_valid
+
+logger = logging.getLogger(__name__)
+
+# entity outcomes, same codes as the results of RecorderForEntities.process_entity,
+# written means data saved while the entity is not finished yet, failed means given up after the retries
+OUTCOME_FAILED = -1
+OUTCOME_WRITTEN = 0
+OUTCOME_EVALUATED = 1
+OUTCOME_RECORDED = 2
+OUTCOME_PERSISTED = 3
+
+CHECKPOINT_TABLE = 'fetch_checkpoint'
+
+# one database per region, the region is implied by the engine
+checkpoint_table = Table(CHECKPOINT_TABLE, MetaData(),
+                         Column('provider', String(length=32), primary_key=True),
+                         Column('schema_name', String(length=128), primary_key=True),
+                         Column('entity_id', String(length=128), primary_key=True),
+                         # latest timestamp persisted, kept when an outcome comes without data
+                         Column('timestamp', DateTime),
+                         Column('outcome', Integer),
+                         Column('updated_at', DateTime))
+
+checkpoint_ddl = str(CreateTable(checkpoint_table, if_not_exists=True).compile(dialect=postgresql.dialect()))
+
+# regions whose checkpoint table is known to exist in this process
+__checked = set()
+
+_upsert = (f"INSERT INTO {CHECKPOINT_TABLE} (provider, schema_name, entity_id, timestamp, outcome, updated_at) "
+           "VALUES {values} ON CONFLICT (provider, schema_name, entity_id) DO UPDATE SET "
+           f"timestamp = GREATEST({CHECKPOINT_TABLE}.timestamp, EXCLUDED.timestamp), "
+           "outcome = EXCLUDED.outcome, updated_at = EXCLUDED.updated_at")
+
+checkpoint_sql = _upsert.format(values='%s')
+checkpoint_sql_async = _upsert.format(values='($1, $2, $3, $4, $5, $6)')
+
+
+def ensure_checkpoint_table(region: Region):
+    if region in __checked:
+        return
+    from findy.database.context import get_db_engine
+    checkpoint_table.create(get_db_engine(region), checkfirst=True)
+    __checked.add(region)
+
+
+async def ensure_checkpoint_table_async(region: Region):
+    if region in __checked:
+        return
+    from findy.database.context import get_db_async_pool
+    pool = await get_db_async_pool(region)
+    async with pool.acquire() as connection:
+        await connection.execute(checkpoint_ddl)
+    __checked.add(region)
+
+
+def checkpoint_rows(provider, schema_name, df: pd.DataFrame, outcome=OUTCOME_WRITTEN):
+    """
+    one row per entity of the frame, carrying its latest timestamp
+    """
+    if not pd_valid(df) or 'entity_id' not in df.columns or 'timestamp' not in df.columns:
+        return []
+
+    now = pd.Timestamp.now().to_pydatetime()
+    latest = df.groupby('entity_id')['timestamp'].max()
+    return [(provider, schema_name, entity_id, pd.Timestamp(timestamp).to_pydatetime(), outcome, now)
+            for entity_id, timestamp in latest.items()]
+
+
+def write_checkpoints(cursor, rows):
+    # runs on the cursor of the data write, committed or rolled back together with the data
+    if rows:
+        from psycopg2.extras import execute_values
+        execute_values(cursor, checkpoint_sql, rows)
+
+
+async def write_checkpoints_async(connection, rows):
+    if rows:
+        await connection.executemany(checkpoint_sql_async, rows)
+
+
+def save_outcomes(region: Region, rows):
+    """
+    outcomes of entities finished without writing data
+    """
+    if not rows:
+        return
+
+    from findy.database.context import get_db_engine
+    ensure_checkpoint_table(region)
+
+    connection = get_db_engine(region).raw_connection()
+    cursor = connection.cursor()
+    try:
+        write_checkpoints(cursor, rows)
+        connection.commit()
+    except Exception as e:
+        logger.warning(f'save checkpoints failed with error: {e}')
+        connection.rollback()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+async def save_outcomes_async(region: Region, rows):
+    if not rows:
+        return
+
+    from findy.database.context import get_db_async_pool
+    try:
+        await ensure_checkpoint_table_async(region)
+        pool = await get_db_async_pool(region)
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await write_checkpoints_async(connection, rows)
+    except Exception as e:
+        logger.warning(f'save checkpoints failed with error: {e}')
+
+
+def load_checkpoints(region: Region, provider, schema_name, entity_ids=None):
+    """
+    entity_id -> (timestamp, outcome, updated_at), None when the store could not be read
+    """
+    from findy.database.context import get_db_engine
+
+    try:
+        ensure_checkpoint_table(region)
+        sql = (f"SELECT entity_id, timestamp, outcome, updated_at FROM {CHECKPOINT_TABLE} "
+               "WHERE provider = :provider AND schema_name = :schema_name")
+        params = {'provider': provider, 'schema_name': schema_name}
+        if entity_ids is not None:
+            sql += " AND entity_id = ANY(:entity_ids)"
+            params['entity_ids'] = list(entity_ids)
+
+        with get_db_engine(region).connect() as connection:
+            rows = connection.execute(text(sql), params).fetchall()
+    except Exception as e:
+        logger.warning(f'load checkpoints failed with error: {e}')
+        return None
+
+    return {row[0]: (pd.Timestamp(row[1]) if row[1] is not None else None, row[2], pd.Timestamp(row[3]))
+            for row in rows}
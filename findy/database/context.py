@@ -1,13 +1,10 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
 import os
-from io import StringIO
-import cProfile
 import time
-import pstats
-import contextlib
 
-from sqlalchemy import create_engine, schema, event, select, exc
+from sqlalchemy import create_engine, event, select, exc
 from sqlalchemy.engine import Engine
 from sqlalchemy.engine.reflection import Inspector
 from sqlalchemy.pool import QueuePool
@@ -18,13 +15,16 @@ from sqlalchemy_batch_inserts import enable_batch_inserting
 from findy import findy_config
 from findy.interface import Region, Provider
 from findy.database.schema.register import get_db_name
+from findy.database.instrument import instrument_engine
 
 logger = logging.getLogger(__name__)
-logger_time = logging.getLogger("findy.sql.performance")
 
 # provider_dbname -> engine
 __db_engine_map = {}
 
+# region -> asyncpg pool
+__db_async_pool_map = {}
+
 # global sessions
 __db_sessions = {}
 
@@ -84,37 +84,6 @@ __dbname_map_index = {}
 #                 (connection_record.info['pid'], pid))
 
 
-# @event.listens_for(Engine, "before_cursor_execute")
-# def before_cursor_execute(conn, cursor, statement,
-#                           parameters, context, executemany):
-#     if findy_config['debug'] == 2:
-#         conn.info.setdefault('query_start_time', []).append(time.time())
-#         logger_time.debug("Start Query: %s", statement[:50])
-
-
-# @event.listens_for(Engine, "after_cursor_execute")
-# def after_cursor_execute(conn, cursor, statement,
-#                          parameters, context, executemany):
-#     if findy_config['debug'] == 2:
-#         total = time.time() - conn.info['query_start_time'].pop(-1)
-#         logger_time.debug("Query Complete!")
-#         logger_time.debug("Total Time: %f", total)
-
-
-@contextlib.contextmanager
-def profiled():
-    pr = cProfile.Profile()
-    pr.enable()
-    yield
-    pr.disable()
-    s = StringIO()
-    ps = pstats.Stats(pr, stream=s).sort_stats('cumulative')
-    ps.print_stats()
-    # uncomment this to see who's calling what
-    # ps.print_callers()
-    logger_time.info(s.getvalue())
-
-
 def create_db(db_name):
     import psycopg2
 
@@ -170,6 +139,9 @@ def build_engine(region: Region) -> Engine:
                         #    executemany_values_page_size=10000,
                         #    executemany_batch_page_size=500)
 
+    # per statement latency, rows and slow query log, see findy.database.instrument
+    instrument_engine(engine)
+
     logger.debug(f'{region} engine connect successed')
     return engine
 
@@ -182,48 +154,57 @@ def get_db_engine(region: Region) -> Engine:
     return db_engine
 
 
+async def build_async_pool(region: Region):
+    import asyncpg
+
+    logger.debug(f'start building {region} async database pool...')
+
+    db_name = f"{findy_config['db_name']}_{region.value}"
+
+    create_db(db_name)
+
+    pool = await asyncpg.create_pool(user=findy_config['db_user'],
+                                     password=findy_config['db_pass'],
+                                     host=findy_config[f'db_host_{findy_config["location"]}'],
+                                     port=int(findy_config[f'db_port_{findy_config["location"]}']),
+                                     database=db_name,
+                                     min_size=1,
+                                     max_size=5,
+                                     max_inactive_connection_lifetime=3600)
+
+    logger.debug(f'{region} async pool connect successed')
+    return pool
+
+
+async def get_db_async_pool(region: Region):
+    # asyncpg pool belongs to the event loop it is created in, one per process
+    # keep the building task, concurrent callers wait on the same pool
+    key = (region, os.getpid())
+    task = __db_async_pool_map.get(key)
+    if not task:
+        task = asyncio.ensure_future(build_async_pool(region))
+        __db_async_pool_map[key] = task
+    return await task
+
+
 def create_index(region: Region, engine, schema_base):
+    from findy.database.indexes import create_table_indexes
+
     if not __dbname_map_index.get(region):
         __dbname_map_index[region] = []
 
     inspector = Inspector.from_engine(engine)
 
-    # create index for 'id', 'timestamp', 'entity_id', 'code', 'report_period', 'updated_timestamp
+    # create the indexes specified for the schema family, see findy.database.indexes
     for table_name, table in iter(schema_base.metadata.tables.items()):
         if table_name not in __dbname_map_index[region]:
             __dbname_map_index[region].append(table_name)
 
-            # try:
-            index_column_names = [index['name'] for index in inspector.get_indexes(table_name)]
-            # except Exception as e:
-            #     logger.warning(f'create table: {e}')
-            #     schema_base.metadata.create_all(engine)
-            #     index_column_names = [index['name'] for index in inspector.get_indexes(table_name)]
-
-            logger.debug(f'create async index -> engine: {engine}, table: {table_name}, index: {index_column_names}')
-
-            # for col in ['timestamp', 'entity_id', 'code', 'report_period', 'created_timestamp', 'updated_timestamp']:
-            for col in ['timestamp', 'entity_id', 'code', 'report_period']:
-                if col in table.c:
-                    index_name = f'{table_name}_{col}_index'
-                    if index_name not in index_column_names:
-                        column = eval(f'table.c.{col}')
-                        if col == 'timestamp':
-                            column = eval(f'table.c.{col}.desc()')
-                        else:
-                            column = eval(f'table.c.{col}')
-                        # index = schema.Index(index_name, column, unique=(col=='id'))
-                        index = schema.Index(index_name, column)
-                        index.create(engine)
-
-            for cols in [('timestamp', 'entity_id'), ('timestamp', 'code')]:
-                if (cols[0] in table.c) and (col[1] in table.c):
-                    index_name = f'{table_name}_{col[0]}_{col[1]}_index'
-                    if index_name not in index_column_names:
-                        column0 = eval(f'table.c.{col[0]}')
-                        column1 = eval(f'table.c.{col[1]}')
-                        index = schema.Index(index_name, column0, column1)
-                        index.create(engine)
+            index_names = [index['name'] for index in inspector.get_indexes(table_name)]
+
+            logger.debug(f'create index -> engine: {engine}, table: {table_name}, index: {index_names}')
+
+            create_table_indexes(region, engine, table, index_names)
 
 
 def bind_engine(region: Region,
@@ -234,6 +215,11 @@ def bind_engine(region: Region,
     # get database engine
     engine = get_db_engine(region)
 
+    # create partitioned kdata tables and their partitions ahead of writes
+    if findy_config.get('kdata_partition', False):
+        from findy.database.partition import bind_partitions
+        bind_partitions(region, engine, schema_base, Inspector.from_engine(engine).get_table_names())
+
     # create table
     schema_base.metadata.create_all(engine, checkfirst=True)
 
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from sqlalchemy import schema, text
+from sqlalchemy.engine import Engine
+
+from findy.interface import Region
+from findy.database.schema.register import get_schema_bases
+
+logger = logging.getLogger(__name__)
+
+# declarative index specification per schema family
+# columns: index columns in order, 'desc' suffix for descending
+# include: non key columns carried in the index leaf (covering, postgresql 11+)
+index_specs = {
+    # eval: max(timestamp) by entity_id, dedup: id, timestamp by entity_id
+    'kdata': [
+        {'columns': ['entity_id', 'timestamp desc'], 'include': ['id']},
+        {'columns': ['code', 'timestamp desc']},
+        {'columns': ['timestamp desc']},
+    ],
+    'finance': [
+        {'columns': ['entity_id', 'timestamp desc'], 'include': ['id']},
+        {'columns': ['code', 'timestamp desc']},
+        {'columns': ['report_period']},
+        {'columns': ['timestamp desc']},
+    ],
+    'holder': [
+        {'columns': ['entity_id', 'timestamp desc'], 'include': ['id']},
+        {'columns': ['code', 'timestamp desc']},
+        {'columns': ['holder_code']},
+    ],
+    'meta': [
+        {'columns': ['entity_id']},
+        {'columns': ['code']},
+        {'columns': ['timestamp desc']},
+    ],
+    'default': [
+        {'columns': ['entity_id', 'timestamp desc'], 'include': ['id']},
+        {'columns': ['timestamp desc']},
+    ],
+}
+
+
+def get_table_family(table) -> str:
+    if table.name.endswith('_kdata'):
+        return 'kdata'
+    if table.name.endswith('_holder'):
+        return 'holder'
+    if 'report_period' in table.c:
+        return 'finance'
+    if 'list_date' in table.c:
+        return 'meta'
+    return 'default'
+
+
+def get_index_name(table_name, spec) -> str:
+    # keep the '{table}_{col}_index' naming, single column indexes created before are recognized
+    cols = [col.split()[0] for col in spec['columns']]
+    return f"{table_name}_{'_'.join(cols)}_index"
+
+
+def get_table_indexes(table):
+    """
+    the specified indexes applicable to table, index name -> spec
+    """
+    indexes = {}
+    for spec in index_specs[get_table_family(table)]:
+        cols = [col.split()[0] for col in spec['columns']] + spec.get('include', [])
+        if all(col in table.c for col in cols):
+            indexes[get_index_name(table.name, spec)] = spec
+    return indexes
+
+
+def build_index(table, index_name, spec, concurrently=True) -> schema.Index:
+    columns = []
+    for col in spec['columns']:
+        name, *order = col.split()
+        column = table.c[name]
+        columns.append(column.desc() if order and order[0] == 'desc' else column)
+
+    return schema.Index(index_name, *columns,
+                        postgresql_include=spec.get('include', []),
+                        postgresql_concurrently=concurrently)
+
+
+def create_table_indexes(region: Region, engine: Engine, table, existing):
+    from findy.database.partition import get_partitioned_tables
+
+    # partitioned parent does not support concurrent build, its partitions are indexed along
+    concurrently = table.name not in get_partitioned_tables(region, engine)
+
+    # concurrent build can not run inside a transaction block
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        for index_name, spec in get_table_indexes(table).items():
+            if index_name in existing:
+                continue
+
+            logger.debug(f'create index concurrently -> table: {table.name}, index: {index_name}')
+            try:
+                # every pool process binds the engine, the ones coming second find the index and skip it
+                connection.execute(schema.CreateIndex(build_index(table, index_name, spec, concurrently=concurrently),
+                                                      if_not_exists=True))
+            except Exception as e:
+                logger.warning(f'create index {index_name} failed with error: {e}')
+                if is_abandoned_index(connection, index_name):
+                    # a failed concurrent build leaves an invalid index behind, drop it for the next try
+                    concurrent = 'CONCURRENTLY ' if concurrently else ''
+                    connection.execute(text(f'DROP INDEX {concurrent}IF EXISTS {index_name}'))
+
+
+def is_abandoned_index(connection, index_name) -> bool:
+    """
+    the index exists, is invalid and no backend is building it, a valid index or a build
+    in progress of another process is left alone
+    """
+    row = connection.execute(text(
+        "SELECT i.indisvalid, EXISTS (SELECT 1 FROM pg_stat_progress_create_index p WHERE p.index_relid = i.indexrelid) "
+        "FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"), {'name': index_name}).fetchone()
+    return row is not None and not row[0] and not row[1]
+
+
+def report_indexes(region: Region, engine: Engine):
+    """
+    log the specified indexes which are missing or invalid, and the indexes never scanned
+    """
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT s.relname, s.indexrelname, s.idx_scan, i.indisvalid, i.indisunique "
+            "FROM pg_stat_user_indexes s JOIN pg_index i ON i.indexrelid = s.indexrelid")).fetchall()
+        # pg_indexes also lists the indexes of partitioned parents, which carry no statistics
+        names = connection.execute(text(
+            "SELECT tablename, indexname FROM pg_indexes WHERE schemaname = 'public'")).fetchall()
+
+    existing = {row[1]: row for row in rows}
+    tables = {row[0] for row in names}
+    index_names = {row[1] for row in names}
+
+    missing = []
+    for base in get_schema_bases():
+        for table_name, table in base.metadata.tables.items():
+            # tables not created yet are built with their indexes
+            if table_name not in tables:
+                continue
+            for index_name in get_table_indexes(table).keys():
+                if index_name not in index_names:
+                    missing.append(index_name)
+
+    invalid = [name for name, row in existing.items() if not row[3]]
+    unused = [name for name, row in existing.items() if row[2] == 0 and not row[4]]
+
+    if missing:
+        logger.warning(f'{region.value} missing indexes: {missing}')
+    if invalid:
+        logger.warning(f'{region.value} invalid indexes: {invalid}')
+    if unused:
+        logger.info(f'{region.value} unused indexes: {unused}')
+
+    return missing, invalid, unused
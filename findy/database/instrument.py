@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import glob
+import logging
+import os
+import re
+import time
+
+from sqlalchemy import event
+
+from findy import findy_config, findy_env
+from findy.utils.cache import get_cache, dump_cache
+
+logger_time = logging.getLogger("findy.sql.performance")
+
+# latency histogram upper bounds in ms, the last bucket takes the rest
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+STATS_FILE = 'sql_stats'
+
+# the fetching task the statements run for, set by loop_task_set
+current_task = contextvars.ContextVar('sql_task', default='-')
+
+# (task, table, shape) -> stat
+__sql_stats = {}
+
+_literal = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s|\$\d+")
+_in_list = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_space = re.compile(r"\s+")
+_table = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+([\w.\"]+)", re.IGNORECASE)
+
+
+def query_shape(statement: str) -> str:
+    # literals and parameters become '?', IN lists collapse, so one shape per query pattern
+    shape = _literal.sub('?', statement)
+    shape = _in_list.sub('(?)', shape)
+    return _space.sub(' ', shape).strip()[:160]
+
+
+def query_table(statement: str) -> str:
+    match = _table.search(statement)
+    return match.group(1).strip('"') if match else '-'
+
+
+def record(table, shape, elapsed, rows=-1):
+    key = (current_task.get(), table, shape)
+    stat = __sql_stats.get(key)
+    if stat is None:
+        stat = {'count': 0, 'total': 0.0, 'max': 0.0, 'rows': 0, 'buckets': [0] * (len(BUCKETS_MS) + 1)}
+        __sql_stats[key] = stat
+
+    ms = elapsed * 1000
+    stat['count'] += 1
+    stat['total'] += elapsed
+    stat['max'] = max(stat['max'], elapsed)
+    if rows > 0:
+        stat['rows'] += rows
+
+    index = len(BUCKETS_MS)
+    for i, bound in enumerate(BUCKETS_MS):
+        if ms <= bound:
+            index = i
+            break
+    stat['buckets'][index] += 1
+
+
+def explain(cursor, statement, parameters):
+    # EXPLAIN ANALYZE runs the statement again, only for read queries,
+    # inside a savepoint rolled back afterwards, its effects or its failure never reach the caller's transaction
+    if not statement.lstrip().upper().startswith('SELECT'):
+        return None
+
+    from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+    connection = cursor.connection
+    status = connection.get_transaction_status()
+    try:
+        with connection.cursor() as explain_cursor:
+            if status == TRANSACTION_STATUS_INTRANS:
+                explain_cursor.execute('SAVEPOINT findy_explain')
+            try:
+                explain_cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {statement}', parameters)
+                return '\n'.join(row[0] for row in explain_cursor.fetchall())
+            finally:
+                if status == TRANSACTION_STATUS_INTRANS:
+                    explain_cursor.execute('ROLLBACK TO SAVEPOINT findy_explain')
+                    explain_cursor.execute('RELEASE SAVEPOINT findy_explain')
+                elif status == TRANSACTION_STATUS_IDLE and not connection.autocommit:
+                    # the explain opened a transaction of its own
+                    connection.rollback()
+    except Exception as e:
+        return f'explain failed with error: {e}'
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.time() - conn.info['query_start_time'].pop(-1)
+    table = query_table(statement)
+    record(table, query_shape(statement), elapsed, cursor.rowcount)
+
+    slow_ms = findy_config.get('sql_slow_ms', 1000)
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        plan = explain(cursor, statement, parameters) if findy_config.get('sql_explain', False) and not executemany else None
+        logger_time.warning(f'slow query: {elapsed * 1000:.1f} ms, task: {current_task.get()}, table: {table}, '
+                            f'rows: {cursor.rowcount}\n{statement}' + (f'\n{plan}' if plan else ''))
+
+
+def instrument_engine(engine):
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def dump_stats():
+    # pool processes each leave their own file, merged by report_stats
+    if __sql_stats:
+        dump_cache(f'{STATS_FILE}_{os.getpid()}', __sql_stats)
+
+
+def clear_stats():
+    __sql_stats.clear()
+    for file in glob.glob(os.path.join(findy_env['cache_path'], f'{STATS_FILE}_*.pkl')):
+        os.remove(file)
+
+
+def report_stats(top=20):
+    """
+    merge the snapshots of all processes, log the statements by total time
+    """
+    dump_stats()
+
+    merged = {}
+    for file in glob.glob(os.path.join(findy_env['cache_path'], f'{STATS_FILE}_*.pkl')):
+        stats = get_cache(os.path.basename(file)[:-len('.pkl')]) or {}
+        for key, stat in stats.items():
+            if key not in merged:
+                merged[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'rows': 0, 'buckets': [0] * (len(BUCKETS_MS) + 1)}
+            total = merged[key]
+            total['count'] += stat['count']
+            total['total'] += stat['total']
+            total['max'] = max(total['max'], stat['max'])
+            total['rows'] += stat['rows']
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], stat['buckets'])]
+
+    by_task = {}
+    for (task, table, shape), stat in merged.items():
+        by_task[task] = by_task.get(task, 0.0) + stat['total']
+
+    for task, total in sorted(by_task.items(), key=lambda x: x[1], reverse=True):
+        logger_time.info(f'sql time by task: {task:>36}, total: {total:.3f}s')
+
+    ranked = sorted(merged.items(), key=lambda x: x[1]['total'], reverse=True)[:top]
+    for (task, table, shape), stat in ranked:
+        histogram = ', '.join(f'<={b}ms: {c}' for b, c in zip(BUCKETS_MS + ['inf'], stat['buckets']) if c)
+        logger_time.info(f"{task}, {table}, count: {stat['count']}, total: {stat['total']:.3f}s, "
+                         f"avg: {stat['total'] / stat['count'] * 1000:.1f}ms, max: {stat['max'] * 1000:.1f}ms, "
+                         f"rows: {stat['rows']}, [{histogram}]\n    {shape}")
+
+    return merged
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import pandas as pd
+from sqlalchemy import MetaData, Table, Column, text
+from sqlalchemy.engine import Engine
+
+from findy import findy_config
+from findy.interface import Region
+from findy.database.schema import IntervalLevel
+
+logger = logging.getLogger(__name__)
+
+# level -> (partition unit, periods kept behind now), rows older go to the default partition,
+# moved to their partition once it is created
+partition_policies = {
+    IntervalLevel.LEVEL_1MIN: ('month', 24),
+    IntervalLevel.LEVEL_5MIN: ('month', 24),
+    IntervalLevel.LEVEL_15MIN: ('month', 36),
+    IntervalLevel.LEVEL_30MIN: ('month', 36),
+    IntervalLevel.LEVEL_1HOUR: ('month', 60),
+    IntervalLevel.LEVEL_4HOUR: ('year', 10),
+    IntervalLevel.LEVEL_1DAY: ('year', 40),
+    IntervalLevel.LEVEL_1WEEK: ('year', 40),
+    IntervalLevel.LEVEL_1MON: ('year', 40),
+}
+
+# periods created ahead of now, so writes never wait for a partition
+PARTITION_AHEAD = 2
+
+# region -> partitioned table names
+__partitioned_tables = {}
+
+
+def get_table_level(table_name):
+    # kdata table rule: {entity_type}_{level}[_{adjust_type}]_kdata
+    try:
+        return IntervalLevel(table_name.split('_')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def get_partition_policy(table_name):
+    if not findy_config.get('kdata_partition', False) or not table_name.endswith('_kdata'):
+        return None
+    return partition_policies.get(get_table_level(table_name))
+
+
+def get_partitioned_tables(region: Region, engine: Engine):
+    tables = __partitioned_tables.get(region)
+    if tables is None:
+        with engine.connect() as connection:
+            rows = connection.execute(text("SELECT relname FROM pg_class WHERE relkind = 'p'")).fetchall()
+        tables = {row[0] for row in rows}
+        __partitioned_tables[region] = tables
+    return tables
+
+
+def is_partitioned(region: Region, tablename: str) -> bool:
+    from findy.database.context import get_db_engine
+    return tablename in get_partitioned_tables(region, get_db_engine(region))
+
+
+def partition_bounds(unit, start: pd.Timestamp, end: pd.Timestamp):
+    """
+    (suffix, lower, upper) of every partition covering [start, end]
+    """
+    freq = 'MS' if unit == 'month' else 'YS'
+    fmt = '%Y_%m' if unit == 'month' else '%Y'
+    offset = pd.DateOffset(months=1) if unit == 'month' else pd.DateOffset(years=1)
+
+    lower = start.to_period('M' if unit == 'month' else 'Y').to_timestamp()
+    return [(lower.strftime(fmt), lower, lower + offset)
+            for lower in pd.date_range(lower, end, freq=freq)]
+
+
+def create_partitioned_table(engine: Engine, table):
+    # partition key must be part of the primary key, (id, timestamp) is as unique as id
+    columns = [Column(col.name, col.type, primary_key=col.name in ('id', 'timestamp'))
+               for col in table.columns]
+    partitioned = Table(table.name, MetaData(), *columns, postgresql_partition_by='RANGE (timestamp)')
+
+    try:
+        with engine.begin() as connection:
+            partitioned.create(connection)
+            connection.execute(text(f'CREATE TABLE {table.name}_default PARTITION OF {table.name} DEFAULT'))
+    except Exception as e:
+        # created by another process in between
+        logger.warning(f'create partitioned table {table.name} failed with error: {e}')
+        return
+
+    logger.info(f'partitioned table {table.name} created')
+
+
+def create_partitions(engine: Engine, table_name, unit, history):
+    now = pd.Timestamp.now()
+    if unit == 'month':
+        start, end = now - pd.DateOffset(months=history), now + pd.DateOffset(months=PARTITION_AHEAD)
+    else:
+        start, end = now - pd.DateOffset(years=history), now + pd.DateOffset(years=PARTITION_AHEAD)
+
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table"), {'table': table_name}).fetchall()
+    existing = {row[0] for row in rows}
+
+    default = f'{table_name}_default'
+    for suffix, lower, upper in partition_bounds(unit, start, end):
+        name = f'{table_name}_p{suffix}'
+        if name in existing:
+            continue
+        try:
+            with engine.begin() as connection:
+                in_range = f"timestamp >= '{lower}' AND timestamp < '{upper}'"
+                stranded = default in existing and connection.execute(text(
+                    f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})")).scalar()
+
+                if stranded:
+                    # the default partition holds rows of this range, the partition can not be created
+                    # while it does, move them over in the same transaction
+                    connection.execute(text(f"ALTER TABLE {table_name} DETACH PARTITION {default}"))
+
+                connection.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table_name} "
+                    f"FOR VALUES FROM ('{lower}') TO ('{upper}')"))
+
+                if stranded:
+                    moved = connection.execute(text(
+                        f"INSERT INTO {table_name} SELECT * FROM {default} WHERE {in_range}")).rowcount
+                    connection.execute(text(f"DELETE FROM {default} WHERE {in_range}"))
+                    connection.execute(text(f"ALTER TABLE {table_name} ATTACH PARTITION {default} DEFAULT"))
+                    logger.info(f'{name} created, {moved} rows moved from {default}')
+        except Exception as e:
+            # nothing changed, writes of this range keep going to the default partition
+            logger.error(f'create partition {name} failed with error: {e}')
+
+
+def bind_partitions(region: Region, engine: Engine, schema_base, existing_tables):
+    """
+    create the enabled kdata tables as partitioned tables, and their partitions ahead of writes
+    """
+    partitioned_tables = get_partitioned_tables(region, engine)
+
+    for table_name, table in schema_base.metadata.tables.items():
+        policy = get_partition_policy(table_name)
+        if policy is None:
+            continue
+
+        if table_name not in existing_tables:
+            create_partitioned_table(engine, table)
+            partitioned_tables.add(table_name)
+        elif table_name not in partitioned_tables:
+            logger.info(f'{table_name} exists as a plain table, drop or migrate it to partition')
+            continue
+
+        create_partitions(engine, table_name, *policy)
+
+
+def detach_partitions(region: Region, data_schema, before):
+    """
+    detach the partitions of data_schema entirely older than before, for archival
+
+    :return: detached partition names
+    """
+    from findy.database.context import get_db_engine
+
+    engine = get_db_engine(region)
+    table_name = data_schema.__tablename__
+    before = pd.Timestamp(before)
+
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table"), {'table': table_name}).fetchall()
+
+    detached = []
+    for name, bound in rows:
+        # FOR VALUES FROM ('2020-01-01 00:00:00') TO ('2020-02-01 00:00:00')
+        if 'TO (' not in bound:
+            continue
+        upper = pd.Timestamp(bound.split("TO ('")[1].split("'")[0])
+        if upper <= before:
+            with engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {table_name} DETACH PARTITION {name}'))
+            detached.append(name)
+
+    if detached:
+        logger.info(f'{table_name} detached partitions: {detached}')
+    return detached
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import time
 from io import StringIO
@@ -6,9 +7,14 @@ import pandas as pd
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import DeclarativeMeta
 
+from findy import findy_config
 from findy.interface import Region, Provider
-from findy.database.schema.register import get_schema_columns
-from findy.database.context import get_db_engine
+from findy.database.schema.register import get_schema_columns, get_schema_column_types
+from findy.database.context import get_db_engine, get_db_async_pool
+from findy.database.instrument import record
+from findy.database.checkpoint import ensure_checkpoint_table, ensure_checkpoint_table_async, checkpoint_rows, \
+    write_checkpoints, write_checkpoints_async, save_outcomes, save_outcomes_async
+from findy.database.pgcopy import BinaryCopyStream, is_binary_supported, iter_copy_chunks
 from findy.utils.pd import pd_valid
 from findy.utils.time import PRECISION_STR
 
@@ -23,7 +29,10 @@ async def df_to_db(region: Region,
                    ref_entity = None,
                    drop_duplicates: bool = True,
                    fix_duplicate_way: str = 'ignore',
-                   force_update=False) -> object:
+                   force_update=False,
+                   upsert=False,
+                   checkpoint=False,
+                   raise_error=False) -> object:
     now = time.time()
 
     if not pd_valid(df):
@@ -41,30 +50,53 @@ async def df_to_db(region: Region,
 
     df = df[cols]
 
-    # force update mode, delete duplicate id data, and rewrite new data back
+    # asyncpg backend keeps the event loop serving the other fetches while writing
+    use_async = findy_config.get('db_driver', 'psycopg2') == 'asyncpg'
+    tablename = data_schema.__tablename__
+
+    # latest timestamp of every entity in the frame, written in the same transaction as the data
+    checkpoints = None
+    if checkpoint:
+        if use_async:
+            await ensure_checkpoint_table_async(region)
+        else:
+            ensure_checkpoint_table(region)
+        checkpoints = checkpoint_rows(provider.value, tablename, df)
+
+    # upsert mode, resolve id conflicts on the server side through a staging table,
+    # skip reading back the existing ids of the entity (or the whole table)
+    if upsert:
+        if use_async:
+            saved = await to_postgresql_upsert_async(region, df, tablename, update=force_update, data_schema=data_schema, checkpoints=checkpoints, raise_error=raise_error)
+        else:
+            saved = to_postgresql_upsert(region, df, tablename, update=force_update, data_schema=data_schema, checkpoints=checkpoints, raise_error=raise_error)
+
+        # raw connection writes are not seen by the engine events
+        record(tablename, 'COPY upsert', time.time() - now, saved)
+
+        cost = PRECISION_STR.format(time.time() - now)
+        logger.debug(f"upsert db: {cost}, size: {saved}, skipped: {len(df) - saved}")
+
+        return saved
+
+    # force update mode, delete duplicate id data, and rewrite new data back in one transaction
     if force_update:
-        ids = df["id"].tolist()
-        if len(ids) == 1:
-            sql = f"delete from {data_schema.__tablename__} where id = '{ids[0]}'"
+        if use_async:
+            saved = await to_postgresql_replace_async(region, df, tablename, data_schema=data_schema, checkpoints=checkpoints, raise_error=raise_error)
         else:
-            sql = f"delete from {data_schema.__tablename__} where id in {tuple(ids)}"
+            saved = to_postgresql_replace(region, df, tablename, data_schema=data_schema, checkpoints=checkpoints, raise_error=raise_error)
 
-        try:
-            db_session.execute(sql)
-        except Exception as e:
-            logger.error(f"query {data_schema.__tablename__} failed with error: {e}")
+        record(tablename, 'COPY replace', time.time() - now, saved)
 
-        try:
-            db_session.commit()
-        except Exception as e:
-            logger.error(f'df_to_db {data_schema.__tablename__}, error: {e}')
-            db_session.rollback()
-        finally:
-            db_session.close()
-        df_new = df
+        cost = PRECISION_STR.format(time.time() - now)
+        logger.debug(f"replace db: {cost}, size: {saved}")
+
+        return saved
 
+    ref_ids = None
+    if use_async:
+        ref_ids = await get_saved_ids_async(region, tablename, entity_id=ref_entity.id if ref_entity is not None else None)
     else:
-        ref_df = None
         if ref_entity is not None:
             data, column_names = data_schema.query_data(
                 region=region,
@@ -80,21 +112,21 @@ async def df_to_db(region: Region,
                 provider=provider,
                 db_session=db_session,
                 columns=[data_schema.id, data_schema.timestamp])
-            
+
         if data and len(data) > 0:
-            ref_df = pd.DataFrame(data, columns=column_names)
+            ref_ids = pd.DataFrame(data, columns=column_names).id
 
-        if pd_valid(ref_df):
-            df_new = df[~df.id.isin(ref_df.id)]
-        else:
-            df_new = df
+    if ref_ids is not None and len(ref_ids) > 0:
+        df_new = df[~df.id.isin(ref_ids)]
+    else:
+        df_new = df
 
-        # 不能单靠ID决定是否新增，要全量比对
-        # if fix_duplicate_way == 'add':
-        #     df_add = df[df.id.isin(ref_df.id)]
-        #     if not df_add.empty:
-        #         df_add.id = uuid.uuid1()
-        #         df_new = pd.concat([df_new, df_add])
+    # 不能单靠ID决定是否新增，要全量比对
+    # if fix_duplicate_way == 'add':
+    #     df_add = df[df.id.isin(ref_df.id)]
+    #     if not df_add.empty:
+    #         df_add.id = uuid.uuid1()
+    #         df_new = pd.concat([df_new, df_add])
 
     rmdup = time.time()
     cost = PRECISION_STR.format(rmdup - now)
@@ -102,7 +134,18 @@ async def df_to_db(region: Region,
 
     saved = 0
     if pd_valid(df_new):
-        saved = to_postgresql(region, df_new, data_schema.__tablename__)
+        if use_async:
+            saved = await to_postgresql_async(region, df_new, tablename, data_schema=data_schema, checkpoints=checkpoints, raise_error=raise_error)
+        else:
+            saved = to_postgresql(region, df_new, tablename, data_schema=data_schema, checkpoints=checkpoints, raise_error=raise_error)
+    else:
+        # all saved before, the checkpoints still move forward
+        if use_async:
+            await save_outcomes_async(region, checkpoints)
+        else:
+            save_outcomes(region, checkpoints)
+
+    record(tablename, 'COPY insert', time.time() - rmdup, saved)
 
     cost = PRECISION_STR.format(time.time() - rmdup)
     logger.debug(f"write db: {cost}, size: {saved}")
@@ -110,34 +153,366 @@ async def df_to_db(region: Region,
     return saved
 
 
-def to_postgresql(region: Region, df, tablename):
-    # now = time.time()
+class PersistBuffer(object):
+    """
+    write-behind buffer of one table, coalesce the frames of many entities into one upsert,
+    flush when the row count, byte size or age threshold is reached
+    """
+
+    def __init__(self,
+                 region: Region,
+                 provider: Provider,
+                 data_schema: DeclarativeMeta,
+                 db_session,
+                 max_rows: int = 100000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 max_age: float = 30,
+                 checkpoint: bool = False,
+                 force_update: bool = False) -> None:
+        self.region = region
+        self.provider = provider
+        self.data_schema = data_schema
+        self.db_session = db_session
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.checkpoint = checkpoint
+        # update the rows already saved instead of keeping them
+        self.force_update = force_update
+
+        # (frame, on_commit, on_error) held until the flush taking them commits
+        self.frames = []
+        self.rows = 0
+        self.bytes = 0
+        self.first_put = None
+
+        # held while flushing, producers calling put wait on it, that is the backpressure
+        self.lock = asyncio.Lock()
+
+    def is_full(self) -> bool:
+        return self.rows >= self.max_rows or self.bytes >= self.max_bytes
+
+    def is_stale(self) -> bool:
+        return self.first_put is not None and time.time() - self.first_put >= self.max_age
+
+    def hold(self, df: pd.DataFrame, on_commit=None, on_error=None):
+        self.frames.append((df, on_commit, on_error))
+        self.rows += len(df)
+        self.bytes += int(df.memory_usage(index=False, deep=True).sum())
+        if self.first_put is None:
+            self.first_put = time.time()
+
+    async def put(self, df: pd.DataFrame, on_commit=None, on_error=None) -> int:
+        """
+        hold the frame for the next flush, on_commit is called once it is committed,
+        on_error(error) when it could not be written, a failing frame never holds back the others,
+        when it is the frame of this put the error is raised to the caller instead
+        """
+        if not pd_valid(df):
+            return 0
+
+        async with self.lock:
+            self.hold(df, on_commit, on_error)
+
+            if self.is_full() or self.is_stale():
+                await self._flush(current=df)
+
+        return len(df)
+
+    async def flush(self) -> int:
+        async with self.lock:
+            return await self._flush()
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.max_age)
+            if self.is_stale():
+                await self.flush()
+
+    async def write(self, frames) -> int:
+        return await df_to_db(region=self.region,
+                              provider=self.provider,
+                              data_schema=self.data_schema,
+                              db_session=self.db_session,
+                              df=pd.concat([frame for frame, _, _ in frames], ignore_index=True),
+                              force_update=self.force_update,
+                              upsert=True,
+                              checkpoint=self.checkpoint,
+                              raise_error=True)
+
+    async def _flush(self, current=None) -> int:
+        if not self.frames:
+            return 0
+
+        now = time.time()
+        frames = self.frames
+        self.frames = []
+        self.rows = 0
+        self.bytes = 0
+        self.first_put = None
+
+        committed, failed = frames, []
+        try:
+            saved = await self.write(frames)
+        except Exception as e:
+            # one bad frame (a COPY or constraint error) fails the whole upsert, find it by writing them one by one
+            logger.warning(f"flush {self.data_schema.__tablename__} failed with error: {e}, writing {len(frames)} frames one by one")
+            saved, committed = 0, []
+            for frame in frames:
+                try:
+                    saved += await self.write([frame])
+                    committed.append(frame)
+                except Exception as error:
+                    failed.append((frame, error))
+
+        for _, on_commit, _ in committed:
+            if on_commit is not None:
+                on_commit()
+
+        current_error = None
+        for (df, _, on_error), error in failed:
+            if df is current:
+                current_error = error
+            elif on_error is not None:
+                on_error(error)
+            else:
+                logger.error(f"flush {self.data_schema.__tablename__} dropped {len(df)} rows, error: {error}")
+
+        rows = sum(len(frame) for frame, _, _ in committed)
+        cost = PRECISION_STR.format(time.time() - now)
+        logger.info(f"flush {self.data_schema.__tablename__}, frames: {len(committed)}, size: {saved}, skipped: {rows - saved}, "
+                    f"failed: {len(failed)}, cost: {cost}")
+
+        if current_error is not None:
+            raise current_error
+        return saved
+
+
+def copy_df(cursor, df, tablename, data_schema=None):
+    columns = list(df.columns)
+
+    # binary copy skips rendering floats and timestamps as text, encode chunk by chunk
+    if data_schema is not None and findy_config.get('copy_format', 'text') == 'binary':
+        column_types = get_schema_column_types(data_schema)
+        if all(is_binary_supported(column_types[col]) for col in columns):
+            sql = f"COPY {tablename} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)"
+            cursor.copy_expert(sql, BinaryCopyStream(df, column_types), size=1024 * 64)
+            return
 
-    saved = len(df)
     output = StringIO()
     df.to_csv(output, sep='\t', index=False, header=False, encoding='utf-8')
     output.seek(0)
+    cursor.copy_from(output, tablename, null='', size=1024 * 16, columns=columns)
+
 
-    # to_csv_time = time.time()
-    # cost = PRECISION_STR.format(to_csv_time - now)
-    # logger.debug(f"dataFrame to IO: {cost}, size: {saved}")
+def to_postgresql(region: Region, df, tablename, data_schema=None, checkpoints=None, raise_error=False):
+    saved = len(df)
 
     db_engine = get_db_engine(region)
     connection = db_engine.raw_connection()
     cursor = connection.cursor()
-    cursor.copy_from(output, tablename, null='', size=1024 * 16, columns=list(df.columns))
-    try:        
+    try:
+        copy_df(cursor, df, tablename, data_schema=data_schema)
+        write_checkpoints(cursor, checkpoints)
         connection.commit()
     except Exception as e:
         logger.error(f'copy_from failed on table: [ {tablename} ], {e}')
         connection.rollback()
+        if raise_error:
+            raise
+        saved = 0
+    finally:
+        cursor.close()
+        connection.close()
+
+    return saved
+
+
+def conflict_columns(region: Region, tablename):
+    # partitioned tables carry (id, timestamp) as primary key, see findy.database.partition
+    if findy_config.get('kdata_partition', False):
+        from findy.database.partition import is_partitioned
+        if is_partitioned(region, tablename):
+            return ['id', 'timestamp']
+    return ['id']
+
+
+def upsert_sql(tablename, staging, columns, update=False, conflict_cols=['id']):
+    col_str = ', '.join(columns)
+
+    if update:
+        update_str = ', '.join([f'{col} = EXCLUDED.{col}' for col in columns if col not in conflict_cols])
+        conflict = f'DO UPDATE SET {update_str}' if update_str else 'DO NOTHING'
+    else:
+        conflict = 'DO NOTHING'
+
+    # temp table is private to the connection and dropped on commit
+    create = f"CREATE TEMP TABLE {staging} (LIKE {tablename} INCLUDING DEFAULTS) ON COMMIT DROP"
+    insert = f"INSERT INTO {tablename} ({col_str}) SELECT {col_str} FROM {staging} ON CONFLICT ({', '.join(conflict_cols)}) {conflict}"
+    return create, insert
+
+
+def to_postgresql_upsert(region: Region, df, tablename, update=False, data_schema=None, checkpoints=None, raise_error=False):
+    staging = f'{tablename}_staging'
+    create, insert = upsert_sql(tablename, staging, list(df.columns), update=update,
+                                conflict_cols=conflict_columns(region, tablename))
+
+    db_engine = get_db_engine(region)
+    connection = db_engine.raw_connection()
+    cursor = connection.cursor()
+
+    saved = 0
+    try:
+        cursor.execute(create)
+        copy_df(cursor, df, staging, data_schema=data_schema)
+        cursor.execute(insert)
+        saved = cursor.rowcount
+        write_checkpoints(cursor, checkpoints)
+        connection.commit()
+    except Exception as e:
+        logger.error(f'upsert failed on table: [ {tablename} ], {e}')
+        connection.rollback()
+        if raise_error:
+            raise
+        saved = 0
+    finally:
+        cursor.close()
+        connection.close()
+
+    return saved
+
+
+def replace_time_bound(region: Region, df, tablename):
+    # bound the delete by the frame's time range, partitions outside are pruned
+    if 'timestamp' in df.columns and conflict_columns(region, tablename) != ['id']:
+        return df['timestamp'].min(), df['timestamp'].max()
+    return None
+
+
+def to_postgresql_replace(region: Region, df, tablename, data_schema=None, chunk_size=10000, checkpoints=None, raise_error=False):
+    ids = df['id'].tolist()
+    saved = len(df)
+    bound = replace_time_bound(region, df, tablename)
+
+    db_engine = get_db_engine(region)
+    connection = db_engine.raw_connection()
+    cursor = connection.cursor()
+    try:
+        # ids are bound as an array parameter, sql text stays small whatever the frame size
+        for start in range(0, len(ids), chunk_size):
+            if bound is not None:
+                cursor.execute(f"DELETE FROM {tablename} WHERE id = ANY(%s) AND timestamp BETWEEN %s AND %s",
+                               (ids[start:start + chunk_size], *bound))
+            else:
+                cursor.execute(f"DELETE FROM {tablename} WHERE id = ANY(%s)", (ids[start:start + chunk_size],))
+        copy_df(cursor, df, tablename, data_schema=data_schema)
+        write_checkpoints(cursor, checkpoints)
+        connection.commit()
+    except Exception as e:
+        logger.error(f'replace failed on table: [ {tablename} ], {e}')
+        connection.rollback()
+        if raise_error:
+            raise
+        saved = 0
     finally:
         cursor.close()
         connection.close()
-    
-    # to_db_time = time.time()
-    # cost = PRECISION_STR.format(to_db_time - to_csv_time)
-    # logger.debug(f"write to db: {cost}, size: {saved}")
+
+    return saved
+
+
+async def copy_df_async(connection, df, tablename, data_schema=None):
+    columns = list(df.columns)
+
+    # asyncpg speaks binary copy natively, reuse the chunked encoder when the types allow it
+    if data_schema is not None:
+        column_types = get_schema_column_types(data_schema)
+        if all(is_binary_supported(column_types[col]) for col in columns):
+            async def source():
+                for chunk in iter_copy_chunks(df, column_types):
+                    yield chunk
+
+            await connection.copy_to_table(tablename, source=source(), columns=columns, format='binary')
+            return
+
+    records = df.astype(object).where(pd.notna(df), None).itertuples(index=False, name=None)
+    await connection.copy_records_to_table(tablename, records=list(records), columns=columns)
+
+
+async def get_saved_ids_async(region: Region, tablename, entity_id=None):
+    pool = await get_db_async_pool(region)
+    async with pool.acquire() as connection:
+        if entity_id is not None:
+            rows = await connection.fetch(f"SELECT id FROM {tablename} WHERE entity_id = $1", entity_id)
+        else:
+            rows = await connection.fetch(f"SELECT id FROM {tablename}")
+    return pd.Series([row['id'] for row in rows], dtype=object)
+
+
+async def to_postgresql_async(region: Region, df, tablename, data_schema=None, checkpoints=None, raise_error=False):
+    saved = len(df)
+
+    pool = await get_db_async_pool(region)
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await copy_df_async(connection, df, tablename, data_schema=data_schema)
+                await write_checkpoints_async(connection, checkpoints)
+    except Exception as e:
+        logger.error(f'copy failed on table: [ {tablename} ], {e}')
+        if raise_error:
+            raise
+        saved = 0
+
+    return saved
+
+
+async def to_postgresql_upsert_async(region: Region, df, tablename, update=False, data_schema=None, checkpoints=None, raise_error=False):
+    staging = f'{tablename}_staging'
+    create, insert = upsert_sql(tablename, staging, list(df.columns), update=update,
+                                conflict_cols=conflict_columns(region, tablename))
+
+    pool = await get_db_async_pool(region)
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(create)
+                await copy_df_async(connection, df, staging, data_schema=data_schema)
+                status = await connection.execute(insert)
+                await write_checkpoints_async(connection, checkpoints)
+        # status tag looks like 'INSERT 0 <rows>'
+        saved = int(status.split()[-1])
+    except Exception as e:
+        logger.error(f'upsert failed on table: [ {tablename} ], {e}')
+        if raise_error:
+            raise
+        saved = 0
+
+    return saved
+
+
+async def to_postgresql_replace_async(region: Region, df, tablename, data_schema=None, chunk_size=10000, checkpoints=None, raise_error=False):
+    ids = df['id'].tolist()
+    saved = len(df)
+    bound = replace_time_bound(region, df, tablename)
+
+    pool = await get_db_async_pool(region)
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                for start in range(0, len(ids), chunk_size):
+                    if bound is not None:
+                        await connection.execute(f"DELETE FROM {tablename} WHERE id = ANY($1::text[]) AND timestamp BETWEEN $2 AND $3",
+                                                 ids[start:start + chunk_size], *[b.to_pydatetime() for b in bound])
+                    else:
+                        await connection.execute(f"DELETE FROM {tablename} WHERE id = ANY($1::text[])", ids[start:start + chunk_size])
+                await copy_df_async(connection, df, tablename, data_schema=data_schema)
+                await write_checkpoints_async(connection, checkpoints)
+    except Exception as e:
+        logger.error(f'replace failed on table: [ {tablename} ], {e}')
+        if raise_error:
+            raise
+        saved = 0
 
     return saved
 
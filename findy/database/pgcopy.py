@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import enum
+import io
+import struct
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import types as sqltypes
+
+# postgresql binary copy format, see https://www.postgresql.org/docs/current/sql-copy.html
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_TRAILER = struct.pack('>h', -1)
+
+# rows encoded per chunk, bound the memory used by one frame
+COPY_CHUNK_ROWS = 10000
+
+# postgres epoch (2000-01-01) in unix microseconds
+PG_EPOCH_US = 946684800000000
+
+
+def _fixed_dtype(col_type):
+    # order matters, BigInteger and SmallInteger are subclasses of Integer
+    if isinstance(col_type, sqltypes.BigInteger):
+        return '>i8'
+    if isinstance(col_type, sqltypes.SmallInteger):
+        return '>i2'
+    if isinstance(col_type, sqltypes.Integer):
+        return '>i4'
+    if isinstance(col_type, sqltypes.Float):
+        return '>f8'
+    if isinstance(col_type, sqltypes.Boolean):
+        return '?'
+    if isinstance(col_type, sqltypes.DateTime):
+        return '>i8'
+    return None
+
+
+def is_binary_supported(col_type) -> bool:
+    return _fixed_dtype(col_type) is not None or isinstance(col_type, (sqltypes.String, sqltypes.Enum))
+
+
+def _encode_fixed(series: pd.Series, col_type):
+    null = series.isna().values
+    dtype = _fixed_dtype(col_type)
+
+    if isinstance(col_type, sqltypes.DateTime):
+        values = pd.to_datetime(series)
+        if values.dt.tz is not None:
+            # timestamp without time zone, keep the wall clock like text copy does
+            values = values.dt.tz_localize(None)
+        values = values.values.astype('datetime64[us]').astype(np.int64) - PG_EPOCH_US
+    elif isinstance(col_type, sqltypes.Boolean):
+        values = series.where(~null, False).astype(bool).values
+    elif isinstance(col_type, sqltypes.Integer):
+        values = series.where(~null, 0).astype(np.int64).values
+    else:
+        values = series.astype(np.float64).values
+
+    width = np.dtype(dtype).itemsize
+    payload = np.ascontiguousarray(values.astype(dtype)).view(np.uint8).reshape(len(series), width)
+    lengths = np.where(null, -1, width).astype(np.int64)
+    return lengths, payload[~null].reshape(-1)
+
+
+def _encode_text(series: pd.Series):
+    null = series.isna().values
+    # enum members are stored by value, str() would give 'Class.MEMBER'
+    encoded = [str(v.value if isinstance(v, enum.Enum) else v).encode('utf-8') for v in series.values[~null]]
+
+    lengths = np.full(len(series), -1, dtype=np.int64)
+    lengths[~null] = [len(b) for b in encoded]
+    return lengths, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def encode_rows(df: pd.DataFrame, column_types: dict) -> bytes:
+    """
+    encode the rows of df as postgresql binary copy tuples, without header and trailer
+
+    :param df: frame to encode, columns must be keys of column_types
+    :param column_types: column name -> sqlalchemy column type
+    """
+    rows = len(df)
+    if rows == 0:
+        return b''
+
+    columns = []
+    for col in df.columns:
+        col_type = column_types[col]
+        if _fixed_dtype(col_type) is not None:
+            columns.append(_encode_fixed(df[col], col_type))
+        else:
+            columns.append(_encode_text(df[col]))
+
+    # row layout: int16 field count, then int32 length + payload for every field
+    row_sizes = np.full(rows, 2, dtype=np.int64)
+    for lengths, _ in columns:
+        row_sizes += 4 + np.maximum(lengths, 0)
+
+    row_starts = np.zeros(rows, dtype=np.int64)
+    np.cumsum(row_sizes[:-1], out=row_starts[1:])
+
+    buf = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+
+    field_count = np.frombuffer(struct.pack('>h', len(columns)), dtype=np.uint8)
+    buf[row_starts[:, None] + np.arange(2)] = field_count
+
+    pos = row_starts + 2
+    for lengths, payload in columns:
+        header = lengths.astype('>i4').view(np.uint8).reshape(rows, 4)
+        buf[pos[:, None] + np.arange(4)] = header
+
+        sizes = np.maximum(lengths, 0)
+        total = int(sizes.sum())
+        if total > 0:
+            starts = pos + 4
+            # scatter the concatenated payload to each row's slot
+            offsets = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            buf[np.repeat(starts, sizes) + offsets] = payload
+
+        pos = pos + 4 + sizes
+
+    return buf.tobytes()
+
+
+def iter_copy_chunks(df: pd.DataFrame, column_types: dict, chunk_rows: int = COPY_CHUNK_ROWS):
+    yield COPY_HEADER
+    for start in range(0, len(df), chunk_rows):
+        yield encode_rows(df.iloc[start:start + chunk_rows], column_types)
+    yield COPY_TRAILER
+
+
+class BinaryCopyStream(io.RawIOBase):
+    """
+    file-like reader over the binary copy chunks of a frame, feed it to cursor.copy_expert,
+    only one chunk is materialized at a time
+    """
+
+    def __init__(self, df: pd.DataFrame, column_types: dict, chunk_rows: int = COPY_CHUNK_ROWS):
+        self._chunks = iter_copy_chunks(df, column_types, chunk_rows)
+        self._buffer = b''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size < 0 or size > 0:
+            if self._offset >= len(self._buffer):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buffer, self._offset = chunk, 0
+
+            end = len(self._buffer) if size < 0 else min(len(self._buffer), self._offset + size)
+            parts.append(self._buffer[self._offset:end])
+            if size > 0:
+                size -= end - self._offset
+            self._offset = end
+
+        return b''.join(parts)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
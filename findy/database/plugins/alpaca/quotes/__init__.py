@@ -11,8 +11,6 @@ from findy.database.schema.quotes.stock.stock_15m_kdata import ofmKdataBase
 from findy.database.schema.quotes.stock.stock_5m_kdata import fmKdataBase
 from findy.database.schema.quotes.stock.stock_1m_kdata import mKdataBase
 from findy.database.schema.register import register_schema
-from findy.database.plugins.alpaca.quotes.alpaca_index_kdata_recorder import *
-from findy.database.plugins.alpaca.quotes.alpaca_stock_kdata_recorder import *
 
 
 register_schema(Region.US,
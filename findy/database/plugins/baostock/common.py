@@ -1,7 +1,28 @@
 # -*- coding: utf-8 -*-
+import threading
+
 from findy.interface import ChnExchange, EntityType
 from findy.database.schema import IntervalLevel, AdjustType
 
+# baostock keeps one login per process, done by the first query instead of the import
+__login_lock = threading.Lock()
+__logged_in = False
+
+
+def bao_login():
+    global __logged_in
+    if __logged_in:
+        return
+
+    import findy.vendor.baostock as bs
+    with __login_lock:
+        if not __logged_in:
+            try:
+                bs.login()
+                __logged_in = True
+            except:
+                pass
+
 
 def to_bao_trading_level(trading_level: IntervalLevel):
 
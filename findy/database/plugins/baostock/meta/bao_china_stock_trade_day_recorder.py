@@ -12,11 +12,9 @@ from findy.database.persist import df_to_db
 from findy.utils.time import PD_TIME_FORMAT_DAY, to_time_str
 from findy.utils.pd import pd_valid
 
+from findy.database.plugins.baostock.common import bao_login
+
 import findy.vendor.baostock as bs
-try:
-    bs.login()
-except:
-    pass
 
 
 class BaoChinaStockTradeDayRecorder(RecorderForEntities):
@@ -36,6 +34,7 @@ class BaoChinaStockTradeDayRecorder(RecorderForEntities):
 
     def bao_get_trade_days(self, start_date=None, end_date=None):
         def _bao_get_trade_days(start_date=None, end_date=None):
+            bao_login()
             k_rs = bs.query_trade_dates(start_date=start_date, end_date=end_date)
             return k_rs.get_data()
 
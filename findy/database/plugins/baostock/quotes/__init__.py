@@ -10,7 +10,6 @@ from findy.database.schema.quotes.stock.stock_15m_kdata import ofmKdataBase
 from findy.database.schema.quotes.stock.stock_5m_kdata import fmKdataBase
 from findy.database.schema.quotes.stock.stock_1m_kdata import mKdataBase
 from findy.database.schema.register import register_schema
-from findy.database.plugins.baostock.quotes.bao_china_stock_kdata_recorder import *
 
 
 register_schema(Region.CHN,
@@ -11,16 +11,15 @@ from findy.database.schema.meta.stock_meta import Stock
 from findy.database.schema.datatype import StockKdataCommon
 from findy.database.recorder import KDataRecorder
 from findy.database.plugins.baostock.common import to_bao_trading_level, to_bao_entity_id, \
-                                                          to_bao_trading_field, to_bao_adjust_flag
+                                                          to_bao_trading_field, to_bao_adjust_flag, bao_login
 from findy.database.quote import get_entities
 from findy.utils.pd import pd_valid
+from findy.utils.retry import is_transient
 from findy.utils.time import PD_TIME_FORMAT_DAY, PD_TIME_FORMAT_ISO8601, to_time_str
 
 import findy.vendor.baostock as bs
-try:
-    bs.login()
-except:
-    pass
+
+BSERR_NETWORK_PREFIX = '10002'
 
 
 class BaoChinaStockKdataRecorder(KDataRecorder):
@@ -77,8 +76,12 @@ class BaoChinaStockKdataRecorder(KDataRecorder):
                      fields="date, code, open, high, low, close, preclose, volume, amount, adjustflag, turn, tradestatus, pctChg, isST"):
 
         def _bao_get_bars(code, start, end, frequency, adjustflag, fields):
+            bao_login()
             k_rs = bs.query_history_k_data_plus(code, start_date=start, end_date=end, frequency=frequency,
                                                 adjustflag=adjustflag, fields=fields)
+            # baostock reports socket failures as error codes 10002xxx, not as exceptions
+            if k_rs.error_code.startswith(BSERR_NETWORK_PREFIX):
+                raise ConnectionError(f'{k_rs.error_code}: {k_rs.error_msg}')
             return k_rs.get_data()
 
         self.logger.debug("HTTP GET: bars, with code={}, unit={}, start={}, end={}".format(code, frequency, start, end))
@@ -86,6 +89,9 @@ class BaoChinaStockKdataRecorder(KDataRecorder):
             return _bao_get_bars(code, start, end, frequency, adjustflag, fields)
         except Exception as e:
             self.logger.error(f'bao_get_bars, frequency: {frequency}, code: {code}, error: {e}')
+            # the provider did not answer, the run queues the entity again instead of finishing it empty
+            if is_transient(e):
+                raise
         return None
 
     async def record(self, entity, http_session, db_session, para):
@@ -108,7 +114,7 @@ class BaoChinaStockKdataRecorder(KDataRecorder):
         # await asyncio.sleep(0.005)
         
         if pd_valid(df):
-            return False, time.time() - start_point, self.format(entity, df)
+            return False, time.time() - start_point, df
 
         return True, time.time() - start_point, None
 
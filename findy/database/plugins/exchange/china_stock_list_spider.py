@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import io
 import time
-import msgpack
 
 import pandas as pd
 
@@ -10,8 +9,6 @@ from findy.database.schema.meta.stock_meta import Stock, StockDetail
 from findy.database.recorder import RecorderForEntities
 from findy.database.persist import df_to_db
 from findy.database.context import get_db_session
-from findy.utils.kafka import publish_message
-from findy.utils.progress import progress_topic, progress_key
 from findy.utils.request import chrome_copy_header_to_dict
 from findy.utils.pd import pd_valid
 from findy.utils.time import to_pd_timestamp
@@ -65,7 +62,7 @@ class ExchangeChinaStockListRecorder(RecorderForEntities):
     def get_original_time_field(self):
         return 'list_date'
 
-    async def process_loop(self, entity, pbar_update, http_session, db_session, kafka_producer, throttler):
+    async def process_loop(self, entity, pbar_update, http_session, db_session, progress, throttler):
         url = self.category_map_url.get(entity, None)
         if url is None:
             return
@@ -83,7 +80,7 @@ class ExchangeChinaStockListRecorder(RecorderForEntities):
                     await self.persist(df, db_session)
 
             pbar_update["update"] = 1
-            publish_message(kafka_producer, progress_topic, progress_key,  msgpack.dumps(pbar_update))
+            progress.update(pbar_update)
 
     def format(self, resp, exchange):
         df = None
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import time
-import msgpack
 
 import pandas as pd
 
@@ -9,8 +8,6 @@ from findy.database.schema.meta.stock_meta import Stock, StockDetail
 from findy.database.recorder import RecorderForEntities
 from findy.database.persist import df_to_db
 from findy.database.context import get_db_session
-from findy.utils.kafka import publish_message
-from findy.utils.progress import progress_topic, progress_key
 from findy.utils.time import to_pd_timestamp
 
 YAHOO_STOCK_LIST_HEADER = {
@@ -41,7 +38,7 @@ class ExchangeUsStockListRecorder(RecorderForEntities):
     def get_original_time_field(self):
         return 'list_date'
 
-    async def process_loop(self, entity, pbar_update, http_session, db_session, kafka_producer, throttler):
+    async def process_loop(self, entity, pbar_update, http_session, db_session, progress, throttler):
         url = 'https://api.nasdaq.com/api/screener/stocks'
         params = {'download': 'true', 'exchange': entity}
 
@@ -56,7 +53,7 @@ class ExchangeUsStockListRecorder(RecorderForEntities):
             self.logger.info(f"persist {entity} stock list failed with error: {e}")
 
         pbar_update["update"] = 1
-        publish_message(kafka_producer, progress_topic, progress_key, msgpack.dumps(pbar_update))
+        progress.update(pbar_update)
 
     def format(self, content, exchange):
         df = pd.DataFrame(content)
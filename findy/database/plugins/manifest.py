@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import importlib
+import logging
+
+from findy.interface import Region, Provider
+
+logger = logging.getLogger(__name__)
+
+# (region, provider, data_schema name of the recorder) -> module defining the recorder,
+# the module is imported by the first record_data asking for it, its recorder registers on import,
+# schemas subclassing the data_schema (the kdata levels) resolve through their bases
+recorder_modules = {
+    (Region.CHN, Provider.BaoStock, 'StockTradeDay'): 'findy.database.plugins.baostock.meta.bao_china_stock_trade_day_recorder',
+    (Region.CHN, Provider.BaoStock, 'StockKdataCommon'): 'findy.database.plugins.baostock.quotes.bao_china_stock_kdata_recorder',
+    (Region.CHN, Provider.Exchange, 'IndexStock'): 'findy.database.plugins.exchange.china_index_list_spider',
+    (Region.CHN, Provider.Exchange, 'Stock'): 'findy.database.plugins.exchange.china_stock_list_spider',
+    (Region.CHN, Provider.Exchange, 'StockSummary'): 'findy.database.plugins.exchange.china_stock_summary',
+    (Region.CHN, Provider.TuShare, 'StockDetail'): 'findy.database.plugins.tu_share.meta.china_stock_meta_recorder',
+    (Region.US, Provider.Exchange, 'Stock'): 'findy.database.plugins.exchange.us_stock_list_spider',
+    (Region.US, Provider.Yahoo, 'BalanceSheet'): 'findy.database.plugins.yahoo.finance.us_stock_balance_sheet_recorder',
+    (Region.US, Provider.Yahoo, 'StockDetail'): 'findy.database.plugins.yahoo.meta.us_stock_meta_recorder',
+    (Region.US, Provider.Yahoo, 'StockTradeDay'): 'findy.database.plugins.yahoo.meta.us_stock_trade_day_recorder',
+    (Region.US, Provider.Yahoo, 'IndexKdataCommon'): 'findy.database.plugins.yahoo.quotes.yahoo_index_kdata_recorder',
+    (Region.US, Provider.Yahoo, 'StockKdataCommon'): 'findy.database.plugins.yahoo.quotes.yahoo_stock_kdata_recorder',
+}
+
+
+def load_recorder(region: Region, provider: Provider, data_schema) -> bool:
+    """
+    import the module of the recorder of data_schema, False when the manifest has none
+    """
+    for cls in data_schema.__mro__:
+        module = recorder_modules.get((region, provider, cls.__name__))
+        if module is not None:
+            logger.debug(f'loading recorder of {data_schema.__name__}: {module}')
+            importlib.import_module(module)
+            return True
+    return False
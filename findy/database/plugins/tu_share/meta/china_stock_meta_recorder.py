@@ -12,7 +12,15 @@ from findy.database.persist import df_to_db
 from findy.utils.time import to_pd_timestamp
 from findy.utils.pd import pd_valid
 
-pro = ts.pro_api(findy_config['tushare_token'])
+# tushare client, created by the first query instead of the import
+pro = None
+
+
+def get_pro():
+    global pro
+    if pro is None:
+        pro = ts.pro_api(findy_config['tushare_token'])
+    return pro
 
 
 class TushareChinaStockDetailRecorder(RecorderForEntities):
@@ -31,8 +39,8 @@ class TushareChinaStockDetailRecorder(RecorderForEntities):
 
     def tushare_get_info(self, exchange):
         try:
-            df_basic = pro.stock_basic(exchange=exchange)
-            df_detail = pro.stock_company(exchange=exchange)
+            df_basic = get_pro().stock_basic(exchange=exchange)
+            df_detail = get_pro().stock_company(exchange=exchange)
             combine_df = pd.merge(df_basic, df_detail, on=['ts_code'])
             # combine_df = df_basic.join(df_detail, on='ts_code')
             return combine_df
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 from findy.database.schema import IntervalLevel, ReportPeriod
 
+# hosts the circuit breakers are kept for, chart api and the fundamentals behind yfinance
+yahoo_chart_host = 'query1.finance.yahoo.com'
+yahoo_fundamental_host = 'query2.finance.yahoo.com'
+
 
 def to_yahoo_trading_level(trading_level: IntervalLevel):
     if trading_level < IntervalLevel.LEVEL_1HOUR:
@@ -2,7 +2,6 @@
 from findy.interface import Region, Provider, EntityType
 from findy.database.schema.fundamental.finance import FinanceBase
 from findy.database.schema.register import register_schema
-from findy.database.plugins.yahoo.finance.us_stock_balance_sheet_recorder import *
 
 
 register_schema(Region.US,
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+import asyncio
 import time
 
 import pandas as pd
@@ -9,8 +10,9 @@ from yfinance import Ticker
 from findy.interface import Region, Provider, UsExchange, EntityType
 from findy.database.schema.fundamental.finance import BalanceSheet
 from findy.database.recorder import TimestampsDataRecorder
-from findy.database.plugins.yahoo.common import to_report_period_type
+from findy.database.plugins.yahoo.common import to_report_period_type, yahoo_fundamental_host
 from findy.utils.pd import pd_valid
+from findy.utils.retry import get_retry_policy
 
 
 balance_sheet_map = {
@@ -456,26 +458,25 @@ class UsStockBalanceSheetRecorder(TimestampsDataRecorder):
                          codes=codes,
                          share_para=share_para)
 
-    def yh_get_balance_sheet(self, code):
-        retry = 3
-        error_msg = None
+    async def yh_get_balance_sheet(self, code):
+        loop = asyncio.get_event_loop()
 
-        for _ in range(retry):
-            try:
-                return Ticker(code).balance_sheet
-            except Exception as e:
-                msg = str(e)
-                error_msg = f'yh_get_balance_sheet, code: {code}, error: {msg}'
-                time.sleep(60 * 10)
+        async def fetch():
+            # yfinance blocks, keep it off the event loop
+            return await loop.run_in_executor(None, lambda: Ticker(code).balance_sheet)
 
-        self.logger.error(error_msg)
-        return None
+        try:
+            # yfinance raises the requests errors, only network failures and 429 / 5xx answers are retried
+            return await get_retry_policy(self.provider.value).call(fetch, host=yahoo_fundamental_host)
+        except Exception as e:
+            self.logger.error(f'yh_get_balance_sheet, code: {code}, error: {e}')
+            return None
 
-    def record(self, entity, http_session, db_session, para):
+    async def record(self, entity, http_session, db_session, para):
         start_point = time.time()
 
         # get stock info
-        balance_sheet = self.yh_get_balance_sheet(entity.code)
+        balance_sheet = await self.yh_get_balance_sheet(entity.code)
 
         if balance_sheet is None or len(balance_sheet) == 0:
             return True, time.time() - start_point, None
@@ -3,8 +3,6 @@ from findy.interface import Region, Provider
 from findy.database.schema.meta.stock_meta import StockMetaBase
 from findy.database.schema.quotes.trade_day import TradeDayBase
 from findy.database.schema.register import register_schema
-from findy.database.plugins.yahoo.meta.us_stock_meta_recorder import *
-from findy.database.plugins.yahoo.meta.us_stock_trade_day_recorder import *
 
 
 register_schema(Region.US,
@@ -9,10 +9,11 @@ from findy.database.schema import IntervalLevel, AdjustType
 from findy.database.schema.meta.stock_meta import Index
 from findy.database.schema.datatype import IndexKdataCommon
 from findy.database.recorder import KDataRecorder
-from findy.database.plugins.yahoo.common import to_yahoo_trading_level
+from findy.database.plugins.yahoo.common import to_yahoo_trading_level, yahoo_chart_host
 from findy.utils.pd import pd_valid
 from findy.utils.time import PD_TIME_FORMAT_DAY, PD_TIME_FORMAT_ISO8601, to_time_str
 from findy.utils.fetch_apis.yahoo import Yahoo
+from findy.utils.retry import CircuitOpenError, get_retry_policy, is_transient
 
 
 class YahooUsIndexKdataRecorder(KDataRecorder):
@@ -51,31 +52,27 @@ class YahooUsIndexKdataRecorder(KDataRecorder):
         return entity.id + '_' + df[self.get_evaluated_time_field()].dt.strftime(format)
 
     async def yh_get_bars(self, http_session, entity, start=None, end=None, enable_proxy=False):
-        retry = 3
-        error_msg = None
-
-        for _ in range(retry):
-            try:
-                code = entity.code
-                if self.level < IntervalLevel.LEVEL_1DAY:
-                    df, msg = await Yahoo.fetch(http_session, 'US/Eastern', code, interval=to_yahoo_trading_level(self.level), period="3mon")
-                else:
-                    df, msg = await Yahoo.fetch(http_session, 'US/Eastern', code, interval=to_yahoo_trading_level(self.level), start=start, end=end)
-                if isinstance(msg, str) and "symbol may be delisted" in msg:
-                    entity.is_active = False
-                return df
-            except Exception as e:
-                msg = str(e)
-                error_msg = f'yh_get_bars, code: {code}, interval: {self.level.value}, error: {msg}'
-                if isinstance(msg, str) and ("Server disconnected" in msg or
-                                             "Cannot connect to host" in msg or
-                                             "Internal Privoxy Error" in msg):
-                    await self.sleep(60 * 10)
-                else:
-                    break
-
-        self.logger.error(error_msg)
-        return None
+        code = entity.code
+        interval = to_yahoo_trading_level(self.level)
+
+        async def fetch():
+            if self.level < IntervalLevel.LEVEL_1DAY:
+                return await Yahoo.fetch(http_session, 'US/Eastern', code, interval=interval, period="3mon")
+            return await Yahoo.fetch(http_session, 'US/Eastern', code, interval=interval, start=start, end=end)
+
+        # connection errors are retried with backoff, a failing host sheds the calls at once
+        try:
+            df, msg = await get_retry_policy(self.provider.value).call(fetch, host=yahoo_chart_host)
+        except Exception as e:
+            self.logger.error(f'yh_get_bars, code: {code}, interval: {self.level.value}, error: {e}')
+            # the provider did not answer, the run queues the entity again instead of finishing it empty
+            if is_transient(e) or isinstance(e, CircuitOpenError):
+                raise
+            return None
+
+        if isinstance(msg, str) and "symbol may be delisted" in msg:
+            entity.is_active = False
+        return df
 
     async def record(self, entity, http_session, db_session, para):
         start_point = time.time()
@@ -86,7 +83,7 @@ class YahooUsIndexKdataRecorder(KDataRecorder):
         df = await self.yh_get_bars(http_session, entity, start=start, end=end_timestamp)
 
         if pd_valid(df):
-            return False, time.time() - start_point, self.format(entity, df)
+            return False, time.time() - start_point, df
 
         return True, time.time() - start_point, None
 
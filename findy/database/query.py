@@ -2,21 +2,25 @@
 import logging
 from typing import List, Union
 # import time
+import numpy as np
 import pandas as pd
 
+from sqlalchemy import types as sqltypes
 from sqlalchemy.orm import Query
 
 # from findy import findy_config
 from findy.interface import Region, Provider
 from findy.database.schema import IntervalLevel
 from findy.database.schema.register import providers
-# from findy.database.context import  profiled
 # from findy.database.persist import from_postgresql
 from findy.utils.time import PRECISION_STR, to_pd_timestamp
 # from findy.utils.pd import pd_valid, index_df
 
 logger = logging.getLogger(__name__)
 
+# rows fetched per round trip from the server side cursor
+STREAM_CHUNK_ROWS = 50000
+
 
 def common_filter(query: Query,
                   data_schema,
@@ -88,6 +92,40 @@ def column_query(data_schema, db_session, columns, time_field, col_label):
     return db_session.query(*columns)
 
 
+def column_types_of(query: Query):
+    return {desc['name']: desc['type'] for desc in query.column_descriptions}
+
+
+def to_column(values, col_type):
+    # build a typed column straight from the row values, None becomes NaN / NaT
+    if isinstance(col_type, sqltypes.DateTime):
+        return pd.to_datetime(pd.Series(values, dtype=object))
+    if isinstance(col_type, sqltypes.Float):
+        return np.array(values, dtype=np.float64)
+    if isinstance(col_type, sqltypes.Integer):
+        if any(v is None for v in values):
+            return np.array(values, dtype=np.float64)
+        return np.array(values, dtype=np.int64)
+    if isinstance(col_type, sqltypes.Boolean) and not any(v is None for v in values):
+        return np.array(values, dtype=bool)
+    return np.array(values, dtype=object)
+
+
+def rows_to_df(rows, column_names, column_types):
+    if not rows:
+        return pd.DataFrame(columns=column_names)
+
+    columns = zip(*rows)
+    return pd.DataFrame({name: to_column(values, column_types.get(name))
+                         for name, values in zip(column_names, columns)},
+                        columns=column_names)
+
+
+def iter_df(result, column_names, column_types, chunk_size):
+    for rows in result.partitions(chunk_size):
+        yield rows_to_df(rows, column_names, column_types)
+
+
 def get_data(
         region: Region,
         provider: Provider,
@@ -108,7 +146,18 @@ def get_data(
         limit: int = None,
         index: Union[str, list] = None,
         time_field: str = 'timestamp',
-        fun=None):
+        fun=None,
+        return_type: str = 'orm',
+        chunk_size: int = None):
+    """
+    query data_schema, return (result, column_names)
+
+    :param return_type: 'orm' returns the mapped instances (or rows if columns is set),
+        'df' streams the rows from a server side cursor into a typed DataFrame without
+        building ORM objects
+    :param chunk_size: with return_type 'df', yield DataFrames of at most chunk_size rows
+        instead of one frame
+    """
     assert data_schema is not None
     assert db_session is not None
     assert provider is not None
@@ -118,6 +167,8 @@ def get_data(
 
     if columns:
         query = column_query(data_schema, db_session, columns, time_field, col_label)
+    elif return_type == 'df' and fun is None:
+        query = db_session.query(*data_schema.__table__.columns)
     elif fun is not None:
         query = db_session.query(fun)
     else:
@@ -143,6 +194,26 @@ def get_data(
     # if not db_session:
     #     db_session = get_db_session(region, provider, data_schema)
 
+    if return_type == 'df' and fun is None:
+        rows_per_fetch = chunk_size if chunk_size else STREAM_CHUNK_ROWS
+        try:
+            result = db_session.execute(query.statement,
+                                        execution_options={'stream_results': True,
+                                                           'max_row_buffer': rows_per_fetch})
+            result_columns = list(result.keys())
+        except Exception as e:
+            logger.error(f"query {data_schema.__tablename__} failed with error: {e}")
+            return None, []
+
+        column_types = column_types_of(query)
+        if chunk_size:
+            return (iter_df(result, result_columns, column_types, chunk_size), result_columns)
+
+        dfs = [df for df in iter_df(result, result_columns, column_types, rows_per_fetch)]
+        if len(dfs) > 1:
+            return (pd.concat(dfs, ignore_index=True), result_columns)
+        return (dfs[0] if dfs else pd.DataFrame(columns=result_columns), result_columns)
+
     try:
         result = db_session.execute(query)
         result_columns = query.statement.columns.keys()
@@ -180,13 +251,6 @@ def get_data(
     #         df = index_df(df, index=index, time_field=time_field)
     #     return df
 
-    # if findy_config['debug'] == 2:
-    #     with profiled():
-    #         # result = query.all()
-    #         result = db_session.execute(query).all()
-    # else:
-        # result = query.all()
-
     # if findy_config['debug'] == 2:
     #     cost = PRECISION_STR.format(time.time() - now)
     #     res_cnt = len(result) if result else 0
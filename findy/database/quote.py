@@ -62,7 +62,8 @@ def get_entities(
         filters: List = None,
         order=None,
         limit: int = None,
-        index: Union[str, list] = 'code') -> object:
+        index: Union[str, list] = 'code',
+        return_type: str = 'orm') -> object:
     if not entity_schema:
         entity_schema = get_entity_schema_by_type(entity_type)
 
@@ -81,7 +82,8 @@ def get_entities(
         codes=codes, code=code, level=None, columns=columns,
         col_label=col_label, start_timestamp=start_timestamp,
         end_timestamp=end_timestamp, filters=filters,
-        order=order, limit=limit, index=index)
+        order=order, limit=limit, index=index,
+        return_type=return_type)
 
 
 def get_data_count(data_schema, db_session, filters=None):
@@ -240,10 +242,11 @@ async def get_portfolio_stocks(region: Region, provider: Provider, timestamp, po
             codes=codes,
             ids=ids,
             end_timestamp=timestamp,
-            filters=[data_schema.report_date == latest_record.report_date])
+            filters=[data_schema.report_date == latest_record.report_date],
+            return_type='df')
 
-        if data and len(data) > 0:
-            df = pd.DataFrame([s.__dict__ for s in data], columns=column_names)
+        if data is not None and len(data) > 0:
+            df = data
 
             # 最新的为年报或者半年报
             if latest_record.report_period == ReportPeriod.year or latest_record.report_period == ReportPeriod.half_year:
@@ -262,10 +265,11 @@ async def get_portfolio_stocks(region: Region, provider: Provider, timestamp, po
                         codes=codes,
                         ids=ids,
                         end_timestamp=timestamp,
-                        filters=[data_schema.report_date == to_pd_timestamp(report_date)])
+                        filters=[data_schema.report_date == to_pd_timestamp(report_date)],
+                        return_type='df')
 
-                    if data and len(data) > 0:
-                        pre_df = pd.DataFrame.from_records([s.__dict__ for s in data], columns=column_names)
+                    if data is not None and len(data) > 0:
+                        pre_df = data
                         df = df.append(pre_df)
 
                     # 半年报和年报
@@ -292,7 +296,7 @@ async def get_kdata(region: Region, entity_id=None, entity_ids=None,
                     level=IntervalLevel.LEVEL_1DAY.value, provider=None, columns=None,
                     start_timestamp=None, end_timestamp=None,
                     filters=None, db_session=None, order=None, limit=None,
-                    index='timestamp', adjust_type: AdjustType = None):
+                    index='timestamp', adjust_type: AdjustType = None, chunk_size=None):
     assert not entity_id or not entity_ids
     if entity_ids:
         entity_id = entity_ids[0]
@@ -314,9 +318,12 @@ async def get_kdata(region: Region, entity_id=None, entity_ids=None,
         filters=filters,
         order=order,
         limit=limit,
-        index=index)
+        index=index,
+        return_type='df',
+        chunk_size=chunk_size)
 
-    if data and not columns:
-        return pd.DataFrame([s.__dict__ for s in data], columns=column_names)
+    # iterator of frames when chunk_size is set
+    if data is None:
+        return pd.DataFrame(columns=column_names)
 
-    return pd.DataFrame(data, columns=column_names)
+    return data
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 import logging
+import pickle
 import time
-import msgpack
 import math
 from typing import List, Union
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import pandas as pd
+from sqlalchemy import func
 
 from findy import findy_config
 from findy.interface import Region, Provider, EntityType
@@ -16,9 +19,16 @@ from findy.database.schema.quotes.trade_day import StockTradeDay
 from findy.database.schema.register import get_schema_by_name
 from findy.database.context import get_db_session
 from findy.database.quote import get_entities
-from findy.utils.request import get_async_http_session
-from findy.utils.kafka import connect_kafka_producer, publish_message
-from findy.utils.progress import progress_topic, progress_key
+from findy.database.checkpoint import OUTCOME_FAILED, OUTCOME_PERSISTED, load_checkpoints, save_outcomes
+from findy.utils.request import acquire_http_session, release_http_session
+from findy.utils.limiter import get_limiter
+from findy.utils.ratelimit import get_bucket, rate_limit_trace_config
+from findy.utils.retry import CircuitOpenError
+from findy.utils.pipeline import MeteredQueue, PriorityFeed, run_stage, run_workers
+from findy.utils.executor import get_format_executor
+from findy.utils.progress import ProgressReporter
+from findy.utils.shard import current_shard, in_shard, shard_label
+from findy.utils.ledger import count_run, ledger_trace_config
 from findy.utils.pd import pd_valid
 from findy.utils.time import (PD_TIME_FORMAT_DAY, PRECISION_STR,
                               to_pd_timestamp, to_time_str,
@@ -67,6 +77,28 @@ class RecorderForEntities(Recorder):
     data_schema: Mixin = None
     entity_schema: EntityMixin = None
     exchanges: List[str] = None
+    # persist through a staging table and resolve id conflicts on the server side
+    upsert: bool = False
+    # coalesce the records of all entities into table level upserts, see PersistBuffer
+    write_behind: bool = False
+    persist_buffer = None
+    # run fetch, format and persist as separate stages connected by bounded queues, see run_pipeline
+    # only for recorders finishing an entity in one round
+    pipeline: bool = False
+    format_workers: int = 2
+    persist_workers: int = 2
+    queue_size: int = 100
+    # keep per entity outcome and latest timestamp in the checkpoint store, see findy.database.checkpoint
+    checkpoint: bool = True
+    # entity order, None keeps the order of init_entities, 'staleness', 'liquidity' or 'watchlist',
+    # config entity_priority applies when not set by the recorder
+    priority: str = None
+    # a failed entity is queued again behind the fresh ones, at most max_retries times,
+    # after retry_backoff seconds doubled on every attempt
+    max_retries: int = 2
+    retry_backoff: float = 1.0
+    # run time state left out when the recorder is shipped to the format processes
+    transient_attrs = ('persist_buffer', 'checkpoints', 'outcomes', 'failed_writes')
 
     def __init__(self,
                  entity_type: EntityType = EntityType.Stock,
@@ -86,9 +118,21 @@ class RecorderForEntities(Recorder):
         self.entity_ids = entity_ids
         self.codes = codes
         self.share_para = share_para
-        
+        # entity_id -> (timestamp, outcome, updated_at) left by the former runs
+        self.checkpoints = None
+        # outcomes of finished entities not written yet
+        self.outcomes = []
+        # entities whose buffered write failed after they were reported finished
+        self.failed_writes = set()
+
         super().__init__(batch_size=batch_size, force_update=force_update, sleeping_time=sleeping_time)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attr in self.transient_attrs:
+            state.pop(attr, None)
+        return state
+
     async def init_entities(self, db_session):
         # init the entity list
         entities, column_names = get_entities(
@@ -102,12 +146,156 @@ class RecorderForEntities(Recorder):
             codes=self.codes)
         return entities
 
+    def shard_entities(self, entities):
+        # only the entities of the shard this task runs for, see fetch_process
+        shard = current_shard.get()
+        if shard is None:
+            return entities
+        return [entity for entity in entities if in_shard(entity if isinstance(entity, str) else entity.id, shard)]
+
+    def use_checkpoint(self) -> bool:
+        return self.checkpoint and findy_config.get('checkpoint', True)
+
+    def load_checkpoints(self, entities):
+        entity_ids = [entity if isinstance(entity, str) else entity.id for entity in entities]
+        return load_checkpoints(self.region, self.provider.value, self.data_schema.__tablename__, entity_ids)
+
+    def skip_checkpointed(self, entities):
+        # with checkpoint_resume (-resume) the entities persisted by a former run within checkpoint_ttl seconds
+        # are not evaluated again, an interrupted run resumes from where it stopped,
+        # evaluated only, written, recorded without data and failed entities are always run again
+        ttl = findy_config.get('checkpoint_ttl', 12 * 3600)
+        if not findy_config.get('checkpoint_resume', False) or self.force_update or not self.checkpoints or not ttl:
+            return entities
+
+        since = pd.Timestamp.now() - pd.Timedelta(seconds=ttl)
+        remains = []
+        for entity in entities:
+            checkpoint = self.checkpoints.get(entity if isinstance(entity, str) else entity.id)
+            if checkpoint is None or checkpoint[1] != OUTCOME_PERSISTED or checkpoint[2] < since:
+                remains.append(entity)
+
+        skipped = len(entities) - len(remains)
+        if skipped > 0:
+            self.logger.info(f'{self.data_schema.__name__}: {skipped} of {len(entities)} entities are finished by the former run')
+        return remains
+
+    def save_outcome(self, entity, result):
+        if not self.use_checkpoint():
+            return
+
+        # no timestamp, the latest timestamp is only moved by df_to_db, in the transaction of the data
+        entity_id = entity if isinstance(entity, str) else entity.id
+        if entity_id in self.failed_writes:
+            result = OUTCOME_FAILED
+        self.outcomes.append((self.provider.value, self.data_schema.__tablename__, entity_id,
+                              None, result, pd.Timestamp.now().to_pydatetime()))
+
+        # deferred writes are not durable before the buffer is flushed, their outcomes wait for the end of run
+        if self.persist_buffer is None and len(self.outcomes) >= self.batch_size * 10:
+            self.flush_outcomes()
+
+    def flush_outcomes(self):
+        # the last outcome of an entity wins, one upsert can not touch a row twice
+        outcomes = list({outcome[:3]: outcome for outcome in self.outcomes}.values())
+        self.outcomes = []
+        save_outcomes(self.region, outcomes)
+
+    def on_write_error(self, entity, error):
+        # the buffered write of an entity reported finished before failed on its own
+        entity_id = entity if isinstance(entity, str) else entity.id
+        self.logger.error(f'persist {entity_id} failed with error: {error}')
+        self.failed_writes.add(entity_id)
+        self.save_outcome(entity, OUTCOME_FAILED)
+
+    async def filter_entities(self, entities, db_session):
+        # drop the entities known to be up to date before any task is created
+        return entities
+
+    def latest_timestamp_of(self, entity):
+        if not self.checkpoints:
+            return None
+        checkpoint = self.checkpoints.get(entity if isinstance(entity, str) else entity.id)
+        return checkpoint[0] if checkpoint is not None else None
+
+    def load_turnovers(self, entities):
+        # latest daily turnover of every entity, volume * close when the provider gives no turnover
+        from sqlalchemy import text
+        from findy.database.context import get_db_engine
+
+        entity_ids = [entity if isinstance(entity, str) else entity.id for entity in entities]
+        sql = text(f"SELECT DISTINCT ON (entity_id) entity_id, COALESCE(turnover, volume * close) "
+                   f"FROM {self.entity_type.value}_1d_kdata WHERE entity_id = ANY(:entity_ids) AND timestamp >= :since "
+                   f"ORDER BY entity_id, timestamp DESC")
+        try:
+            with get_db_engine(self.region).connect() as connection:
+                rows = connection.execute(sql, {'entity_ids': entity_ids,
+                                                'since': (pd.Timestamp.now() - pd.Timedelta(days=30)).to_pydatetime()})
+                return {entity_id: turnover or 0 for entity_id, turnover in rows}
+        except Exception as e:
+            self.logger.warning(f'load turnovers failed with error: {e}')
+            return {}
+
+    def entity_priority(self, entities):
+        """
+        sort key of the entities, smaller first, None keeps the order
+        """
+        priority = self.priority or findy_config.get('entity_priority')
+
+        def key_of(entity):
+            return entity if isinstance(entity, str) else entity.id
+
+        if priority == 'staleness':
+            # never saved first, then the oldest
+            def staleness(entity):
+                timestamp = self.latest_timestamp_of(entity)
+                return timestamp.value if timestamp is not None else float('-inf')
+            return staleness
+
+        if priority == 'liquidity':
+            turnovers = self.load_turnovers(entities)
+            return lambda entity: -turnovers.get(key_of(entity), 0)
+
+        if priority == 'watchlist':
+            # listed by entity id or code, in the given order, before all the others
+            watchlist = findy_config.get('watchlist', [])
+            rank = {key: index for index, key in enumerate(watchlist)}
+
+            def listed(entity):
+                code = getattr(entity, 'code', None)
+                return rank.get(key_of(entity), rank.get(code, len(rank)))
+            return listed
+
+        return None
+
+    def retry_entity(self, feed, entity, stage, error) -> bool:
+        """
+        queue a failed entity again, False when it is given up and its failure is recorded
+        """
+        name = entity if isinstance(entity, str) else entity.id
+        if isinstance(error, CircuitOpenError):
+            # the host is shed, not the entity, back once the circuit lets a probe through
+            retried = feed.retry(entity, delay=max(error.retry_after, feed.backoff), count=False)
+        else:
+            retried = feed.retry(entity)
+        if retried:
+            self.logger.warning(f'{stage} {name} failed with error: {error}, retry later')
+            return True
+
+        self.logger.error(f'{stage} {name} failed with error: {error}')
+        self.save_outcome(entity, OUTCOME_FAILED)
+        return False
+
     async def eval(self, entity, http_session, db_session):
         raise NotImplementedError
 
     async def record(self, entity, http_session, db_session, para):
         raise NotImplementedError
 
+    def format_record(self, entity, df_record):
+        # cpu bound conversion of the fetched payload, run off the event loop by the pipeline
+        return df_record
+
     async def persist(self, entity, http_session, db_session, df_record):
         raise NotImplementedError
 
@@ -131,14 +319,26 @@ class RecorderForEntities(Recorder):
             return 1, eval_time, download_time, persist_time, time.time() - start_point, None
 
         async with throttler:
+            # provider quota is shared by all the processes of the run
+            bucket = get_bucket(self.provider.value)
+            if bucket is not None:
+                await bucket.acquire()
+
             start_point = time.time()
 
             # fetch
-            is_finish, download_time, df_record = await self.record(entity, http_session, db_session, para)
+            try:
+                is_finish, download_time, df_record = await self.record(entity, http_session, db_session, para)
+            except Exception:
+                throttler.on_sample(time.time() - start_point, ok=False)
+                raise
+            throttler.on_sample(download_time)
             if is_finish:
                 # await self.sleep(0.1)
                 return 2, eval_time, download_time, persist_time, time.time() - start_point + eval_time, None
 
+            df_record = self.format_record(entity, df_record)
+
             # save
             is_finish, persist_time, extra = await self.persist(entity, http_session, db_session, df_record)
             if is_finish:
@@ -147,7 +347,7 @@ class RecorderForEntities(Recorder):
 
         return 0, eval_time, download_time, persist_time, time.time() - start_point + eval_time, None
 
-    async def process_loop(self, entity, pbar_update, http_session, db_session, kafka_producer, throttler):
+    async def process_loop(self, entity, pbar_update, http_session, db_session, progress, throttler):
         eval_time = 0
         download_time = 0
         persist_time = 0
@@ -163,10 +363,22 @@ class RecorderForEntities(Recorder):
             if result > 0:
                 # add finished entity to finished_items
                 total_time += await self.on_finish_entity(entity, http_session, db_session, result)
+                self.save_outcome(entity, result)
                 break
         
         pbar_update["update"] = 1
-        publish_message(kafka_producer, progress_topic, progress_key, msgpack.dumps(pbar_update))
+        pbar_update["limit"] = throttler.current
+        progress.update(pbar_update)
+
+        self.log_finish(entity, eval_time, download_time, persist_time, total_time, extra)
+
+    def log_finish(self, entity, eval_time, download_time, persist_time, total_time, extra):
+        # entities and rows of the task unit in the run ledger
+        count_run('entities', 1)
+        if isinstance(extra, int):
+            count_run('rows', extra)
+        elif isinstance(extra, list):
+            count_run('rows', extra[0] or 0)
 
         eval_time = PRECISION_STR.format(eval_time)
         download_time = PRECISION_STR.format(download_time)
@@ -183,41 +395,213 @@ class RecorderForEntities(Recorder):
                     prefix, self.data_schema.__name__, name, eval_time, download_time, persist_time, total_time,
                     extra, postfix))
             elif isinstance(extra, list):
-                self.logger.info("{}{:>17}, {:>18}, eval: {}, download: {}, persist: {}, total: {}, size: {:>7}, date: [ {}, {} ]{}".format(
+                self.logger.info("{}{:>17}, {:>18}, eval: {}, download: {}, persist: {}, total: {}, size: {:>7}, skipped: {:>7}, date: [ {}, {} ]{}".format(
                     prefix, self.data_schema.__name__, name, eval_time, download_time, persist_time, total_time,
-                    extra[0], extra[1], extra[2], postfix))
+                    extra[0], extra[3], extra[1], extra[2], postfix))
         else:
             self.logger.info("{}{:>17}, {:>18}, eval: {}, download: {}, persist: {}, total: {}{}".format(
                 prefix, self.data_schema.__name__, name, eval_time, download_time, persist_time, total_time, postfix))
 
+    async def run_pipeline(self, feed, pbar_update, http_session, db_session, progress, throttler):
+        """
+        fetchers -> format_q -> formatters -> persist_q -> writers
+
+        only the fetch holds a throttler slot, a slow COPY or a long format no longer blocks the network,
+        a full queue holds the upstream stage back instead of piling up dataframes in memory
+        """
+        loop = asyncio.get_event_loop()
+
+        executor = get_format_executor()
+        if isinstance(executor, ProcessPoolExecutor):
+            # the recorder goes with every payload, find out once whether it can be shipped at all
+            try:
+                pickle.dumps(self)
+            except Exception as e:
+                self.logger.warning(f'{self.__class__.__name__} formats in threads, it can not be shipped to the format processes: {e}')
+                executor = get_format_executor('thread')
+
+        entity_q = MeteredQueue('entity', maxsize=self.queue_size)
+        format_q = MeteredQueue('format', maxsize=self.queue_size)
+        persist_q = MeteredQueue('persist', maxsize=self.queue_size)
+
+        async def finish(entity, timings, result, extra):
+            eval_time, download_time, format_time, persist_time, start_point = timings
+            total_time = time.time() - start_point
+            total_time += await self.on_finish_entity(entity, http_session, db_session, result)
+            self.save_outcome(entity, result)
+            # the entity stays in flight until here, a later stage may still queue it again
+            feed.done(entity)
+
+            pbar_update["update"] = 1
+            pbar_update["limit"] = throttler.current
+            progress.update(pbar_update)
+
+            # format time counts as download, as in process_entity
+            self.log_finish(entity, eval_time, download_time + format_time, persist_time, total_time, extra)
+
+        def fail(entity, stage, error):
+            # queued again from the fetch, or given up and counted on the bar
+            if not self.retry_entity(feed, entity, stage, error):
+                pbar_update["update"] = 1
+                pbar_update["limit"] = throttler.current
+                progress.update(pbar_update)
+            feed.done(entity)
+
+        async def fetch(entity):
+            start_point = time.time()
+            try:
+                is_finish, eval_time, para = await self.eval(entity, http_session, db_session)
+                if is_finish:
+                    await finish(entity, (eval_time, 0, 0, 0, start_point), 1, None)
+                    return None
+
+                async with throttler:
+                    bucket = get_bucket(self.provider.value)
+                    if bucket is not None:
+                        await bucket.acquire()
+
+                    fetch_point = time.time()
+                    try:
+                        is_finish, download_time, df_record = await self.record(entity, http_session, db_session, para)
+                    except Exception:
+                        throttler.on_sample(time.time() - fetch_point, ok=False)
+                        raise
+                    throttler.on_sample(download_time)
+
+                if is_finish:
+                    await finish(entity, (eval_time, download_time, 0, 0, start_point), 2, None)
+                    return None
+
+                return entity, [eval_time, download_time, 0, 0, start_point], df_record
+            except Exception as e:
+                fail(entity, 'fetch', e)
+                return None
+
+        async def transform(item):
+            entity, timings, df_record = item
+            format_point = time.time()
+            try:
+                try:
+                    df_record = await loop.run_in_executor(executor, self.format_record, entity, df_record)
+                except (pickle.PicklingError, TypeError, AttributeError, BrokenProcessPool) as e:
+                    if not isinstance(executor, ProcessPoolExecutor):
+                        raise
+                    # payload can not be shipped to the format processes, pickling raises PicklingError,
+                    # TypeError or AttributeError depending on the object, keep it in this process
+                    name = entity if isinstance(entity, str) else entity.id
+                    self.logger.warning(f'format {name} in thread, process pool failed with error: {e}')
+                    df_record = await loop.run_in_executor(get_format_executor('thread'), self.format_record, entity, df_record)
+            except Exception as e:
+                fail(entity, 'format', e)
+                return None
+            timings[2] = time.time() - format_point
+            return entity, timings, df_record
+
+        async def write(item):
+            entity, timings, df_record = item
+            try:
+                is_finish, timings[3], extra = await self.persist(entity, http_session, db_session, df_record)
+                await finish(entity, timings, 3, extra)
+            except Exception as e:
+                fail(entity, 'persist', e)
+
+        async def feed_entities():
+            # entities may come from a streaming query, only queue_size of them are held ahead
+            async def forward(entity):
+                await entity_q.put(entity)
+            await run_workers(1, forward, feed)
+            await entity_q.put(None)
+
+        # fetchers are as many as the limiter may ever allow, the throttler decides how many run
+        await asyncio.gather(feed_entities(),
+                             run_stage(throttler.max_limit, fetch, entity_q, format_q),
+                             run_stage(self.format_workers, transform, format_q, persist_q),
+                             run_stage(self.persist_workers, write, persist_q))
+
+        for queue in [format_q, persist_q]:
+            self.logger.info(f'{self.data_schema.__name__} pipeline {queue.metrics()}')
+
     async def run(self):
         db_session = get_db_session(self.region, self.provider, self.data_schema)
-        kafka_producer = connect_kafka_producer(findy_config['kafka'])
+        # increments of the entities are batched, sent through the transport of the process
+        progress = ProgressReporter()
 
         entities = await self.init_entities(db_session)
 
         if entities and len(entities) > 0:
-            http_session = get_async_http_session()
-            throttler = asyncio.Semaphore(self.share_para[0])
-
-            (taskid, desc) = self.share_para[1]
-            pbar_update = {"task": taskid, "total": len(entities), "desc": desc, "leave": True, "update": 0}
-            publish_message(kafka_producer, progress_topic, progress_key,  msgpack.dumps(pbar_update))
+            entities = self.shard_entities(entities)
 
-            # tasks = [asyncio.ensure_future(self.process_loop(entity, pbar_update, http_session, db_session, throttler)) for entity in entities]
-            tasks = [self.process_loop(entity, pbar_update, http_session, db_session, kafka_producer, throttler) for entity in entities]
+        if entities and len(entities) > 0 and self.use_checkpoint():
+            self.checkpoints = self.load_checkpoints(entities)
+            entities = self.skip_checkpointed(entities)
 
-            # for result in asyncio.as_completed(tasks):
-            #     await result
+        if entities and len(entities) > 0:
+            entities = await self.filter_entities(entities, db_session)
 
-            [await _ for _ in asyncio.as_completed(tasks)]
+        if entities and len(entities) > 0:
+            # in flight limit adapts to the provider's latency and errors, share_para[0] is the start point
+            throttler = get_limiter(self.provider.value, self.share_para[0])
+            http_session = acquire_http_session(self.provider.value,
+                                                trace_configs=[throttler.trace_config(),
+                                                               rate_limit_trace_config(self.provider.value),
+                                                               ledger_trace_config()])
+
+            flusher = None
+            try:
+                (taskid, desc) = self.share_para[1]
+                pbar_update = {"task": taskid, "total": len(entities), "desc": desc, "leave": True, "update": 0, "limit": throttler.current}
+                if current_shard.get() is not None:
+                    # the shards of a task share its bar, each adds its entities to the total
+                    pbar_update['shard'] = shard_label(current_shard.get())
+                progress.update(pbar_update)
+
+                if self.write_behind:
+                    from findy.database.persist import PersistBuffer
+                    self.persist_buffer = PersistBuffer(self.region, self.provider, self.data_schema, db_session,
+                                                        checkpoint=self.use_checkpoint(), force_update=self.force_update)
+                    flusher = asyncio.ensure_future(self.persist_buffer.flush_periodically())
+
+                # the entities come out by priority, failed ones are queued again
+                feed = PriorityFeed(entities, priority=self.entity_priority(entities), max_retries=self.max_retries,
+                                    backoff=self.retry_backoff)
+
+                if self.pipeline:
+                    await self.run_pipeline(feed, pbar_update, http_session, db_session, progress, throttler)
+                else:
+                    async def process(entity):
+                        try:
+                            await self.process_loop(entity, pbar_update, http_session, db_session, progress, throttler)
+                        except Exception as e:
+                            if not self.retry_entity(feed, entity, 'process', e):
+                                pbar_update["update"] = 1
+                                pbar_update["limit"] = throttler.current
+                                progress.update(pbar_update)
+                        finally:
+                            feed.done(entity)
+
+                    # long lived workers pull the entities, as many as the limiter may ever allow,
+                    # the throttler decides how many of them are downloading
+                    await run_workers(throttler.max_limit, process, feed)
+            finally:
+                # a failed run still writes what it has taken and gives the session back
+                progress.close()
+                try:
+                    if flusher is not None:
+                        flusher.cancel()
+                    # the frames failing on their own turn the outcomes of their entities into failed
+                    if self.persist_buffer is not None:
+                        await self.persist_buffer.flush()
+                    if self.outcomes:
+                        self.flush_outcomes()
+                finally:
+                    await release_http_session(http_session)
 
             await self.on_finish(entities)
 
-            return await http_session.close()
-
 
 class TimeSeriesDataRecorder(RecorderForEntities):
+    transient_attrs = RecorderForEntities.transient_attrs + ('latest_timestamps', 'trade_day')
+
     def __init__(self,
                  entity_type: EntityType = EntityType.Stock,
                  entity_ids=None,
@@ -234,6 +618,8 @@ class TimeSeriesDataRecorder(RecorderForEntities):
         self.fix_duplicate_way = fix_duplicate_way
         self.start_timestamp = to_pd_timestamp(start_timestamp)
         self.end_timestamp = to_pd_timestamp(end_timestamp)
+        # entity_id -> latest saved timestamp, loaded once per run
+        self.latest_timestamps = None
 
         super().__init__(entity_type, entity_ids, codes, batch_size,
                          force_update, sleeping_time, share_para=share_para)
@@ -257,8 +643,43 @@ class TimeSeriesDataRecorder(RecorderForEntities):
             columns=['id', self.get_evaluated_time_field()])
         return pd.DataFrame(data, columns=column_names)
 
-    async def eval_fetch_timestamps(self, entity, http_session, db_session):
+    def load_latest_timestamps(self, entities, db_session):
+        time_field = self.get_evaluated_time_field()
+        time_column = eval(f'self.data_schema.{time_field}')
+        entity_ids = [entity.entity_id for entity in entities]
+
+        # checkpoints carry the latest timestamp committed with the data, only the entities without one
+        # go to the data table
+        latest_timestamps = {}
+        if self.checkpoints and time_field == 'timestamp':
+            for entity_id in entity_ids:
+                checkpoint = self.checkpoints.get(entity_id)
+                if checkpoint is not None and checkpoint[0] is not None:
+                    latest_timestamps[entity_id] = checkpoint[0]
+            entity_ids = [entity_id for entity_id in entity_ids if entity_id not in latest_timestamps]
+
+            if not entity_ids:
+                return latest_timestamps
+
+        # one grouped query for all entities, served by the (entity_id, timestamp) index
+        try:
+            query = db_session.query(self.data_schema.entity_id, func.max(time_column)) \
+                .filter(self.data_schema.entity_id.in_(entity_ids)) \
+                .group_by(self.data_schema.entity_id)
+            for entity_id, latest_timestamp in db_session.execute(query):
+                if latest_timestamp is not None:
+                    latest_timestamps[entity_id] = to_pd_timestamp(latest_timestamp)
+        except Exception as e:
+            self.logger.warning(f'load latest timestamps failed with error: {e}')
+            return None
 
+        return latest_timestamps
+
+    def get_latest_timestamp(self, entity, db_session):
+        if self.latest_timestamps is not None:
+            return self.latest_timestamps.get(entity.entity_id)
+
+        # not prefetched, query the entity alone
         time_field = self.get_evaluated_time_field()
         try:
             time_column = eval(f'self.data_schema.{time_field}')
@@ -267,12 +688,46 @@ class TimeSeriesDataRecorder(RecorderForEntities):
                 provider=self.provider,
                 db_session=db_session,
                 entity_id=entity.entity_id,
+                columns=[time_column],
                 order=time_column.desc(),
-                limit=1000)
-            latest_timestamp = latest_records[0].timestamp if latest_records and len(latest_records) > 0 else None
+                limit=1)
+            return to_pd_timestamp(latest_records[0][0]) if latest_records and len(latest_records) > 0 else None
         except Exception as e:
-            self.logger.warning("get ref_record failed with error: {}".format(e))
-            latest_timestamp = None
+            self.logger.warning(f'get ref_record failed with error: {e}')
+            return None
+
+    def latest_timestamp_of(self, entity):
+        if self.latest_timestamps is not None:
+            return self.latest_timestamps.get(entity.entity_id)
+        return super().latest_timestamp_of(entity)
+
+    def update_latest_timestamp(self, entity, df_record):
+        if self.latest_timestamps is None or not pd_valid(df_record):
+            return
+
+        latest_timestamp = to_pd_timestamp(df_record[self.get_evaluated_time_field()].max())
+        current = self.latest_timestamps.get(entity.entity_id)
+        if current is None or latest_timestamp > current:
+            self.latest_timestamps[entity.entity_id] = latest_timestamp
+
+    async def filter_entities(self, entities, db_session):
+        self.latest_timestamps = self.load_latest_timestamps(entities, db_session)
+        if self.latest_timestamps is None:
+            return entities
+
+        remains = []
+        for entity in entities:
+            start, end, size, timestamps = await self.eval_fetch_timestamps(entity, None, db_session)
+            if size != 0:
+                remains.append(entity)
+
+        skipped = len(entities) - len(remains)
+        if skipped > 0:
+            self.logger.info(f'{self.data_schema.__name__}: {skipped} of {len(entities)} entities are up to date')
+        return remains
+
+    async def eval_fetch_timestamps(self, entity, http_session, db_session):
+        latest_timestamp = self.get_latest_timestamp(entity, db_session)
 
         if not latest_timestamp:
             latest_timestamp = entity.timestamp
@@ -326,15 +781,26 @@ class TimeSeriesDataRecorder(RecorderForEntities):
             assert 'id' in df_record.columns
             from findy.database.persist import df_to_db
 
-            saved_counts = await df_to_db(region=self.region,
-                                          provider=self.provider,
-                                          data_schema=self.data_schema,
-                                          db_session=db_session,
-                                          df=df_record,
-                                          ref_entity=entity,
-                                          fix_duplicate_way=self.fix_duplicate_way)
+            if self.persist_buffer is not None:
+                # accepted by the buffer, written with the next flush, the latest timestamp moves once it commits
+                saved_counts = await self.persist_buffer.put(
+                    df_record,
+                    on_commit=lambda: self.update_latest_timestamp(entity, df_record),
+                    on_error=lambda error: self.on_write_error(entity, error))
+            else:
+                saved_counts = await df_to_db(region=self.region,
+                                              provider=self.provider,
+                                              data_schema=self.data_schema,
+                                              db_session=db_session,
+                                              df=df_record,
+                                              ref_entity=entity,
+                                              fix_duplicate_way=self.fix_duplicate_way,
+                                              upsert=self.upsert,
+                                              checkpoint=self.use_checkpoint())
             if saved_counts == 0:
                 is_finished = True
+            elif self.persist_buffer is None:
+                self.update_latest_timestamp(entity, df_record)
 
         # could not get more data
         else:
@@ -345,8 +811,9 @@ class TimeSeriesDataRecorder(RecorderForEntities):
 
         start_timestamp = to_time_str(df_record['timestamp'].min(axis=0))
         end_timestamp = to_time_str(df_record['timestamp'].max(axis=0))
+        skipped_counts = len(df_record) - saved_counts if pd_valid(df_record) else 0
 
-        return is_finished, time.time() - start_point, [saved_counts, start_timestamp, end_timestamp]
+        return is_finished, time.time() - start_point, [saved_counts, start_timestamp, end_timestamp, skipped_counts]
 
     async def run(self):
         db_session = get_db_session(self.region, self.provider, self.data_schema)
@@ -366,6 +833,13 @@ class TimeSeriesDataRecorder(RecorderForEntities):
 
 
 class KDataRecorder(TimeSeriesDataRecorder):
+    # kdata tables are the largest ones, avoid scanning all ids of the entity on every persist
+    upsert = True
+    # one entity is finished after a single persist, safe to defer the write
+    write_behind = True
+    # one round per entity as well, fetch, format and persist run as pipeline stages
+    pipeline = True
+
     def __init__(self,
                  entity_type: EntityType = EntityType.Stock,
                  entity_ids=None,
@@ -386,6 +860,15 @@ class KDataRecorder(TimeSeriesDataRecorder):
                          share_para=share_para)
         self.level = IntervalLevel(level)
 
+    def format(self, entity, df):
+        raise NotImplementedError
+
+    def format_record(self, entity, df_record):
+        # record returns the raw bars, format names the columns and generates the ids
+        if pd_valid(df_record):
+            return self.format(entity, df_record)
+        return df_record
+
     @staticmethod
     def get_kdata_schema(entity_type: EntityType,
                          level: Union[IntervalLevel, str] = IntervalLevel.LEVEL_1DAY,
@@ -432,20 +915,7 @@ class KDataRecorder(TimeSeriesDataRecorder):
                        one_day_trading_seconds / level.to_second())
 
     async def eval_fetch_timestamps(self, entity, http_session, db_session):
-        time_field = self.get_evaluated_time_field()
-        try:
-            time_column = eval(f'self.data_schema.{time_field}')
-            latest_records, column_names = self.data_schema.query_data(
-                region=self.region,
-                provider=self.provider,
-                db_session=db_session,
-                entity_id=entity.entity_id,
-                order=time_column.desc(),
-                limit=1000)
-            latest_timestamp = latest_records[0].timestamp if latest_records and len(latest_records) > 0 else None
-        except Exception as e:
-            self.logger.warning(f'get ref record failed with error: {e}')
-            latest_timestamp = None
+        latest_timestamp = self.get_latest_timestamp(entity, db_session)
 
         if not latest_timestamp:
             latest_timestamp = entity.timestamp
@@ -502,6 +972,11 @@ class TimestampsDataRecorder(TimeSeriesDataRecorder):
                          share_para=share_para)
         self.security_timestamps_map = {}
 
+    async def filter_entities(self, entities, db_session):
+        # timestamps come from the provider, up to date entities can only be told inside eval
+        self.latest_timestamps = self.load_latest_timestamps(entities, db_session)
+        return entities
+
     def init_timestamps(self, entity_item, http_session) -> List[pd.Timestamp]:
         raise NotImplementedError
 
@@ -522,20 +997,7 @@ class TimestampsDataRecorder(TimeSeriesDataRecorder):
 
         timestamps.sort()
 
-        time_field = self.get_evaluated_time_field()
-        try:
-            time_column = eval(f'self.data_schema.{time_field}')
-            latest_records, column_names = self.data_schema.query_data(
-                region=self.region,
-                provider=self.provider,
-                db_session=db_session,
-                entity_id=entity.entity_id,
-                order=time_column.desc(),
-                limit=1000)
-            latest_timestamp = latest_records[0].timestamp if latest_records and len(latest_records) > 0 else None
-        except Exception as e:
-            self.logger.warning(f'get ref_record failed with error: {e}')
-            latest_timestamp = None
+        latest_timestamp = self.get_latest_timestamp(entity, db_session)
 
         if latest_timestamp is not None and isinstance(latest_timestamp, pd.Timestamp):
             timestamps = [t for t in timestamps if t >= latest_timestamp]
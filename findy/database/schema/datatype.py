@@ -87,7 +87,9 @@ class Mixin(object):
             limit: int = None,
             index: Union[str, list] = None,
             time_field: str = 'timestamp',
-            func=None):
+            func=None,
+            return_type: str = 'orm',
+            chunk_size: int = None):
         from findy.database.query import get_data
         return get_data(
             region=region, provider=provider, data_schema=cls, db_session=db_session,
@@ -95,7 +97,8 @@ class Mixin(object):
             code=code, level=level, columns=columns, col_label=col_label,
             start_timestamp=start_timestamp, end_timestamp=end_timestamp,
             filters=filters, order=order, limit=limit, index=index,
-            time_field=time_field, fun=func)
+            time_field=time_field, fun=func,
+            return_type=return_type, chunk_size=chunk_size)
 
     @classmethod
     async def record_data(cls,
@@ -111,6 +114,11 @@ class Mixin(object):
                           start_timestamp=None,
                           end_timestamp=None,
                           **kwargs):
+        # the recorder modules are imported by the first call for their region, provider and schema
+        if provider not in getattr(cls, 'provider_map_recorder', {}).get(region, {}):
+            from findy.database.plugins.manifest import load_recorder
+            load_recorder(region, provider, cls)
+
         assert hasattr(cls, 'provider_map_recorder') and cls.provider_map_recorder
         # print(f'{cls.__name__} registered recorders:{cls.provider_map_recorder}')
 
@@ -307,10 +315,11 @@ class Portfolio(EntityMixin):
             code=code,
             codes=codes,
             timestamp=timestamp,
-            ids=ids)
+            ids=ids,
+            return_type='df')
 
-        if data and len(data) > 0:
-            return pd.DataFrame([s.__dict__ for s in data], columns=column_names)
+        if data is not None and len(data) > 0:
+            return data
         else:
             return pd.DataFrame()
 
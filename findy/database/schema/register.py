@@ -87,7 +87,14 @@ def get_schema_columns(schema: DeclarativeMeta) -> object:
     return schema.__table__.columns.keys()
 
 
+def get_schema_column_types(schema: DeclarativeMeta) -> dict:
+    return {col.name: col.type for col in schema.__table__.columns}
+
+
 def get_db_name(data_schema: DeclarativeMeta) -> str:
     for db_name, base in __dbname_map_base.items():
         if issubclass(data_schema, base):
-            return db_name
\ No newline at end of file
+            return db_name
+
+def get_schema_bases() -> list:
+    return list(__dbname_map_base.values())
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import os
+
+from findy import findy_config
+from findy.interface import Region, RunMode
+from findy.interface.fetch import Para, task_set_chn, task_set_us, get_tasks, run_tasks, create_pool
+from findy.utils.progress import ProgressReporter, get_progress_transport
+from findy.utils.request import keep_http_sessions, close_http_sessions
+
+logger = logging.getLogger(__name__)
+
+
+class FetchDaemon(object):
+    """
+    one long lived process pool, its workers keep the imported plugins, provider logins, db engines and
+    http sessions between the runs
+
+    every tick the tasks past their Para.Cache hours run, requests on the local socket run at once,
+    one run at a time, json lines:
+        {"command": "fetch", "region": "chn", "tasks": ["task_chn_24"], "force": true}
+        {"command": "status"}
+        {"command": "stop"}
+    """
+
+    def __init__(self, regions=None, host='127.0.0.1', port=None, tick=None) -> None:
+        self.regions = regions or [Region(region) for region in findy_config.get('daemon_regions', ['chn'])]
+        self.host = host
+        self.port = port or findy_config.get('daemon_port', 18765)
+        self.tick = tick or findy_config.get('daemon_tick', 60)
+
+        self.pool = None
+        self.lock = None
+        self.stopped = None
+        self.runs = 0
+        self.last_states = {}
+
+    async def fetch(self, region: Region, task_ids=None, force=False):
+        async with self.lock:
+            tasks_list = get_tasks(region, task_ids=task_ids, force=force)
+            if not tasks_list:
+                return {}
+
+            logger.info(f"{region.value} run of {[task[1][Para.TaskID.value] for task in tasks_list]}")
+            states = await run_tasks(region, tasks_list, ProgressReporter(), pool=self.pool)
+
+            self.runs += 1
+            self.last_states[region.value] = states
+            return states
+
+    async def schedule(self):
+        while not self.stopped.is_set():
+            for region in self.regions:
+                try:
+                    await self.fetch(region)
+                except Exception as e:
+                    logger.error(f'{region.value} scheduled run failed with error: {e}')
+
+            try:
+                await asyncio.wait_for(self.stopped.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                try:
+                    request = json.loads(line)
+                    command = request.get('command')
+                    if command == 'fetch':
+                        states = await self.fetch(Region(request['region']), request.get('tasks'), request.get('force', False))
+                        response = {'states': states}
+                    elif command == 'status':
+                        response = {'regions': [region.value for region in self.regions], 'runs': self.runs,
+                                    'busy': self.lock.locked(), 'last': self.last_states}
+                    elif command == 'stop':
+                        self.stopped.set()
+                        response = {'stopping': True}
+                    else:
+                        response = {'error': f'unknown command: {command}'}
+                except Exception as e:
+                    response = {'error': str(e)}
+
+                writer.write((json.dumps(response) + '\n').encode('utf-8'))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def pool_size(self):
+        cpus = max(1, findy_config.get('processes') or os.cpu_count())
+        task_sets = {Region.CHN: task_set_chn, Region.US: task_set_us}
+        tasks = max([len([item for item in task_sets.get(region, []) if item[Para.Mode.value] == RunMode.Parallel])
+                     for region in self.regions], default=1)
+        return cpus, max(1, round(tasks / cpus))
+
+    async def serve(self):
+        self.lock = asyncio.Lock()
+        self.stopped = asyncio.Event()
+
+        # the serial tasks run in this process, keep its sessions as well
+        keep_http_sessions(True)
+        get_progress_transport()
+
+        cpus, childconcurrency = self.pool_size()
+        self.pool = create_pool(cpus, childconcurrency, keep_sessions=True)
+
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"findy daemon on {self.host}:{self.port}, {cpus} processes x {childconcurrency} tasks, "
+                    f"regions: {[region.value for region in self.regions]}")
+
+        try:
+            await self.schedule()
+        finally:
+            server.close()
+            await server.wait_closed()
+            self.pool.terminate()
+            await self.pool.join()
+            await close_http_sessions()
+
+
+def run_daemon(regions=None):
+    asyncio.run(FetchDaemon(regions).serve())
+
+
+def request_daemon(request: dict, host='127.0.0.1', port=None):
+    """
+    send one request to a running daemon, returns its response
+    """
+    async def send():
+        reader, writer = await asyncio.open_connection(host, port or findy_config.get('daemon_port', 18765))
+        writer.write((json.dumps(request) + '\n').encode('utf-8'))
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        writer.close()
+        return response
+
+    return asyncio.run(send())
@@ -5,15 +5,21 @@ import logging
 import os
 import platform
 import enum
-import msgpack
 import asyncio
 import time
-from datetime import datetime
+import math
+from datetime import datetime, timedelta
 
+from findy import findy_config
 from findy.interface import Region, Provider, RunMode
-from findy.utils.kafka import publish_message
-from findy.utils.progress import ProgressBarProcess, progress_topic, progress_key
+from findy.utils.progress import ProgressBarProcess, ProgressReporter, KafkaTransport, \
+    create_progress_transport, init_progress, get_progress_transport
 from findy.utils.cache import valid, get_cache, dump_cache
+from findy.utils.ratelimit import create_rate_limits, init_rate_limits
+from findy.utils.request import keep_http_sessions
+from findy.utils.dag import DONE, run_dag, simulate_dag
+from findy.utils.ledger import start_unit, finish_unit, load_ledger, record_runs, task_cost
+from findy.utils.shard import current_shard, shard_label
 import findy.vendor.aiomultiprocess as amp
 
 logger = logging.getLogger(__name__)
@@ -259,68 +265,68 @@ class task():
 
 
 task_set_chn = [
-    ["task_chn_01", task.get_stock_list_data,              Provider.Exchange,  0, 10, "Stock List",               24 * 6, RunMode.Serial],
-    ["task_chn_02", task.get_stock_trade_day,              Provider.BaoStock,  0, 10, "Trade Day",                24,     RunMode.Serial],
-    # ["task_chn_03", task.get_fund_list_data,                Provider.Exchange,  0, 10, "Fund List",                 24 * 6, RunMode.Serial],
-    ["task_chn_04", task.get_stock_main_index,             Provider.BaoStock,  0, 10, "Main Index",               24,     RunMode.Serial],
-    ["task_chn_05", task.get_stock_detail_data,            Provider.TuShare,   0,  4, "Stock Detail",             24 * 6, RunMode.Parallel],
-
-    # ["task_chn_06", task.get_dividend_financing_data,      Provider.EastMoney, 0, 10, "Divdend Financing",        24 * 6,  RunMode.Parallel],
-    # ["task_chn_07", task.get_top_ten_holder_data,          Provider.EastMoney, 0, 10, "Top Ten Holder",           24 * 6,  RunMode.Parallel],
-    # ["task_chn_08", task.get_top_ten_tradable_holder_data, Provider.EastMoney, 0, 10, "Top Ten Tradable Holder",  24 * 6,  RunMode.Parallel],
-    # ["task_chn_09", task.get_dividend_detail_data,         Provider.EastMoney, 0, 10, "Divdend Detail",           24 * 6,  RunMode.Parallel],
-    # ["task_chn_10", task.get_spo_detail_data,              Provider.EastMoney, 0, 10, "SPO Detail",               24 * 6,  RunMode.Parallel],
-    # ["task_chn_11", task.get_rights_issue_detail_data,     Provider.EastMoney, 0, 10, "Rights Issue Detail",      24,      RunMode.Parallel],
-    # ["task_chn_12", task.get_holder_trading_data,          Provider.EastMoney, 0, 10, "Holder Trading",           24 * 6,  RunMode.Parallel],
+    ["task_chn_01", task.get_stock_list_data,              Provider.Exchange,  0, 10, "Stock List",               24 * 6, RunMode.Serial,   []],
+    ["task_chn_02", task.get_stock_trade_day,              Provider.BaoStock,  0, 10, "Trade Day",                24,     RunMode.Serial,   []],
+    # ["task_chn_03", task.get_fund_list_data,                Provider.Exchange,  0, 10, "Fund List",                 24 * 6, RunMode.Serial,   []],
+    ["task_chn_04", task.get_stock_main_index,             Provider.BaoStock,  0, 10, "Main Index",               24,     RunMode.Serial,   []],
+    ["task_chn_05", task.get_stock_detail_data,            Provider.TuShare,   0,  4, "Stock Detail",             24 * 6, RunMode.Parallel, ["task_chn_01"]],
+
+    # ["task_chn_06", task.get_dividend_financing_data,      Provider.EastMoney, 0, 10, "Divdend Financing",        24 * 6,  RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_07", task.get_top_ten_holder_data,          Provider.EastMoney, 0, 10, "Top Ten Holder",           24 * 6,  RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_08", task.get_top_ten_tradable_holder_data, Provider.EastMoney, 0, 10, "Top Ten Tradable Holder",  24 * 6,  RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_09", task.get_dividend_detail_data,         Provider.EastMoney, 0, 10, "Divdend Detail",           24 * 6,  RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_10", task.get_spo_detail_data,              Provider.EastMoney, 0, 10, "SPO Detail",               24 * 6,  RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_11", task.get_rights_issue_detail_data,     Provider.EastMoney, 0, 10, "Rights Issue Detail",      24,      RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_12", task.get_holder_trading_data,          Provider.EastMoney, 0, 10, "Holder Trading",           24 * 6,  RunMode.Parallel, ["task_chn_01"]],
 
     # # below functions call join-quant sdk task which limit at most 3 concurrent request
-    # ["task_chn_13", task.get_finance_factor_data,          Provider.EastMoney, 0, 10, "Finance Factor",           24 * 6,  RunMode.Parallel],
-    # ["task_chn_14", task.get_balance_sheet_data,           Provider.EastMoney, 0, 10, "Balance Sheet",            24 * 6,  RunMode.Parallel],
-    # ["task_chn_15", task.get_income_statement_data,        Provider.EastMoney, 0, 10, "Income Statement",         24 * 6,  RunMode.Parallel],
-    # ["task_chn_16", task.get_cashflow_statement_data,      Provider.EastMoney, 0, 10, "CashFlow Statement",       24,      RunMode.Parallel],
-    # ["task_chn_17", task.get_stock_valuation_data,         Provider.JoinQuant, 0, 10, "Stock Valuation",          24,      RunMode.Parallel],
-    # ["task_chn_18", task.get_cross_market_summary_data,    Provider.JoinQuant, 0, 10, "Cross Market Summary",     24,      RunMode.Parallel],
-    # ["task_chn_19", task.get_stock_summary_data,           Provider.Exchange,  0, 10, "Stock Summary",            24,      RunMode.Parallel],
-    # ["task_chn_20", task.get_margin_trading_summary_data,  Provider.JoinQuant, 0, 10, "Margin Trading Summary",   24,      RunMode.Parallel],
-    # ["task_chn_21", task.get_etf_valuation_data,           Provider.JoinQuant, 0, 10, "ETF Valuation",            24,      RunMode.Parallel],
-    # ["task_chn_22", task.get_moneyflow_data,               Provider.Sina,      1, 10, "MoneyFlow Statement",      24,      RunMode.Parallel],
-
-    # ["task_chn_23", task.get_etf_1d_k_data,                Provider.Sina,      0, 10, "ETF Daily K-Data",         24,      RunMode.Parallel],
-    ["task_chn_24", task.get_stock_1d_k_data,              Provider.BaoStock,  0, 100, "Stock Daily   K-Data",     24,      RunMode.Parallel],
-    ["task_chn_25", task.get_stock_1w_k_data,              Provider.BaoStock,  0, 100, "Stock Weekly  K-Data",     24,      RunMode.Parallel],
-    ["task_chn_26", task.get_stock_1mon_k_data,            Provider.BaoStock,  0, 100, "Stock Monthly K-Data",     24,      RunMode.Parallel],
-    ["task_chn_27", task.get_stock_1h_k_data,              Provider.BaoStock,  0,  50, "Stock 1 hours K-Data",     24,      RunMode.Parallel],
-    ["task_chn_28", task.get_stock_30m_k_data,             Provider.BaoStock,  0,  50, "Stock 30 mins K-Data",     24,      RunMode.Parallel],
-    ["task_chn_29", task.get_stock_15m_k_data,             Provider.BaoStock,  0,  40, "Stock 15 mins K-Data",     24,      RunMode.Parallel],
-    ["task_chn_30", task.get_stock_5m_k_data,              Provider.BaoStock,  0,  20, "Stock 5 mins  K-Data",     24,      RunMode.Parallel],
-    # ["task_chn_31", task.get_stock_1m_k_data,              Provider.BaoStock,  0, 10, "Stock 1 mins  K-Data",     24,      RunMode.Parallel],
-
-    # ["task_chn_32", task.get_stock_1d_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock Daily   HFQ K-Data", 24,      RunMode.Parallel],
-    # ["task_chn_33", task.get_stock_1w_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock Weekly  HFQ K-Data", 24,      RunMode.Parallel],
-    # ["task_chn_34", task.get_stock_1mon_hfq_k_data,        Provider.BaoStock,  0, 10, "Stock Monthly HFQ K-Data", 24,      RunMode.Parallel],
-    # ["task_chn_35", task.get_stock_1h_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock 1 hours HFQ K-Data", 24,      RunMode.Parallel],
-    # ["task_chn_36", task.get_stock_30m_hfq_k_data,         Provider.BaoStock,  0, 10, "Stock 30 mins HFQ K-Data", 24,      RunMode.Parallel],
-    # ["task_chn_37", task.get_stock_15m_hfq_k_data,         Provider.BaoStock,  0, 10, "Stock 15 mins HFQ K-Data", 24,      RunMode.Parallel],
-    # ["task_chn_38", task.get_stock_5m_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock 5 mins  HFQ K-Data", 24,      RunMode.Parallel],
-    # ["task_chn_39", task.get_stock_1m_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock 1 mins HFQ K-Data",  24,      RunMode.Parallel],
+    # ["task_chn_13", task.get_finance_factor_data,          Provider.EastMoney, 0, 10, "Finance Factor",           24 * 6,  RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_14", task.get_balance_sheet_data,           Provider.EastMoney, 0, 10, "Balance Sheet",            24 * 6,  RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_15", task.get_income_statement_data,        Provider.EastMoney, 0, 10, "Income Statement",         24 * 6,  RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_16", task.get_cashflow_statement_data,      Provider.EastMoney, 0, 10, "CashFlow Statement",       24,      RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_17", task.get_stock_valuation_data,         Provider.JoinQuant, 0, 10, "Stock Valuation",          24,      RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_18", task.get_cross_market_summary_data,    Provider.JoinQuant, 0, 10, "Cross Market Summary",     24,      RunMode.Parallel, []],
+    # ["task_chn_19", task.get_stock_summary_data,           Provider.Exchange,  0, 10, "Stock Summary",            24,      RunMode.Parallel, []],
+    # ["task_chn_20", task.get_margin_trading_summary_data,  Provider.JoinQuant, 0, 10, "Margin Trading Summary",   24,      RunMode.Parallel, []],
+    # ["task_chn_21", task.get_etf_valuation_data,           Provider.JoinQuant, 0, 10, "ETF Valuation",            24,      RunMode.Parallel, ["task_chn_01"]],
+    # ["task_chn_22", task.get_moneyflow_data,               Provider.Sina,      1, 10, "MoneyFlow Statement",      24,      RunMode.Parallel, ["task_chn_01"]],
+
+    # ["task_chn_23", task.get_etf_1d_k_data,                Provider.Sina,      0, 10, "ETF Daily K-Data",         24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    ["task_chn_24", task.get_stock_1d_k_data,              Provider.BaoStock,  0, 100, "Stock Daily   K-Data",     24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    ["task_chn_25", task.get_stock_1w_k_data,              Provider.BaoStock,  0, 100, "Stock Weekly  K-Data",     24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    ["task_chn_26", task.get_stock_1mon_k_data,            Provider.BaoStock,  0, 100, "Stock Monthly K-Data",     24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    ["task_chn_27", task.get_stock_1h_k_data,              Provider.BaoStock,  0,  50, "Stock 1 hours K-Data",     24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    ["task_chn_28", task.get_stock_30m_k_data,             Provider.BaoStock,  0,  50, "Stock 30 mins K-Data",     24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    ["task_chn_29", task.get_stock_15m_k_data,             Provider.BaoStock,  0,  40, "Stock 15 mins K-Data",     24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    ["task_chn_30", task.get_stock_5m_k_data,              Provider.BaoStock,  0,  20, "Stock 5 mins  K-Data",     24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    # ["task_chn_31", task.get_stock_1m_k_data,              Provider.BaoStock,  0, 10, "Stock 1 mins  K-Data",     24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+
+    # ["task_chn_32", task.get_stock_1d_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock Daily   HFQ K-Data", 24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    # ["task_chn_33", task.get_stock_1w_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock Weekly  HFQ K-Data", 24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    # ["task_chn_34", task.get_stock_1mon_hfq_k_data,        Provider.BaoStock,  0, 10, "Stock Monthly HFQ K-Data", 24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    # ["task_chn_35", task.get_stock_1h_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock 1 hours HFQ K-Data", 24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    # ["task_chn_36", task.get_stock_30m_hfq_k_data,         Provider.BaoStock,  0, 10, "Stock 30 mins HFQ K-Data", 24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    # ["task_chn_37", task.get_stock_15m_hfq_k_data,         Provider.BaoStock,  0, 10, "Stock 15 mins HFQ K-Data", 24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    # ["task_chn_38", task.get_stock_5m_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock 5 mins  HFQ K-Data", 24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
+    # ["task_chn_39", task.get_stock_1m_hfq_k_data,          Provider.BaoStock,  0, 10, "Stock 1 mins HFQ K-Data",  24,      RunMode.Parallel, ["task_chn_01", "task_chn_02"]],
 ]
 
 
 task_set_us = [
-    ["task_us_01", task.get_stock_list_data,              Provider.Exchange,  0, 3, "Stock List",               24,      RunMode.Serial],
-    ["task_us_02", task.get_stock_trade_day,              Provider.Yahoo,     0, 3, "Trade Day",                24,      RunMode.Serial],
-    ["task_us_03", task.get_stock_main_index,             Provider.Exchange,  0, 3, "Main Index",               24,      RunMode.Serial],
-    ["task_us_04", task.get_stock_detail_data,            Provider.Yahoo,     0, 3, "Stock Detail",             24 * 6,  RunMode.Parallel],
-
-    ["task_us_05", task.get_index_1d_k_data,              Provider.Yahoo,     0, 3, "Index Daily   K-Data",     24,      RunMode.Parallel],
-    ["task_us_06", task.get_stock_1d_k_data,              Provider.Yahoo,     0, 3, "Stock Daily   K-Data",     24,      RunMode.Parallel],
-    ["task_us_07", task.get_stock_1w_k_data,              Provider.Yahoo,     0, 3, "Stock Weekly  K-Data",     24,      RunMode.Parallel],
-    ["task_us_08", task.get_stock_1mon_k_data,            Provider.Yahoo,     0, 3, "Stock Monthly K-Data",     24,      RunMode.Parallel],
-    ["task_us_09", task.get_stock_1h_k_data,              Provider.Yahoo,     0, 3, "Stock 1 hours K-Data",     24,      RunMode.Parallel],
-    ["task_us_10", task.get_stock_30m_k_data,             Provider.Yahoo,     0, 3, "Stock 30 mins K-Data",     24,      RunMode.Parallel],
-    ["task_us_11", task.get_stock_15m_k_data,             Provider.Yahoo,     0, 3, "Stock 15 mins K-Data",     24,      RunMode.Parallel],
-    ["task_us_12", task.get_stock_5m_k_data,              Provider.Yahoo,     0, 3, "Stock 5 mins  K-Data",     24,      RunMode.Parallel],
-    ["task_us_13", task.get_stock_1m_k_data,              Provider.Yahoo,     0, 3, "Stock 1 mins  K-Data",     24,      RunMode.Parallel],
+    ["task_us_01", task.get_stock_list_data,              Provider.Exchange,  0, 3, "Stock List",               24,      RunMode.Serial,   []],
+    ["task_us_02", task.get_stock_trade_day,              Provider.Yahoo,     0, 3, "Trade Day",                24,      RunMode.Serial,   []],
+    ["task_us_03", task.get_stock_main_index,             Provider.Exchange,  0, 3, "Main Index",               24,      RunMode.Serial,   []],
+    ["task_us_04", task.get_stock_detail_data,            Provider.Yahoo,     0, 3, "Stock Detail",             24 * 6,  RunMode.Parallel, ["task_us_01"]],
+
+    ["task_us_05", task.get_index_1d_k_data,              Provider.Yahoo,     0, 3, "Index Daily   K-Data",     24,      RunMode.Parallel, ["task_us_02", "task_us_03"]],
+    ["task_us_06", task.get_stock_1d_k_data,              Provider.Yahoo,     0, 3, "Stock Daily   K-Data",     24,      RunMode.Parallel, ["task_us_01", "task_us_02"]],
+    ["task_us_07", task.get_stock_1w_k_data,              Provider.Yahoo,     0, 3, "Stock Weekly  K-Data",     24,      RunMode.Parallel, ["task_us_01", "task_us_02"]],
+    ["task_us_08", task.get_stock_1mon_k_data,            Provider.Yahoo,     0, 3, "Stock Monthly K-Data",     24,      RunMode.Parallel, ["task_us_01", "task_us_02"]],
+    ["task_us_09", task.get_stock_1h_k_data,              Provider.Yahoo,     0, 3, "Stock 1 hours K-Data",     24,      RunMode.Parallel, ["task_us_01", "task_us_02"]],
+    ["task_us_10", task.get_stock_30m_k_data,             Provider.Yahoo,     0, 3, "Stock 30 mins K-Data",     24,      RunMode.Parallel, ["task_us_01", "task_us_02"]],
+    ["task_us_11", task.get_stock_15m_k_data,             Provider.Yahoo,     0, 3, "Stock 15 mins K-Data",     24,      RunMode.Parallel, ["task_us_01", "task_us_02"]],
+    ["task_us_12", task.get_stock_5m_k_data,              Provider.Yahoo,     0, 3, "Stock 5 mins  K-Data",     24,      RunMode.Parallel, ["task_us_01", "task_us_02"]],
+    ["task_us_13", task.get_stock_1m_k_data,              Provider.Yahoo,     0, 3, "Stock 1 mins  K-Data",     24,      RunMode.Parallel, ["task_us_01", "task_us_02"]],
 ]
 
 
@@ -333,111 +339,255 @@ class Para(enum.Enum):
     Desc = 5
     Cache = 6
     Mode = 7
+    # task ids to finish before the task starts
+    Deps = 8
 
 
-async def loop_task_set(args):
+async def loop_task_set(args, shard=None):
+    from findy.database.instrument import current_task, dump_stats
+
     now = time.time()
     region, item, _ = args
 
-    logger.info(f"Start Func: {item[Para.FunName.value].__name__}")
+    # attribute the sql statements of this task to it
+    current_task.set(item[Para.FunName.value].__name__)
+    # the recorder keeps the entities of this shard only
+    current_shard.set(shard)
+
+    # duration, entities, rows and bytes of this unit for the run ledger
+    unit = start_unit(item[Para.FunName.value].__name__, None if shard is None else shard_label(shard))
+
+    name = item[Para.FunName.value].__name__ if shard is None else f"{item[Para.FunName.value].__name__} [{shard_label(shard)}]"
+    logger.info(f"Start Func: {name}")
     await item[Para.FunName.value](region, item[Para.Provider.value], item[Para.Sleep.value], item[Para.Processor.value], item[Para.Desc.value])
-    logger.info(f"End Func: {item[Para.FunName.value].__name__}, cost: {time.time() - now}\n")
-    return item
+    logger.info(f"End Func: {name}, cost: {time.time() - now}\n")
 
+    dump_stats()
+    return finish_unit(unit)
 
-async def fetch_process(region: Region, kafka_producer):
-    print("")
-    print("*" * 80)
-    print(f"*    Start Fetching {region.value.upper()} Stock information...      {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("*" * 80)
 
+# config set in the parent at run time (cli flags), the spawned pool processes only reload config.json
+runtime_config_keys = ('debug', 'checkpoint_resume')
+
+
+def runtime_config():
+    return {key: findy_config[key] for key in runtime_config_keys if key in findy_config}
+
+
+def init_pool_process(rate_limits, transport, keep_sessions=False, config=None):
+    # state shared by the pool processes, handed over at their start
+    findy_config.update(config or {})
+    init_rate_limits(rate_limits)
+    init_progress(transport)
+    keep_http_sessions(keep_sessions)
+
+
+def get_tasks(region: Region, task_ids=None, force=False):
+    """
+    the tasks of the region not run within their cache hours, None for a region without task set
+
+    task_ids: only these tasks, force: regardless of the cache
+    the rows are copied, a run may change them
+    """
     if region == Region.CHN:
         task_set = task_set_chn
     elif region == Region.US:
         task_set = task_set_us
     else:
+        return None
+
+    schedule_cache = get_cache(f'update_schedule_log_{region.value}') or {}
+    return [(region, list(item), index) for index, item in enumerate(task_set)
+            if (task_ids is None or item[Para.TaskID.value] in task_ids) and
+            (force or not valid(region, item[Para.FunName.value].__name__, item[Para.Cache.value], schedule_cache))]
+
+
+def plan_tasks(region: Region, tasks_list):
+    """
+    cost model of the run from the run ledger
+
+    a task costs the median of its recent total unit seconds, a task never recorded is taken as the
+    longest one so it does not end up as the straggler, the shards split a task evenly,
+    childconcurrency is the lowest whose predicted wall time is within 5% of the best
+    """
+    nodes = {task[1][Para.TaskID.value]: task for task in tasks_list}
+    deps = {key: task[1][Para.Deps.value] for key, task in nodes.items()}
+    pooled = {key for key, task in nodes.items() if task[1][Para.Mode.value] == RunMode.Parallel}
+
+    tasks = len(pooled)
+    cpus = max(1, min(tasks, os.cpu_count()))
+    shards = max(1, findy_config.get('fetch_shards') or cpus)
+
+    ledger = load_ledger()
+    known = {key: task_cost(ledger, region, task[1][Para.FunName.value].__name__) for key, task in nodes.items()}
+    longest = max([cost for cost in known.values() if cost is not None], default=0.0)
+    costs = {key: longest if cost is None else cost for key, cost in known.items()}
+    units = {key: [costs[key] / shards] * shards if key in pooled else [costs[key]] for key in nodes}
+
+    childconcurrency = max(1, round(tasks / cpus))
+    finish = simulate_dag(nodes, deps, units, cpus * childconcurrency, pooled)
+
+    if longest > 0:
+        plans = {}
+        for concurrency in range(1, max(1, math.ceil(tasks * shards / cpus)) + 1):
+            plans[concurrency] = simulate_dag(nodes, deps, units, cpus * concurrency, pooled)
+        best = min(max(plan.values(), default=0.0) for plan in plans.values())
+        childconcurrency = min(concurrency for concurrency, plan in plans.items() if max(plan.values(), default=0.0) <= best * 1.05)
+        finish = plans[childconcurrency]
+
+    return {'nodes': nodes, 'deps': deps, 'costs': costs, 'known': known, 'cpus': cpus, 'shards': shards,
+            'childconcurrency': childconcurrency, 'finish': finish, 'wall': max(finish.values(), default=0.0)}
+
+
+def report_plan(region: Region, dry_run=True):
+    """
+    print the tasks of the planned run with their predicted finish, nothing is fetched
+    """
+    tasks_list = get_tasks(region)
+    if tasks_list is None:
+        return None
+
+    plan = plan_tasks(region, tasks_list)
+
+    print("")
+    print(f"{region.value.upper()} fetching plan, pool: {plan['cpus']} processes x {plan['childconcurrency']} tasks, {plan['shards']} shards per parallel task")
+    for key, task in sorted(plan['nodes'].items(), key=lambda item: plan['finish'].get(item[0], 0.0)):
+        cost = "    unknown" if plan['known'][key] is None else f"{plan['costs'][key]:>10.1f}s"
+        print(f"    {key:<12} {task[1][Para.Desc.value]:<26} cost: {cost}, finish at: {plan['finish'].get(key, 0.0):>10.1f}s")
+    print(f"predicted wall time: {timedelta(seconds=round(plan['wall']))}")
+    print("")
+    return plan
+
+
+async def fetch_process(region: Region, progress):
+    print("")
+    print("*" * 80)
+    print(f"*    Start Fetching {region.value.upper()} Stock information...      {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("*" * 80)
+
+    tasks_list = get_tasks(region)
+    if tasks_list is None:
         return
 
     print("")
     print("parallel fetching processing...")
     print("")
 
+    await run_tasks(region, tasks_list, progress)
+
+
+async def run_tasks(region: Region, tasks_list, progress, pool=None):
+    """
+    run the tasks as a DAG, on the given warm pool or on a pool sized by the plan, returns task id -> state
+    """
     schedule_log_file = f'update_schedule_log_{region.value}'
     schedule_cache = get_cache(schedule_log_file)
 
     if schedule_cache is None:
         schedule_cache = {}
 
-    tasks_list = [(region, item, index) for index, item in enumerate(task_set) if not valid(region, item[Para.FunName.value].__name__, item[Para.Cache.value], schedule_cache)]
-
     pbar_update = {"task": "main", "total": len(tasks_list), "desc": "Total Jobs", "position": 0, "leave": True, "update": 0}
-    publish_message(kafka_producer, progress_topic, progress_key, msgpack.dumps(pbar_update))
+    progress.update(pbar_update)
 
-    for task in tasks_list[:]:
+    for task in tasks_list:
         task[1][Para.Desc.value] = (task[2] + 2, task[1][Para.Desc.value])
 
-        if task[1][Para.Mode.value] == RunMode.Serial:
-            result = await loop_task_set(task)
+    # tasks cached as up to date are not scheduled, their dependents start at once
+    plan = plan_tasks(region, tasks_list)
+    nodes, deps, costs = plan['nodes'], plan['deps'], plan['costs']
+    logger.info(f"predicted wall time: {timedelta(seconds=round(plan['wall']))}, childconcurrency: {plan['childconcurrency']}")
+
+    # task -> units finished in this run, written to the run ledger at the end
+    runs = {}
 
-            publish_message(kafka_producer, progress_topic, progress_key,
-                            msgpack.dumps({"command": "@task-finish", "task": result[Para.Desc.value][0]}))
+    def on_finish(key, task, state, result):
+        progress.command({"command": "@task-finish", "task": task[1][Para.Desc.value][0]})
 
-            pbar_update['update'] = 1
-            publish_message(kafka_producer, progress_topic, progress_key, msgpack.dumps(pbar_update))
+        pbar_update['update'] = 1
+        progress.update(pbar_update)
 
-            schedule_cache.update({f"{task[0].value}_{result[Para.FunName.value].__name__}": datetime.now()})
+        if state == DONE:
+            schedule_cache.update({f"{region.value}_{task[1][Para.FunName.value].__name__}": datetime.now()})
             dump_cache(schedule_log_file, schedule_cache)
-            tasks_list.remove(task)
+            runs[task[1][Para.FunName.value].__name__] = result if isinstance(result, list) else [result]
+
+    # a parallel task is queued as entity shards, a process done with its own work takes the next shard
+    # of whichever task is still running
+    shards = plan['shards'] if pool is None else max(1, findy_config.get('fetch_shards') or pool.process_count)
+
+    async def run(task):
+        # serial tasks run in this process, concurrently with each other once their inputs are ready
+        if task[1][Para.Mode.value] == RunMode.Serial:
+            return await loop_task_set(task)
+        if shards == 1:
+            return await pool.apply(loop_task_set, (task,))
+        return await asyncio.gather(*[pool.apply(loop_task_set, (task, (index, shards))) for index in range(shards)])
 
     Multi = True
-    if Multi:
-        tasks = len(tasks_list)
-        cpus = max(1, min(tasks, os.cpu_count()))
-        childconcurrency = max(1, round(tasks / cpus))
-
-        current_os = platform.system().lower()
-        if current_os != "windows":
-            import uvloop
-            loop_initializer = uvloop.new_event_loop
-        else:
-            loop_initializer = None
-
-        async with amp.Pool(cpus, childconcurrency=childconcurrency, loop_initializer=loop_initializer) as pool:
-            async for result in pool.map(loop_task_set, tasks_list):
-                publish_message(kafka_producer, progress_topic, progress_key,
-                                msgpack.dumps({"command": "@task-finish", "task": result[Para.Desc.value][0]}))
-
-                pbar_update['update'] = 1
-                publish_message(kafka_producer, progress_topic, progress_key, msgpack.dumps(pbar_update))
-
-                schedule_cache.update({f"{region.value}_{result[Para.FunName.value].__name__}": datetime.now()})
-                dump_cache(schedule_log_file, schedule_cache)
+    if pool is not None:
+        # the tasks getting ready together are queued longest first
+        states = await run_dag(nodes, deps, run, on_finish, cost=costs.get)
+    elif Multi:
+        async with create_pool(plan['cpus'], plan['childconcurrency']) as pool:
+            states = await run_dag(nodes, deps, run, on_finish, cost=costs.get)
     else:
-        for task in tasks_list:
-            result = await loop_task_set(task)
+        states = await run_dag(nodes, deps, loop_task_set, on_finish, cost=costs.get)
 
-            publish_message(kafka_producer, progress_topic, progress_key,
-                            msgpack.dumps({"command": "@task-finish", "task": result[Para.Desc.value][0]}))
+    record_runs(region, runs)
+    return states
 
-            pbar_update['update'] = 1
-            publish_message(kafka_producer, progress_topic, progress_key, msgpack.dumps(pbar_update))
 
-            schedule_cache.update({f"{region.value}_{result[Para.FunName.value].__name__}": datetime.now()})
-            dump_cache(schedule_log_file, schedule_cache)
+def create_pool(cpus, childconcurrency, keep_sessions=False):
+    current_os = platform.system().lower()
+    if current_os != "windows":
+        import uvloop
+        loop_initializer = uvloop.new_event_loop
+    else:
+        loop_initializer = None
+
+    # token buckets in shared memory, every pool process takes from the same provider quota
+    rate_limits = create_rate_limits(amp.core.get_context())
+
+    return amp.Pool(cpus, childconcurrency=childconcurrency, loop_initializer=loop_initializer,
+                    initializer=init_pool_process, initargs=(rate_limits, get_progress_transport(), keep_sessions, runtime_config()))
+
 
+def fetching(region: Region, dry_run=False):
+    from findy.database.instrument import clear_stats, report_stats
 
-def fetching(region: Region):
-    pbar = ProgressBarProcess()
+    if dry_run:
+        report_plan(region)
+        return
+
+    clear_stats()
+
+    # kafka when a broker is configured, the dashboard follows the progress, queue otherwise,
+    # see progress_transport_kind
+    transport = create_progress_transport(amp.core.get_context())
+    init_progress(transport)
+
+    pbar = ProgressBarProcess(transport, context=amp.core.get_context())
     pbar.start()
 
-    kafka_producer = pbar.getProducer()
-    print("waiting for kafka connection.....")
-    time.sleep(5)
+    progress = ProgressReporter(transport)
+    if isinstance(transport, KafkaTransport):
+        # the consumer subscribes at the latest offset, messages sent before are lost
+        print("waiting for kafka connection.....")
+    if not pbar.wait_ready(findy_config.get('progress_ready_timeout', 30)):
+        logger.warning('progress consumer not ready, the first progress updates may be lost')
+
+    try:
+        from findy.database.context import get_db_engine
+        from findy.database.indexes import report_indexes
+        report_indexes(region, get_db_engine(region))
+    except Exception as e:
+        logger.warning(f'index report failed with error: {e}')
+
+    asyncio.run(fetch_process(region, progress))
 
-    asyncio.run(fetch_process(region, kafka_producer))
+    report_stats()
 
-    pbar_update = {"command": "@end"}
-    publish_message(kafka_producer, progress_topic, progress_key, msgpack.dumps(pbar_update))
+    progress.command({"command": "@end"})
 
     pbar.join()
 
@@ -155,11 +155,11 @@ class DataReader(object):
                 entity_id=entity_id,
                 index=[self.category_field, self.time_field],
                 order=data_schema.timestamp.desc(),
-                limit=window)
+                limit=window,
+                return_type='df')
 
-            if data and len(data) > 0:
-                df = pd.DataFrame([s.__dict__ for s in data], columns=column_names)
-                dfs.append(df)
+            if data is not None and len(data) > 0:
+                dfs.append(data)
         if dfs:
             window_df = pd.concat(dfs)
             window_df = window_df.sort_index(level=[0, 1])
@@ -208,12 +208,10 @@ class DataReader(object):
             limit=self.limit,
             level=self.level,
             index=[self.category_field, self.time_field],
-            time_field=self.time_field)
+            time_field=self.time_field,
+            return_type='df')
 
-        if data and not self.columns:
-            self.data_df = pd.DataFrame([s.__dict__ for s in data], columns=column_names)
-        else:
-            self.data_df = pd.DataFrame(data, columns=column_names)
+        self.data_df = data if data is not None else pd.DataFrame(columns=column_names)
 
         cost_time = time.time() - start_time
         self.logger.info(f'load_data finished, cost_time:{cost_time}')
@@ -295,9 +293,10 @@ def load_company_info(tickers=None):
         provider=Provider.Yahoo,
         entity_schema=entity_schema,
         db_session=db_session,
-        codes=tickers)
+        codes=tickers,
+        return_type='df')
 
-    df = pd.DataFrame([s.__dict__ for s in entities], columns=column_names)
+    df = entities if entities is not None else pd.DataFrame(columns=column_names)
     df.reset_index(drop=True, inplace=True)
 
     return df
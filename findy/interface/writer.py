@@ -19,8 +19,9 @@ async def write_data(region: Region,
                      ref_entity = None,
                      drop_duplicates: bool = True,
                      fix_duplicate_way: str = 'ignore',
-                     force_update=False) -> object:
-    await df_to_db(region, provider, data_schema, db_session, df, ref_entity, drop_duplicates, fix_duplicate_way, force_update)
+                     force_update=False,
+                     upsert=False) -> object:
+    await df_to_db(region, provider, data_schema, db_session, df, ref_entity, drop_duplicates, fix_duplicate_way, force_update, upsert)
 
 
 def del_data(db_session, data_schema: Type[Mixin], filters: List = None):
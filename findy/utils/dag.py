@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+async def run_dag(nodes: dict, deps: dict, run, on_finish=None, cost=None) -> dict:
+    """
+    start every node as soon as all its dependencies are done, independent nodes run concurrently
+
+    nodes: key -> item
+    deps: key -> keys it depends on, keys out of nodes count as done (not scheduled this run)
+    run: coroutine function taking the item
+    on_finish: called with (key, item, state, result or exception) once a node is done, failed or skipped
+    cost: key -> expected duration, the nodes getting ready together start longest first
+
+    the dependents of a failed node are skipped, returns key -> state
+    """
+    deps = {key: {dep for dep in deps.get(key, ()) if dep in nodes} for key in nodes}
+    states = {}
+    running = {}
+
+    def finish(key, state, result=None):
+        states[key] = state
+        if on_finish is not None:
+            on_finish(key, nodes[key], state, result)
+
+    order = list(nodes) if cost is None else sorted(nodes, key=cost, reverse=True)
+
+    while True:
+        for key in order:
+            if key in states or key in running:
+                continue
+            if any(states.get(dep) in (FAILED, SKIPPED) for dep in deps[key]):
+                logger.warning(f'{key} skipped, dependencies failed: {[dep for dep in deps[key] if states.get(dep) != DONE]}')
+                finish(key, SKIPPED)
+            elif all(states.get(dep) == DONE for dep in deps[key]):
+                running[key] = asyncio.ensure_future(run(nodes[key]))
+
+        if not running:
+            break
+
+        done, _ = await asyncio.wait(running.values(), return_when=asyncio.FIRST_COMPLETED)
+        for key in [key for key, future in running.items() if future in done]:
+            future = running.pop(key)
+            if future.exception() is not None:
+                logger.error(f'{key} failed with error: {future.exception()}')
+                finish(key, FAILED, future.exception())
+            else:
+                finish(key, DONE, future.result())
+
+    # left over nodes wait on each other
+    for key in nodes:
+        if key not in states:
+            logger.error(f'{key} skipped, dependency cycle: {deps[key]}')
+            finish(key, SKIPPED)
+
+    return states
+
+
+def simulate_dag(nodes, deps: dict, units: dict, slots: int, pooled) -> dict:
+    """
+    predict the finish time of every node the way run_dag and a pool of slots run them
+
+    units: key -> durations of the units the node is split into
+    pooled: keys whose units queue for a free slot in submit order, the others run at once
+
+    the nodes getting ready together are submitted longest first, returns key -> finish time
+    """
+    deps = {key: {dep for dep in deps.get(key, ()) if dep in nodes} for key in nodes}
+    order = sorted(nodes, key=lambda key: sum(units[key]), reverse=True)
+
+    finish = {}
+    remaining = {}
+    queue = []
+    running = []
+    free = slots
+    now = 0.0
+    seq = 0
+
+    while len(finish) < len(nodes):
+        ready = [key for key in order if key not in finish and key not in remaining and deps[key].issubset(finish)]
+        for key in ready:
+            durations = units[key] or [0.0]
+            remaining[key] = len(durations)
+            for duration in durations:
+                if key in pooled:
+                    queue.append((key, duration))
+                else:
+                    heapq.heappush(running, (now + duration, seq, key, False))
+                    seq += 1
+
+        while free > 0 and queue:
+            key, duration = queue.pop(0)
+            heapq.heappush(running, (now + duration, seq, key, True))
+            seq += 1
+            free -= 1
+
+        if not running:
+            # cycle, run_dag skips the rest
+            break
+
+        now, _, key, slot = heapq.heappop(running)
+        if slot:
+            free += 1
+        remaining[key] -= 1
+        if remaining[key] == 0:
+            finish[key] = now
+
+    return finish
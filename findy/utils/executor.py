@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from findy import findy_config
+
+logger = logging.getLogger(__name__)
+
+# kind -> executor of this process
+__executors = {}
+
+
+def get_format_executor(kind: str = None, workers: int = None):
+    """
+    executor the recorders hand the raw payloads to for formatting, one per process
+
+    kind: 'process' (default) or 'thread', config format_executor
+    workers: config format_workers
+    """
+    kind = kind or findy_config.get('format_executor', 'process')
+    executor = __executors.get(kind)
+    if executor is not None:
+        return executor
+
+    workers = workers or findy_config.get('format_workers', 2)
+    if kind == 'process':
+        # spawn as the fetching pool does, the worker does not inherit the event loop and db connections
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='format')
+
+    logger.debug(f'format executor: {kind}, workers: {workers}')
+    __executors[kind] = executor
+    return executor
+
+
+def shutdown_executors(wait=True):
+    for executor in __executors.values():
+        executor.shutdown(wait=wait)
+    __executors.clear()
@@ -22,10 +22,12 @@ def connect_kafka_consumer(topic, server, gropuid=None):
     return KafkaConsumer(topic, bootstrap_servers=[server], group_id=gropuid, api_version=(2, 5, 0))
 
 
-def publish_message(producer_instance, topic_name, key_bytes, value_bytes):
+def publish_message(producer_instance, topic_name, key_bytes, value_bytes, flush=True):
     try:
+        # send only buffers, flush waits for the broker round trip
         producer_instance.send(topic_name, key=key_bytes, value=value_bytes)
-        producer_instance.flush()
+        if flush:
+            producer_instance.flush()
         # print('Message published successfully.', value_bytes)
         # print("")
     except Exception as ex:
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import time
+from datetime import datetime
+
+from aiohttp import TraceConfig
+
+from findy.utils.cache import get_cache, dump_cache
+
+LEDGER_FILE = 'run_ledger'
+
+# runs kept per task, the cost model takes their median
+HISTORY = 7
+
+# counters of the task unit (task or shard) running in this context, set by loop_task_set
+current_run = contextvars.ContextVar('run_ledger', default=None)
+
+
+def start_unit(task: str, shard=None) -> dict:
+    unit = {'task': task, 'shard': shard, 'start': time.time(), 'duration': 0.0, 'entities': 0, 'rows': 0, 'bytes': 0}
+    current_run.set(unit)
+    return unit
+
+
+def finish_unit(unit: dict) -> dict:
+    unit['duration'] = time.time() - unit['start']
+    return unit
+
+
+def count_run(key: str, value: int):
+    unit = current_run.get()
+    if unit is not None:
+        unit[key] += value
+
+
+def ledger_trace_config() -> TraceConfig:
+    """
+    aiohttp hook counting the bytes of the response bodies into the running unit
+    """
+    async def on_response_chunk_received(session, context, params):
+        count_run('bytes', len(params.chunk))
+
+    trace_config = TraceConfig()
+    trace_config.on_response_chunk_received.append(on_response_chunk_received)
+    return trace_config
+
+
+def load_ledger() -> dict:
+    # f"{region}_{task}" -> runs, oldest first, every run {'timestamp': datetime, 'units': [unit, ...]}
+    return get_cache(LEDGER_FILE) or {}
+
+
+def record_runs(region, runs: dict):
+    """
+    runs: task -> units of the task finished in this run
+    """
+    ledger = load_ledger()
+    for task, units in runs.items():
+        history = ledger.setdefault(f"{region.value}_{task}", [])
+        history.append({'timestamp': datetime.now(), 'units': units})
+        del history[:-HISTORY]
+    dump_cache(LEDGER_FILE, ledger)
+
+
+def task_cost(ledger: dict, region, task: str):
+    """
+    median of the total unit seconds of the recent runs, None for a task never recorded
+    """
+    history = ledger.get(f"{region.value}_{task}")
+    if not history:
+        return None
+    works = sorted(sum(unit['duration'] for unit in run['units']) for run in history)
+    return works[len(works) // 2]
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiohttp import TraceConfig
+
+logger = logging.getLogger(__name__)
+
+# (provider, host) -> limiter, shared by the recorders of one process,
+# host None is the limiter of the provider the recorders hold while fetching an entity
+__limiters = {}
+
+
+class AdaptiveLimiter(object):
+    """
+    concurrency limit adjusted by AIMD: grows by one slot per round of successful samples,
+    shrinks by backoff on 429/5xx, connection errors, error rate over threshold, or latency
+    drifting over tolerance times the baseline
+
+    the limiter of a provider also bounds every host its sessions talk to, see trace_config
+    """
+
+    def __init__(self,
+                 name: str,
+                 initial: int = 10,
+                 min_limit: int = 1,
+                 max_limit: int = None,
+                 backoff: float = 0.7,
+                 tolerance: float = 2.0,
+                 error_rate: float = 0.2,
+                 window: int = 20) -> None:
+        self.name = name
+        self.initial = initial
+        self.limit = float(max(initial, min_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit if max_limit else max(initial * 4, min_limit)
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.error_rate = error_rate
+        self.window = window
+
+        self.in_flight = 0
+        self.baseline = None
+        self.samples = 0
+        self.errors = 0
+        self.last_decrease = 0.0
+
+        self._waiters = deque()
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self):
+        if self.in_flight < self.current and not self._waiters:
+            self.in_flight += 1
+            return
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # woken up and cancelled at the same time, hand the slot back
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.current:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def resize(self, initial: int):
+        """
+        a later user asks for a higher start point, the ceiling grows to it, the limit keeps what it learned,
+        a lower one leaves the limiter as is, the users holding it keep their ceiling
+        """
+        if initial <= self.initial:
+            return
+        logger.info(f'{self.name} initial limit: {self.initial} -> {initial}')
+        self.initial = initial
+        self.max_limit = max(self.max_limit, initial * 4, self.min_limit)
+        self._wake()
+
+    def _increase(self):
+        # additive, one slot per limit successful samples
+        self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._wake()
+
+    def _decrease(self, reason):
+        # at most once per baseline latency, one burst of failures is one congestion signal
+        now = time.time()
+        if now - self.last_decrease < max(self.baseline or 0, 1.0):
+            return
+        self.last_decrease = now
+
+        limit = max(self.min_limit, self.limit * self.backoff)
+        if int(limit) != self.current:
+            logger.info(f'{self.name} concurrency limit: {self.current} -> {int(limit)}, {reason}')
+        self.limit = limit
+
+    def on_sample(self, latency: float, ok: bool = True):
+        self.samples += 1
+        if not ok:
+            self.errors += 1
+
+        if ok:
+            # the baseline follows new lows at once and drifts up slowly
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                self.baseline += (latency - self.baseline) * 0.01
+
+        if self.samples >= self.window:
+            rate = self.errors / self.samples
+            self.samples = self.errors = 0
+            if rate > self.error_rate:
+                self._decrease(f'error rate: {rate:.2f}')
+                return
+
+        if not ok:
+            return
+
+        if latency > self.baseline * self.tolerance and latency > 1.0:
+            self._decrease(f'latency: {latency:.2f}s, baseline: {self.baseline:.2f}s')
+        else:
+            self._increase()
+
+    def on_overload(self, reason: str = 'overload'):
+        self._decrease(reason)
+
+    def trace_config(self) -> TraceConfig:
+        """
+        aiohttp hooks holding a slot of the (provider, host) limiter for every request of a session,
+        429/5xx and connection errors shrink the limit of that host only
+        """
+        def release(context):
+            limiter = getattr(context, 'host_limiter', None)
+            if limiter is not None:
+                context.host_limiter = None
+                limiter.release()
+            return limiter
+
+        async def on_request_start(session, context, params):
+            limiter = get_limiter(self.name, self.initial, host=params.url.host)
+            await limiter.acquire()
+            context.host_limiter = limiter
+            context.start = time.time()
+
+        async def on_request_redirect(session, context, params):
+            # the next hop acquires the slot of its own host
+            release(context)
+
+        async def on_request_end(session, context, params):
+            limiter = release(context)
+            if limiter is None:
+                return
+            status = params.response.status
+            if status == 429 or status >= 500:
+                limiter.on_overload(f'http {status}')
+            else:
+                limiter.on_sample(time.time() - context.start)
+
+        async def on_request_exception(session, context, params):
+            limiter = release(context)
+            if limiter is not None:
+                limiter.on_overload(type(params.exception).__name__)
+
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_redirect.append(on_request_redirect)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+
+def get_limiter(name: str, initial: int = 10, host: str = None) -> AdaptiveLimiter:
+    key = (name, host)
+    limiter = __limiters.get(key)
+    if limiter is None:
+        limiter = AdaptiveLimiter(f'{name}:{host}' if host else name, initial=initial)
+        __limiters[key] = limiter
+    elif initial > limiter.initial:
+        # shared by recorders asking for different start points, keep the highest ceiling
+        limiter.resize(initial)
+    return limiter
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+
+class MeteredQueue(asyncio.Queue):
+    """
+    bounded stage queue keeping depth and wait metrics
+    """
+
+    def __init__(self, name, maxsize=0) -> None:
+        super().__init__(maxsize=maxsize)
+        self.name = name
+        self.puts = 0
+        self.max_depth = 0
+        self.depth_sum = 0
+        # time producers were blocked by a full queue / consumers by an empty one
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    async def put(self, item):
+        start = time.time()
+        await super().put(item)
+        self.put_wait += time.time() - start
+        if item is None:
+            return
+
+        depth = self.qsize()
+        self.puts += 1
+        self.depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    async def get(self):
+        start = time.time()
+        item = await super().get()
+        self.get_wait += time.time() - start
+        return item
+
+    def metrics(self) -> str:
+        avg = self.depth_sum / self.puts if self.puts else 0
+        return (f'{self.name}: items: {self.puts}, depth avg: {avg:.1f}, max: {self.max_depth}/{self.maxsize}, '
+                f'put wait: {self.put_wait:.2f}s, get wait: {self.get_wait:.2f}s')
+
+
+async def run_stage(workers, handle, source: MeteredQueue, sink: MeteredQueue = None):
+    """
+    run workers taking items from source until the None sentinel, pass results (not None) to sink,
+    the sentinel is forwarded to sink once every worker of the stage is done
+    """
+    async def worker():
+        while (item := await source.get()) is not None:
+            result = await handle(item)
+            if sink is not None and result is not None:
+                await sink.put(result)
+        # leave the sentinel for the other workers of the stage
+        source.put_nowait(None)
+
+    await asyncio.gather(*[worker() for _ in range(workers)])
+
+    if sink is not None:
+        await sink.put(None)
+
+
+async def run_workers(workers, handle, items):
+    """
+    a fixed number of workers pulling items from an iterable or async iterable,
+    memory stays flat whatever the number of items
+    """
+    if hasattr(items, '__aiter__'):
+        iterator = items.__aiter__()
+        # an async generator does not allow concurrent __anext__
+        lock = asyncio.Lock()
+
+        async def next_item():
+            async with lock:
+                try:
+                    return True, await iterator.__anext__()
+                except StopAsyncIteration:
+                    return False, None
+    else:
+        iterator = iter(items)
+
+        async def next_item():
+            try:
+                return True, next(iterator)
+            except StopIteration:
+                return False, None
+
+    async def worker():
+        while True:
+            has_item, item = await next_item()
+            if not has_item:
+                break
+            await handle(item)
+
+    await asyncio.gather(*[worker() for _ in range(workers)])
+
+
+class PriorityFeed(object):
+    """
+    heap of items by (attempts, priority), smaller first, consumed as an async iterator,
+    a failed item comes back behind the fresh ones after a backoff, until max_retries is reached
+    """
+
+    def __init__(self, items=(), priority=None, max_retries: int = 2,
+                 backoff: float = 1.0, max_backoff: float = 60.0) -> None:
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.heap = []
+        # retried items not due yet, (ready at, seq, attempts, priority, item)
+        self.delayed = []
+        self.seq = itertools.count()
+        # id(item) -> (attempts, priority) of the items handed out
+        self.in_flight = {}
+        self._changed = asyncio.Event()
+
+        for item in items:
+            self.push(item, priority(item) if priority is not None else 0)
+
+    def __len__(self) -> int:
+        return len(self.heap) + len(self.delayed) + len(self.in_flight)
+
+    def push(self, item, priority=0, attempts=0):
+        # seq keeps the given order among equal priorities and never compares the items
+        heapq.heappush(self.heap, (attempts, priority, next(self.seq), item))
+        self._changed.set()
+
+    def _release_due(self) -> float:
+        """
+        move the delayed items which are due to the heap, seconds until the next one is due or None
+        """
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, attempts, priority, item = heapq.heappop(self.delayed)
+            self.push(item, priority, attempts)
+        return self.delayed[0][0] - now if self.delayed else None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            wait = self._release_due()
+            if self.heap:
+                break
+            # an item in flight may still come back for a retry
+            if not self.in_flight and wait is None:
+                raise StopAsyncIteration
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+        attempts, priority, _, item = heapq.heappop(self.heap)
+        self.in_flight[id(item)] = (attempts, priority)
+        return item
+
+    def retry_delay(self, attempts: int) -> float:
+        # exponential, jittered so the items failing together do not come back together
+        return random.uniform(0.5, 1) * min(self.max_backoff, self.backoff * 2 ** attempts)
+
+    def retry(self, item, delay: float = None, count: bool = True) -> bool:
+        """
+        queue a handed out item again after delay seconds, a backoff by its attempts when not given,
+        count False does not take an attempt, False when max_retries is reached
+        """
+        attempts, priority = self.in_flight.get(id(item), (0, 0))
+        if count:
+            if attempts >= self.max_retries:
+                return False
+            attempts += 1
+        if delay is None:
+            delay = self.retry_delay(attempts - 1)
+        if delay > 0:
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.seq), attempts, priority, item))
+            self._changed.set()
+        else:
+            self.push(item, priority, attempts)
+        return True
+
+    def done(self, item):
+        self.in_flight.pop(id(item), None)
+        self._changed.set()
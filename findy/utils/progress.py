@@ -6,39 +6,200 @@ import msgpack
 from tqdm.auto import tqdm
 
 from findy import findy_config
-from findy.utils.kafka import connect_kafka_producer, connect_kafka_consumer
+from findy.utils.kafka import connect_kafka_producer, connect_kafka_consumer, publish_message
 
 progress_topic = 'progress_topic'
 progress_key = bytes('progress_key', encoding='utf-8')
 
+# transport of this process, set by fetching and the pool initializer
+__transport = None
+
+
+class QueueTransport(object):
+    """
+    multiprocessing queue, handed to the pool processes at their start, no broker needed
+    """
+
+    def __init__(self, context=None) -> None:
+        self.queue = (context or multiprocessing.get_context()).Queue()
+
+    def send(self, value: bytes, flush=False):
+        # put only hands the bytes to the feeder thread of the queue
+        self.queue.put_nowait(value)
+
+    def flush(self):
+        pass
+
+    def messages(self, ready=None):
+        # the queue holds whatever is sent before the consumer reads it
+        if ready is not None:
+            ready.set()
+        while True:
+            yield self.queue.get()
+
+
+class KafkaTransport(object):
+    """
+    kafka topic, also read by the dashboard /progress stream
+    """
+
+    def __init__(self, server=None) -> None:
+        self.server = server or findy_config['kafka']
+        self.producer = None
+
+    def __getstate__(self):
+        # every process connects its own producer
+        return {'server': self.server, 'producer': None}
+
+    def get_producer(self):
+        if self.producer is None:
+            self.producer = connect_kafka_producer(self.server)
+        return self.producer
+
+    def send(self, value: bytes, flush=False):
+        publish_message(self.get_producer(), progress_topic, progress_key, value, flush=flush)
+
+    def flush(self):
+        try:
+            self.get_producer().flush()
+        except Exception:
+            pass
+
+    def messages(self, ready=None):
+        consumer = connect_kafka_consumer(progress_topic, self.server)
+        if ready is not None:
+            # the consumer starts at the latest offset, ready once the partitions are assigned
+            # and their positions fetched, the messages sent after are all read
+            while not consumer.assignment():
+                for records in consumer.poll(timeout_ms=100).values():
+                    for msg in records:
+                        yield msg.value
+            for partition in consumer.assignment():
+                consumer.position(partition)
+            ready.set()
+        for msg in consumer:
+            yield msg.value
+
+
+class NullTransport(object):
+    # no consumer in this process tree, recorders run alone
+    def send(self, value: bytes, flush=False):
+        pass
+
+    def flush(self):
+        pass
+
+
+def progress_transport_kind() -> str:
+    """
+    config progress_transport, 'queue' or 'kafka', when not set kafka as long as a broker is configured,
+    the dashboard /progress stream reads the kafka topic
+    """
+    kind = findy_config.get('progress_transport')
+    if kind:
+        return kind
+    return 'kafka' if findy_config.get('kafka') else 'queue'
+
+
+def create_progress_transport(context=None):
+    if progress_transport_kind() == 'kafka':
+        return KafkaTransport()
+    return QueueTransport(context)
+
+
+def init_progress(transport):
+    global __transport
+    __transport = transport
+
+
+def get_progress_transport():
+    if __transport is None:
+        # started outside fetching, only kafka may have a consumer listening
+        if progress_transport_kind() == 'kafka':
+            init_progress(KafkaTransport())
+        else:
+            init_progress(NullTransport())
+    return __transport
+
+
+class ProgressReporter(object):
+    """
+    aggregate the increments per task, publish at most every interval seconds or batch updates,
+    the first message of a task and the commands go out at once
+    """
+
+    def __init__(self, transport=None, interval: float = None, batch: int = None) -> None:
+        self.transport = transport or get_progress_transport()
+        self.interval = interval if interval is not None else findy_config.get('progress_interval', 0.5)
+        self.batch = batch if batch is not None else findy_config.get('progress_batch', 50)
+
+        # task -> latest message, its update is the sum of the pending increments
+        self.pending = {}
+        self.count = 0
+        self.last_publish = time.time()
+
+    def publish(self, message, flush=False):
+        self.transport.send(msgpack.dumps(message), flush=flush)
+
+    def update(self, pbar_update):
+        # the message creating the bar carries no increment, the consumers count its update once
+        if pbar_update.get('update', 0) == 0:
+            self.publish(pbar_update)
+            return
+
+        pending = self.pending.get(pbar_update['task'])
+        if pending is None:
+            self.pending[pbar_update['task']] = dict(pbar_update)
+        else:
+            update = pending['update'] + pbar_update['update']
+            pending.update(pbar_update)
+            pending['update'] = update
+
+        self.count += 1
+        if self.count >= self.batch or time.time() - self.last_publish >= self.interval:
+            self.flush()
+
+    def flush(self):
+        for message in self.pending.values():
+            self.publish(message)
+        self.pending.clear()
+        self.count = 0
+        self.last_publish = time.time()
+
+    def command(self, message):
+        # the pending increments first, a command must not overtake them
+        self.flush()
+        self.publish(message, flush=True)
+
+    def close(self):
+        self.flush()
+        self.transport.flush()
+
 
 class ProgressBarProcess():
-    def __init__(self, sleep=0.2):
-        self.kafka_producer = None
+    def __init__(self, transport, sleep=0.2, context=None):
+        self.transport = transport
 
         # 创建子进程
-        self.process = multiprocessing.Process(target=self.consuming, args=(sleep,))   
+        context = context or multiprocessing.get_context()
+        self.ready = context.Event()
+        self.process = context.Process(target=self.consuming, args=(transport, sleep, self.ready))
 
     def __del__(self):
         if self.process.is_alive():
             ...
 
-    def getProducer(self):
-        if self.kafka_producer:
-            return self.kafka_producer
-
-        self.kafka_producer = connect_kafka_producer(findy_config['kafka'])
-        return self.kafka_producer
-
-    def consuming(self, sleep):
-        consumer = connect_kafka_consumer(progress_topic, findy_config['kafka'])
+    @staticmethod
+    def consuming(transport, sleep, ready=None):
         pbars = {}
         pdata = {}
         pfinish = {}
+        # task -> shards counted in its total
+        pshards = {}
 
         while True:
-            for msg in consumer:
-                data = msgpack.loads(msg.value)
+            for value in transport.messages(ready):
+                data = msgpack.loads(value)
 
                 command = data.get('command', None)
                 if command == '@end':
@@ -59,9 +220,18 @@ class ProgressBarProcess():
                     desc = data['desc'] if task == 'main' else f"    {data['desc']}"
                     pbars[task] = tqdm(total=data['total'], ncols=90, desc=desc, position=position, leave=data['leave'])
                     pdata[task] = data
+                    pshards[task] = {data.get('shard')}
                     pbar = pbars[task]
+                elif data['update'] == 0 and data.get('shard') not in pshards[task]:
+                    # another shard of the task started
+                    pshards[task].add(data.get('shard'))
+                    pbar.total += data['total']
+                    pdata[task]['total'] = pbar.total
+                    pbar.refresh()
 
                 if pfinish.get(task, None) is None:
+                    if data.get('limit') is not None:
+                        pbar.set_postfix_str(f"limit: {data['limit']}", refresh=False)
                     pbar.update(data['update'])
 
             time.sleep(sleep)
@@ -69,6 +239,12 @@ class ProgressBarProcess():
     def start(self):
         self.process.start()
 
+    def wait_ready(self, timeout=None) -> bool:
+        """
+        wait until the consumer reads every message sent from now on, False on timeout
+        """
+        return self.ready.wait(timeout)
+
     def kill(self):
         if self.process.is_alive():
             self.process.terminate()
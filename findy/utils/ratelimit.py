@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+
+from aiohttp import TraceConfig
+
+from findy import findy_config
+
+logger = logging.getLogger(__name__)
+
+# token buckets shared by the processes of one run: (keys, RawArray of [tokens, last refill] pairs, Lock)
+__shared = None
+
+# key -> TokenBucket of this process
+__buckets = {}
+
+
+def create_rate_limits(context=None):
+    """
+    allocate the buckets of config rate_limits in shared memory, pass the result to
+    init_rate_limits of every worker process (pool initializer)
+
+    rate_limits: {"provider" or "provider:host": {"rate": requests per second, "burst": bucket size}}
+    """
+    context = context or multiprocessing.get_context()
+    keys = list(findy_config.get('rate_limits', {}).keys())
+
+    state = context.RawArray('d', 2 * max(len(keys), 1))
+    now = time.time()
+    for index, key in enumerate(keys):
+        # start full, the burst is available at once
+        state[2 * index] = findy_config['rate_limits'][key].get('burst', 1)
+        state[2 * index + 1] = now
+
+    shared = (keys, state, context.Lock())
+    init_rate_limits(shared)
+    return shared
+
+
+def init_rate_limits(shared):
+    global __shared
+    __shared = shared
+    __buckets.clear()
+
+
+class TokenBucket(object):
+    def __init__(self, key, rate, burst, state, index, lock) -> None:
+        self.key = key
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.state = state
+        self.index = index
+        self.lock = lock
+
+    def try_acquire(self) -> float:
+        """
+        take one token, return 0 on success, otherwise the seconds until one is refilled
+        """
+        with self.lock:
+            now = time.time()
+            tokens = self.state[2 * self.index]
+            last = self.state[2 * self.index + 1]
+
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            self.state[2 * self.index + 1] = now
+
+            if tokens >= 1:
+                self.state[2 * self.index] = tokens - 1
+                return 0
+            self.state[2 * self.index] = tokens
+            return (1 - tokens) / self.rate
+
+    async def acquire(self):
+        while (wait := self.try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+
+def get_bucket(provider: str, host: str = None):
+    """
+    bucket of provider (or provider:host when host is given), None when no limit is configured
+    """
+    key = f'{provider}:{host}' if host else provider
+    bucket = __buckets.get(key)
+    if bucket is not None:
+        return bucket
+
+    if key not in findy_config.get('rate_limits', {}):
+        return None
+
+    if __shared is None:
+        # not started by fetching, limit this process alone
+        create_rate_limits()
+
+    limit = findy_config['rate_limits'][key]
+    keys, state, lock = __shared
+    if key in keys:
+        bucket = TokenBucket(key, limit['rate'], limit.get('burst', 1), state, keys.index(key), lock)
+    else:
+        # configured after the shared buckets were allocated, rebuilding them here would split
+        # this process from the quota of the others
+        logger.warning(f'rate limit {key} is not shared with the other processes, limited per process')
+        bucket = TokenBucket(key, limit['rate'], limit.get('burst', 1),
+                             [limit.get('burst', 1), time.time()], 0, threading.Lock())
+    __buckets[key] = bucket
+    return bucket
+
+
+def rate_limit_trace_config(provider: str) -> TraceConfig:
+    """
+    aiohttp hook taking a token of the provider:host bucket before every request of a session
+    """
+    async def on_request_start(session, context, params):
+        bucket = get_bucket(provider, params.url.host)
+        if bucket is not None:
+            await bucket.acquire()
+
+    trace_config = TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    return trace_config
@@ -40,7 +40,17 @@ def get_sync_http_session():
     return requests.Session()
 
 
-def get_async_http_session():
+# provider -> session left open between the tasks of this process, daemon mode only
+__kept_sessions = {}
+__keep_sessions = False
+
+
+def keep_http_sessions(keep=True):
+    global __keep_sessions
+    __keep_sessions = keep
+
+
+def get_async_http_session(trace_configs=None, keep_alive=False):
     # if fetch_mode == RunMode.Sync:
     #     http_session = TimeoutRequestsSession()
     #     http_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=100, pool_maxsize=100, max_retries=0))
@@ -58,13 +68,40 @@ def get_async_http_session():
     #     # ignored_params=['auth_token'],                    # Ignore this param when caching responses
     # )
     return ClientSession(connector=TCPConnector(limit=30, limit_per_host=10, ttl_dns_cache=50,
-                                                ssl=False, force_close=True, enable_cleanup_closed=True),
+                                                ssl=False, force_close=not keep_alive, enable_cleanup_closed=True),
                          trust_env=True,
                         #  headers={"Connection": "close"},
-                         timeout=timeout
+                         timeout=timeout,
+                         trace_configs=trace_configs
                          )
 
 
+def acquire_http_session(key, trace_configs=None):
+    """
+    a new session per call, or in daemon mode the open session of key with its connections kept alive,
+    the trace configs of the first call stay with it
+    """
+    if not __keep_sessions:
+        return get_async_http_session(trace_configs=trace_configs)
+
+    http_session = __kept_sessions.get(key)
+    if http_session is None or http_session.closed:
+        http_session = get_async_http_session(trace_configs=trace_configs, keep_alive=True)
+        __kept_sessions[key] = http_session
+    return http_session
+
+
+async def release_http_session(http_session):
+    if not __keep_sessions:
+        await http_session.close()
+
+
+async def close_http_sessions():
+    for http_session in __kept_sessions.values():
+        await http_session.close()
+    __kept_sessions.clear()
+
+
 def sync_get(http_session: requests.Session, url, headers=None, encoding='utf-8', params={}, enable_proxy=False, return_type=None):
 
     @retry(retry_on_exception=retry_if_connection_error, stop_max_attempt_number=max_retries, wait_fixed=2000)
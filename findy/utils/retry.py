@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+import requests
+
+from findy import findy_config
+
+logger = logging.getLogger(__name__)
+
+# host -> CircuitBreaker of this process
+__breakers = {}
+
+# name -> RetryPolicy of this process
+__policies = {}
+
+# error messages of the providers meaning the connection, not the request, failed
+_transient_markers = ("Server disconnected",
+                      "Cannot connect to host",
+                      "Internal Privoxy Error",
+                      "Too Many Requests",
+                      "timed out")
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, message='', retry_after: float = 0) -> None:
+        super().__init__(message)
+        # seconds until the circuit lets a probe call pass
+        self.retry_after = retry_after
+
+
+def http_status(error: Exception):
+    # aiohttp keeps the status on the error, requests on its response
+    status = getattr(error, 'status', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError, aiohttp.ClientConnectionError,
+                          requests.ConnectionError, requests.Timeout)):
+        return True
+    status = http_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    msg = str(error)
+    return any(marker in msg for marker in _transient_markers)
+
+
+class CircuitBreaker(object):
+    """
+    closed: calls pass, consecutive failures counted
+    open: calls rejected at once for reset_timeout, doubled on every failed probe up to max_timeout
+    half open: one probe call passes, success closes the circuit, failure opens it again
+    """
+
+    def __init__(self, host: str, threshold: int = 5, reset_timeout: float = 10, max_timeout: float = 300) -> None:
+        self.host = host
+        self.threshold = threshold
+        self.base_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    @property
+    def retry_after(self) -> float:
+        # seconds until the open circuit turns half open
+        if self.opened_at is None:
+            return 0
+        return max(0, self.opened_at + self.reset_timeout - time.time())
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def on_success(self):
+        if self.opened_at is not None:
+            logger.info(f'circuit of {self.host} closed')
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.reset_timeout = self.base_timeout
+
+    def on_failure(self):
+        self.failures += 1
+
+        if self.probing:
+            # the probe failed, stay open for longer
+            self.probing = False
+            self.reset_timeout = min(self.reset_timeout * 2, self.max_timeout)
+            self.opened_at = time.time()
+            logger.warning(f'circuit of {self.host} open again for {self.reset_timeout:.0f}s')
+        elif self.opened_at is None and self.failures >= self.threshold:
+            self.opened_at = time.time()
+            logger.warning(f'circuit of {self.host} open for {self.reset_timeout:.0f}s, {self.failures} failures in a row')
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    breaker = __breakers.get(host)
+    if breaker is None:
+        breaker = CircuitBreaker(host, **findy_config.get('circuit_breaker', {}))
+        __breakers[host] = breaker
+    return breaker
+
+
+class RetryPolicy(object):
+    """
+    exponential backoff with full jitter, retries capped by a budget: every call deposits ratio of a token,
+    every retry takes one, so a failing provider gets at most ratio more calls than the healthy load
+    """
+
+    def __init__(self,
+                 name: str,
+                 attempts: int = 4,
+                 base: float = 0.5,
+                 cap: float = 30.0,
+                 ratio: float = 0.2,
+                 min_tokens: float = 10) -> None:
+        self.name = name
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.ratio = ratio
+        self.max_tokens = min_tokens
+        self.tokens = float(min_tokens)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def _withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def call(self, func, *args, host: str = None, retry_on=is_transient, **kwargs):
+        """
+        await func(*args, **kwargs), retrying the errors retry_on accepts, CircuitOpenError when host is failing
+        """
+        breaker = get_breaker(host or self.name)
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f'{breaker.host} circuit is {breaker.state}', retry_after=breaker.retry_after)
+
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if not retry_on(e):
+                    # the request failed, the host works
+                    breaker.on_success()
+                    raise
+
+                breaker.on_failure()
+                attempt += 1
+                if attempt >= self.attempts or not self._withdraw():
+                    raise
+
+                delay = self.backoff(attempt)
+                logger.debug(f'{self.name} retry {attempt} in {delay:.2f}s, error: {e}')
+                await asyncio.sleep(delay)
+            else:
+                breaker.on_success()
+                return result
+
+
+def get_retry_policy(name: str) -> RetryPolicy:
+    """
+    policy shared by the calls of one provider, config retry_policies overrides the defaults by name
+    """
+    policy = __policies.get(name)
+    if policy is None:
+        policy = RetryPolicy(name, **findy_config.get('retry_policies', {}).get(name, {}))
+        __policies[name] = policy
+    return policy
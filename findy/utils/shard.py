@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import zlib
+
+# (index, count) of the entity shard the running task records, set by loop_task_set
+current_shard = contextvars.ContextVar('entity_shard', default=None)
+
+
+def shard_of(entity_id: str, count: int) -> int:
+    # stable across processes and runs, unlike hash()
+    return zlib.crc32(entity_id.encode('utf-8')) % count
+
+
+def in_shard(entity_id: str, shard) -> bool:
+    if shard is None:
+        return True
+    index, count = shard
+    return shard_of(entity_id, count) == index
+
+
+def shard_label(shard) -> str:
+    return f"{shard[0] + 1}/{shard[1]}"
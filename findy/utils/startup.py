@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+
+
+def import_times(modules):
+    """
+    import the modules in a fresh interpreter under -X importtime,
+    returns [(module, self us, cumulative us, depth)] in import order
+    """
+    code = '; '.join(f'import {module}' for module in modules)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        times.append((name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip()) - 1) // 2))
+
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else f'import failed: {modules}')
+    return times
+
+
+def report_startup(modules, top=30):
+    """
+    print the modules taking most of the startup, by their own import time and with their imports
+    """
+    times = import_times(modules)
+    if not times:
+        return times
+
+    total = sum(cumulative for _, _, cumulative, depth in times if depth == 0)
+
+    print("")
+    print(f"startup imports: {len(times)} modules, {total / 1e6:.3f}s")
+    print(f"{'module':<64} {'self':>10} {'cumulative':>12}")
+    for name, self_us, cumulative_us, _ in sorted(times, key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{name:<64} {self_us / 1e3:>8.1f}ms {cumulative_us / 1e3:>10.1f}ms")
+
+    # the provider packages and their share of the startup
+    print("")
+    for name, _, cumulative_us, _ in times:
+        if name.startswith('findy.database.plugins.') and name.count('.') == 3:
+            print(f"{name:<64} {'':>10} {cumulative_us / 1e3:>10.1f}ms")
+    print("")
+    return times
@@ -25,6 +25,26 @@ def arg_parsing():
                         choices=[e.value for e in Region],
                         help=f"fetch stock market data. support: {[e.value for e in Region]}")
 
+    parser.add_argument("-dry-run",
+                        action='store_true',
+                        help="print the planned fetching with its predicted wall time, nothing is fetched")
+
+    parser.add_argument("-resume",
+                        action='store_true',
+                        help="skip the entities persisted by the former run within config checkpoint_ttl")
+
+    parser.add_argument("-daemon",
+                        action='store_true',
+                        help="keep a warm worker pool, fetch the due tasks of config daemon_regions, serve fetch requests")
+
+    parser.add_argument("-submit",
+                        action='store_true',
+                        help="hand the -fetch region to the running daemon instead of a cold start")
+
+    parser.add_argument("-profile-startup",
+                        action='store_true',
+                        help="report the import time per module of the startup, with the recorders of the -fetch region")
+
     parser.add_argument("-v", action="version",
                         version="Financial-Dynamics v%s" % findy_config['version'],
                         help="prints version and exits")
@@ -32,10 +52,29 @@ def arg_parsing():
     return parser.parse_args()
 
 
+def profile_startup(args):
+    from findy.utils.startup import report_startup
+
+    modules = ['findy.interface.fetch', 'findy.database']
+    if args.fetch is not None:
+        # the recorders the run would load, nothing of the other regions
+        from findy.database.plugins.manifest import recorder_modules
+        modules += sorted({module for (region, _, _), module in recorder_modules.items() if region == Region(args.fetch)})
+    report_startup(modules)
+
+
 # @sched.scheduled_job('interval', days=1)
 def fetch(args):
-    if args.fetch is not None:
-        fetching(Region(args.fetch))
+    if args.profile_startup:
+        profile_startup(args)
+    elif args.daemon:
+        from findy.interface.daemon import run_daemon
+        run_daemon()
+    elif args.fetch is not None and args.submit:
+        from findy.interface.daemon import request_daemon
+        print(request_daemon({"command": "fetch", "region": args.fetch}))
+    elif args.fetch is not None:
+        fetching(Region(args.fetch), dry_run=args.dry_run)
 
 
 if __name__ == '__main__':
@@ -43,6 +82,8 @@ if __name__ == '__main__':
     print(args)
 
     findy_config['debug'] = args.debug
+    if args.resume:
+        findy_config['checkpoint_resume'] = True
 
     fetch(args)
 
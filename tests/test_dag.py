@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+dag = pytest.importorskip('findy.utils.dag')
+
+
+def run_nodes(nodes, deps, fail=(), cost=None):
+    started = []
+
+    async def run(key):
+        started.append(key)
+        await asyncio.sleep(0)
+        if key in fail:
+            raise ValueError(f'{key} failed')
+        return key
+
+    states = asyncio.run(asyncio.wait_for(dag.run_dag({key: key for key in nodes}, deps, run, cost=cost), 5))
+    return states, started
+
+
+def test_dependencies_run_first():
+    states, started = run_nodes(['meta', 'kdata', 'finance'], {'kdata': ['meta'], 'finance': ['meta']})
+
+    assert all(state == dag.DONE for state in states.values())
+    assert started[0] == 'meta'
+    assert set(started[1:]) == {'kdata', 'finance'}
+
+
+def test_dependents_of_a_failure_are_skipped():
+    states, started = run_nodes(['meta', 'kdata', 'index'], {'kdata': ['meta']}, fail={'meta'})
+
+    assert states == {'meta': dag.FAILED, 'index': dag.DONE, 'kdata': dag.SKIPPED}
+    assert 'kdata' not in started
+
+
+def test_cycle_and_unscheduled_deps():
+    # a dependency out of the nodes counts as done
+    states, _ = run_nodes(['a', 'b', 'c'], {'a': ['b'], 'b': ['a'], 'c': ['not_scheduled']})
+
+    assert states == {'c': dag.DONE, 'a': dag.SKIPPED, 'b': dag.SKIPPED}
+
+
+def test_ready_nodes_start_longest_first():
+    cost = {'short': 1, 'long': 10, 'middle': 5}
+    _, started = run_nodes(list(cost), {}, cost=cost.get)
+
+    assert started == ['long', 'middle', 'short']
+
+
+def test_simulate_dag_pooled_slots():
+    nodes = ['meta', 'kdata', 'finance']
+    deps = {'kdata': ['meta'], 'finance': ['meta']}
+    units = {'meta': [1.0], 'kdata': [4.0, 4.0], 'finance': [2.0]}
+
+    # kdata and finance share 2 slots once meta is done, the longest goes first
+    finish = dag.simulate_dag(nodes, deps, units, slots=2, pooled={'kdata', 'finance'})
+    assert finish == {'meta': 1.0, 'kdata': 5.0, 'finance': 7.0}
+
+    # out of the pool, every unit runs at once
+    finish = dag.simulate_dag(nodes, deps, units, slots=2, pooled=set())
+    assert finish == {'meta': 1.0, 'kdata': 5.0, 'finance': 3.0}
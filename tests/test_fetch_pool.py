@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+fetch = pytest.importorskip('findy.interface.fetch')
+
+from findy import findy_config
+
+
+async def read_config(key):
+    return findy_config.get(key)
+
+
+def test_pool_process_sees_runtime_config(monkeypatch):
+    # -resume only sets the flag in the parent, the spawned workers reload config.json
+    monkeypatch.setitem(findy_config, 'checkpoint_resume', True)
+
+    async def run():
+        pool = fetch.create_pool(1, 1)
+        try:
+            return await pool.apply(read_config, ('checkpoint_resume',))
+        finally:
+            pool.terminate()
+            await pool.join()
+
+    assert asyncio.run(asyncio.wait_for(run(), 60)) is True
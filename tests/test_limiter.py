@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+limiter = pytest.importorskip('findy.utils.limiter')
+
+
+def test_get_limiter_keeps_highest_ceiling():
+    first = limiter.get_limiter('ceiling_smoke', 10)
+    first.limit = 25.0
+
+    # a lower start point does not take the slots of the first user
+    assert limiter.get_limiter('ceiling_smoke', 2) is first
+    assert (first.initial, first.max_limit, first.current) == (10, 40, 25)
+
+    # a higher one grows the ceiling, the learned limit stays
+    assert limiter.get_limiter('ceiling_smoke', 20) is first
+    assert (first.initial, first.max_limit, first.current) == (20, 80, 25)
+
+    # back and forth between the users does not resize again
+    limiter.get_limiter('ceiling_smoke', 10)
+    assert (first.initial, first.max_limit) == (20, 80)
+
+
+def test_additive_increase_per_round():
+    aimd = limiter.AdaptiveLimiter('aimd_smoke', initial=4, max_limit=6)
+
+    # 1 / limit per successful sample, about one slot per round of limit samples
+    for _ in range(4):
+        aimd.on_sample(0.1)
+    assert aimd.current == 4
+    aimd.on_sample(0.1)
+    assert aimd.current == 5
+
+    for _ in range(100):
+        aimd.on_sample(0.1)
+    assert aimd.current == 6
+
+
+def test_multiplicative_decrease_once_per_burst():
+    aimd = limiter.AdaptiveLimiter('aimd_smoke', initial=10, min_limit=2, backoff=0.5)
+
+    aimd.on_overload('http 429')
+    assert aimd.current == 5
+    # the same burst of failures, within a second of the last decrease
+    aimd.on_overload('http 429')
+    assert aimd.current == 5
+
+    for _ in range(3):
+        aimd.last_decrease = 0
+        aimd.on_overload('http 503')
+    assert aimd.current == 2
+
+
+def test_latency_drift_and_error_rate_shrink():
+    aimd = limiter.AdaptiveLimiter('aimd_smoke', initial=10, backoff=0.5, window=10, error_rate=0.2)
+    aimd.on_sample(0.5)
+    before = aimd.current
+
+    # over tolerance times the baseline
+    aimd.on_sample(2.0)
+    assert aimd.current < before
+
+    aimd = limiter.AdaptiveLimiter('aimd_smoke', initial=10, backoff=0.5, window=10, error_rate=0.2)
+    for ok in [True] * 7 + [False] * 3:
+        aimd.on_sample(0.1, ok=ok)
+    assert aimd.current == 5
+
+
+def test_waiters_wake_as_the_limit_grows():
+    async def run():
+        aimd = limiter.AdaptiveLimiter('aimd_smoke', initial=1, max_limit=2)
+        await aimd.acquire()
+        waiter = asyncio.ensure_future(aimd.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        aimd.on_sample(0.1)
+        await asyncio.sleep(0)
+        assert waiter.done() and aimd.in_flight == 2
+
+        aimd.release()
+        aimd.release()
+        return aimd
+
+    aimd = asyncio.run(asyncio.wait_for(run(), 5))
+    assert aimd.in_flight == 0
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+import pytest
+
+partition = pytest.importorskip('findy.database.partition')
+
+
+def test_month_partitions_cover_the_range():
+    bounds = partition.partition_bounds('month', pd.Timestamp('2021-11-15 10:00'), pd.Timestamp('2022-02-01'))
+
+    assert [suffix for suffix, _, _ in bounds] == ['2021_11', '2021_12', '2022_01', '2022_02']
+    assert bounds[0][1] == pd.Timestamp('2021-11-01')
+    # contiguous, the upper bound of one is the lower bound of the next
+    assert all(bounds[i][2] == bounds[i + 1][1] for i in range(len(bounds) - 1))
+    assert bounds[-1][2] == pd.Timestamp('2022-03-01')
+
+
+def test_year_partitions():
+    bounds = partition.partition_bounds('year', pd.Timestamp('2020-06-01'), pd.Timestamp('2021-01-01'))
+
+    assert bounds == [('2020', pd.Timestamp('2020-01-01'), pd.Timestamp('2021-01-01')),
+                      ('2021', pd.Timestamp('2021-01-01'), pd.Timestamp('2022-01-01'))]
+
+
+def test_range_within_one_partition():
+    bounds = partition.partition_bounds('month', pd.Timestamp('2021-11-15'), pd.Timestamp('2021-11-20'))
+
+    assert bounds == [('2021_11', pd.Timestamp('2021-11-01'), pd.Timestamp('2021-12-01'))]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pandas as pd
+import pytest
+
+persist = pytest.importorskip('findy.database.persist')
+
+
+class Schema(object):
+    __tablename__ = 'smoke_kdata'
+
+
+def fake_db(monkeypatch, bad_ids):
+    writes = []
+
+    async def df_to_db(**kwargs):
+        df = kwargs['df']
+        if df['id'].isin(bad_ids).any():
+            raise ValueError('constraint violated')
+        writes.append((sorted(df['id']), kwargs['force_update']))
+        return len(df)
+
+    monkeypatch.setattr(persist, 'df_to_db', df_to_db)
+    return writes
+
+
+def test_bad_frame_fails_alone(monkeypatch):
+    writes = fake_db(monkeypatch, ['bad'])
+    committed, errors = [], []
+
+    async def run():
+        buffer = persist.PersistBuffer(None, None, Schema, None, max_rows=5, force_update=True)
+        for name in ['a', 'bad']:
+            await buffer.put(pd.DataFrame({'id': [name, name + '2']}),
+                             on_commit=lambda name=name: committed.append(name),
+                             on_error=lambda error, name=name: errors.append(name))
+        # the flush taken by this put fails on the held frame, not on this one
+        await buffer.put(pd.DataFrame({'id': ['c', 'c2']}), on_commit=lambda: committed.append('c'))
+        return buffer
+
+    buffer = asyncio.run(run())
+
+    assert committed == ['a', 'c']
+    assert errors == ['bad']
+    assert buffer.frames == [] and buffer.rows == 0
+    assert (['a', 'a2'], True) in writes
+
+
+def test_bad_frame_of_the_put_raises(monkeypatch):
+    fake_db(monkeypatch, ['bad'])
+    committed = []
+
+    async def run():
+        buffer = persist.PersistBuffer(None, None, Schema, None, max_rows=3)
+        await buffer.put(pd.DataFrame({'id': ['a', 'a2']}), on_commit=lambda: committed.append('a'))
+        with pytest.raises(ValueError):
+            await buffer.put(pd.DataFrame({'id': ['bad', 'bad2']}))
+        return buffer
+
+    buffer = asyncio.run(run())
+
+    assert committed == ['a']
+    assert buffer.frames == []
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import enum
+import struct
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+pgcopy = pytest.importorskip('findy.database.pgcopy')
+
+from sqlalchemy import types as sqltypes
+
+
+class Level(enum.Enum):
+    LEVEL_1DAY = '1d'
+    LEVEL_1WEEK = '1wk'
+
+
+PG_EPOCH = datetime(2000, 1, 1)
+
+# sqlalchemy type -> decoder of the binary field, what postgresql reads from it
+decoders = {
+    'big': (sqltypes.BigInteger(), lambda b: struct.unpack('>q', b)[0]),
+    'int': (sqltypes.Integer(), lambda b: struct.unpack('>i', b)[0]),
+    'small': (sqltypes.SmallInteger(), lambda b: struct.unpack('>h', b)[0]),
+    'float': (sqltypes.Float(), lambda b: struct.unpack('>d', b)[0]),
+    'flag': (sqltypes.Boolean(), lambda b: struct.unpack('?', b)[0]),
+    'timestamp': (sqltypes.DateTime(), lambda b: PG_EPOCH + timedelta(microseconds=struct.unpack('>q', b)[0])),
+    'code': (sqltypes.String(32), lambda b: b.decode('utf-8')),
+    'level': (sqltypes.Enum(Level), lambda b: b.decode('utf-8')),
+}
+
+
+def decode_copy(data: bytes, columns):
+    assert data.startswith(pgcopy.COPY_HEADER)
+    pos = len(pgcopy.COPY_HEADER)
+    rows = []
+    while True:
+        (count,) = struct.unpack_from('>h', data, pos)
+        pos += 2
+        if count == -1:
+            break
+        assert count == len(columns)
+        row = []
+        for col in columns:
+            (length,) = struct.unpack_from('>i', data, pos)
+            pos += 4
+            if length == -1:
+                row.append(None)
+                continue
+            row.append(decoders[col][1](data[pos:pos + length]))
+            pos += length
+        rows.append(row)
+    assert pos == len(data)
+    return rows
+
+
+def test_round_trip_every_type_with_nulls():
+    df = pd.DataFrame({
+        'big': pd.array([2 ** 40, None, -3], dtype='Int64'),
+        'int': pd.array([2 ** 20, -7, None], dtype='Int64'),
+        'small': pd.array([None, 300, -2], dtype='Int64'),
+        'float': [1.5, None, -0.25],
+        'flag': [True, None, False],
+        'timestamp': [datetime(2021, 3, 4, 5, 6, 7, 8), None, datetime(1999, 12, 31)],
+        'code': ['000001', '平安银行', None],
+        'level': [Level.LEVEL_1DAY, None, Level.LEVEL_1WEEK],
+    })
+    column_types = {col: decoder[0] for col, decoder in decoders.items()}
+
+    rows = decode_copy(b''.join(pgcopy.iter_copy_chunks(df, column_types, chunk_rows=2)), list(df.columns))
+
+    assert rows == [
+        [2 ** 40, 2 ** 20, None, 1.5, True, datetime(2021, 3, 4, 5, 6, 7, 8), '000001', '1d'],
+        [None, -7, 300, None, None, None, '平安银行', None],
+        [-3, None, -2, -0.25, False, datetime(1999, 12, 31), None, '1wk'],
+    ]
+
+
+def test_small_integer_is_two_bytes():
+    assert pgcopy._fixed_dtype(sqltypes.SmallInteger()) == '>i2'
+    assert pgcopy._fixed_dtype(sqltypes.BigInteger()) == '>i8'
+    assert pgcopy._fixed_dtype(sqltypes.Integer()) == '>i4'
+
+
+def test_tz_aware_timestamp_keeps_wall_clock():
+    df = pd.DataFrame({'timestamp': pd.to_datetime(['2021-03-04 09:30']).tz_localize('Asia/Shanghai')})
+
+    rows = decode_copy(b''.join(pgcopy.iter_copy_chunks(df, {'timestamp': sqltypes.DateTime()})), ['timestamp'])
+
+    assert rows == [[datetime(2021, 3, 4, 9, 30)]]
+
+
+def test_stream_reads_the_chunks():
+    df = pd.DataFrame({'code': [f'{i:06d}' for i in range(25)], 'int': range(25)})
+    column_types = {'code': sqltypes.String(), 'int': sqltypes.Integer()}
+    stream = pgcopy.BinaryCopyStream(df, column_types, chunk_rows=10)
+
+    parts = []
+    while part := stream.read(7):
+        parts.append(part)
+
+    assert b''.join(parts) == b''.join(pgcopy.iter_copy_chunks(df, column_types))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import msgpack
+import pytest
+
+progress = pytest.importorskip('findy.utils.progress')
+
+
+class Message(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeConsumer(object):
+    # partitions assigned on the second poll, the first one already returns a record
+    def __init__(self):
+        self.polls = 0
+        self.positions = []
+
+    def assignment(self):
+        return {'p0'} if self.polls >= 2 else set()
+
+    def poll(self, timeout_ms=0):
+        self.polls += 1
+        return {'p0': [Message(b'early')]} if self.polls == 1 else {}
+
+    def position(self, partition):
+        self.positions.append(partition)
+        return 0
+
+    def __iter__(self):
+        return iter([Message(b'late')])
+
+
+def test_kafka_ready_after_assignment(monkeypatch):
+    consumer = FakeConsumer()
+    monkeypatch.setattr(progress, 'connect_kafka_consumer', lambda topic, server: consumer)
+    ready = threading.Event()
+
+    messages = progress.KafkaTransport('broker:9092').messages(ready)
+
+    assert next(messages) == b'early'
+    assert not ready.is_set()
+    assert next(messages) == b'late'
+    assert ready.is_set()
+    assert consumer.positions == ['p0']
+
+
+def test_queue_consumer_ready():
+    transport = progress.QueueTransport()
+    pbar = progress.ProgressBarProcess(transport)
+    pbar.start()
+    try:
+        assert pbar.wait_ready(30)
+        transport.send(msgpack.dumps({'command': '@end'}))
+        pbar.process.join(30)
+        assert not pbar.process.is_alive()
+    finally:
+        pbar.kill()
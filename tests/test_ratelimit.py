@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+ratelimit = pytest.importorskip('findy.utils.ratelimit')
+
+from findy import findy_config
+
+
+@pytest.fixture(autouse=True)
+def local_buckets():
+    yield
+    # the buckets of this process are cached, leave none to the other tests
+    ratelimit.init_rate_limits(None)
+
+
+def test_bucket_shared_by_processes(monkeypatch):
+    monkeypatch.setitem(findy_config, 'rate_limits', {'smoke': {'rate': 1, 'burst': 2}})
+    shared = ratelimit.create_rate_limits()
+
+    bucket = ratelimit.get_bucket('smoke')
+    assert bucket.state is shared[1]
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() > 0
+
+    assert ratelimit.get_bucket('other') is None
+
+
+def test_late_key_does_not_replace_shared_state(monkeypatch):
+    monkeypatch.setitem(findy_config, 'rate_limits', {'smoke': {'rate': 1, 'burst': 1}})
+    shared = ratelimit.create_rate_limits()
+    ratelimit.get_bucket('smoke').try_acquire()
+
+    findy_config['rate_limits'] = {'smoke': {'rate': 1, 'burst': 1}, 'smoke:host': {'rate': 10, 'burst': 3}}
+    bucket = ratelimit.get_bucket('smoke', 'host')
+
+    # the late key is limited in this process, the shared buckets keep their state
+    assert bucket.state is not shared[1]
+    assert bucket.try_acquire() == 0
+    assert ratelimit.get_bucket('smoke').state is shared[1]
+    assert ratelimit.get_bucket('smoke').try_acquire() > 0
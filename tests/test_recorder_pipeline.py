@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+
+import pandas as pd
+import pytest
+
+recorder = pytest.importorskip('findy.database.recorder')
+
+from findy import findy_config
+from findy.utils.limiter import AdaptiveLimiter
+from findy.utils.pipeline import PriorityFeed
+from findy.utils.retry import CircuitOpenError
+
+
+class Schema(object):
+    pass
+
+
+class Provider(object):
+    value = 'smoke'
+
+
+class Progress(object):
+    def __init__(self) -> None:
+        self.updates = 0
+
+    def update(self, pbar_update):
+        self.updates += pbar_update['update']
+
+
+class SmokeRecorder(recorder.RecorderForEntities):
+    provider = Provider
+    data_schema = Schema
+    checkpoint = False
+    queue_size = 2
+
+    def __init__(self, failures) -> None:
+        # no db, no entity schema, only what run_pipeline touches
+        self.batch_size = 10
+        self.persist_buffer = None
+        self.outcomes = []
+        self.failures = failures
+        self.persisted = []
+
+    async def eval(self, entity, http_session, db_session):
+        return False, 0, None
+
+    async def record(self, entity, http_session, db_session, para):
+        if self.failures.get((entity, 'record'), 0) > 0:
+            self.failures[(entity, 'record')] -= 1
+            raise ConnectionError(f'{entity} dropped')
+        return False, 0, entity
+
+    async def persist(self, entity, http_session, db_session, df_record):
+        if self.failures.get((entity, 'persist'), 0) > 0:
+            self.failures[(entity, 'persist')] -= 1
+            raise IOError(f'{entity} not written')
+        self.persisted.append(entity)
+        return True, 0, 1
+
+    async def on_finish_entity(self, entity, http_session, db_session, result):
+        return 0
+
+
+def test_run_pipeline_over_priority_feed(monkeypatch):
+    monkeypatch.setitem(findy_config, 'format_executor', 'thread')
+
+    entities = [f'stock_sz_{i:06d}' for i in range(8)]
+    r = SmokeRecorder({(entities[1], 'record'): 1, (entities[2], 'persist'): 1, (entities[3], 'record'): 5})
+    progress = Progress()
+
+    async def run():
+        feed = PriorityFeed(entities, max_retries=2, backoff=0.01)
+        await r.run_pipeline(feed, {'task': 'smoke', 'update': 0}, None, None, progress, AdaptiveLimiter('smoke', 2))
+        return feed
+
+    feed = asyncio.run(asyncio.wait_for(run(), 10))
+
+    # a failure is queued again, the one failing more than max_retries times is given up
+    assert sorted(r.persisted) == sorted(entities[:3] + entities[4:])
+    # every entity moves the bar once, given up or not
+    assert progress.updates == len(entities)
+    assert len(feed) == 0
+
+
+def test_retry_waits_for_backoff():
+    async def run():
+        feed = PriorityFeed(['a', 'b'], backoff=0.2)
+        first = await feed.__anext__()
+        feed.retry(first)
+        feed.done(first)
+
+        # the fresh item first, the retried one only once its backoff is over
+        assert await feed.__anext__() == 'b'
+        feed.done('b')
+        start = asyncio.get_event_loop().time()
+        assert await feed.__anext__() == 'a'
+        return asyncio.get_event_loop().time() - start
+
+    assert asyncio.run(asyncio.wait_for(run(), 5)) >= 0.09
+
+
+def test_open_circuit_retry_not_counted():
+    r = SmokeRecorder({})
+    r.logger = logging.getLogger('smoke')
+
+    async def run():
+        feed = PriorityFeed(['a'], max_retries=1, backoff=0.01)
+        for _ in range(3):
+            entity = await feed.__anext__()
+            assert r.retry_entity(feed, entity, 'record', CircuitOpenError('open', retry_after=0.02))
+            feed.done(entity)
+
+        # still every attempt left for the errors of the entity itself
+        entity = await feed.__anext__()
+        assert r.retry_entity(feed, entity, 'record', ConnectionError('dropped'))
+        feed.done(entity)
+        entity = await feed.__anext__()
+        assert not r.retry_entity(feed, entity, 'record', ConnectionError('dropped'))
+        feed.done(entity)
+        return feed
+
+    feed = asyncio.run(asyncio.wait_for(run(), 5))
+    assert len(feed) == 0
+
+
+def test_skip_checkpointed_only_on_resume(monkeypatch):
+    from findy.database.checkpoint import OUTCOME_FAILED, OUTCOME_EVALUATED, OUTCOME_PERSISTED
+
+    now = pd.Timestamp.now()
+    r = SmokeRecorder({})
+    r.force_update = False
+    r.checkpoints = {'persisted': (None, OUTCOME_PERSISTED, now),
+                     'evaluated': (None, OUTCOME_EVALUATED, now),
+                     'failed': (None, OUTCOME_FAILED, now),
+                     'expired': (None, OUTCOME_PERSISTED, now - pd.Timedelta(days=2))}
+    entities = list(r.checkpoints) + ['new']
+
+    monkeypatch.setitem(findy_config, 'checkpoint_resume', False)
+    assert r.skip_checkpointed(entities) == entities
+
+    monkeypatch.setitem(findy_config, 'checkpoint_resume', True)
+    assert r.skip_checkpointed(entities) == ['evaluated', 'failed', 'expired', 'new']
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+retry = pytest.importorskip('findy.utils.retry')
+
+
+class HttpError(Exception):
+    def __init__(self, status) -> None:
+        super().__init__(f'http {status}')
+        self.status = status
+
+
+def test_transient_errors():
+    assert retry.is_transient(asyncio.TimeoutError())
+    assert retry.is_transient(ConnectionError())
+    assert retry.is_transient(HttpError(429))
+    assert retry.is_transient(HttpError(503))
+    assert retry.is_transient(Exception('Server disconnected'))
+
+    assert not retry.is_transient(HttpError(404))
+    assert not retry.is_transient(ValueError('bad payload'))
+    assert not retry.is_transient(retry.CircuitOpenError('open'))
+
+
+def test_breaker_states():
+    breaker = retry.CircuitBreaker('breaker_smoke', threshold=2, reset_timeout=10, max_timeout=30)
+
+    breaker.on_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.on_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    assert 9 < breaker.retry_after <= 10
+
+    # reset timeout over, one probe passes
+    breaker.opened_at -= 10
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # the probe failed, open for twice as long, up to max_timeout
+    breaker.on_failure()
+    assert breaker.state == 'open' and breaker.reset_timeout == 20
+    breaker.opened_at -= 20
+    breaker.allow()
+    breaker.on_failure()
+    assert breaker.reset_timeout == 30
+
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    breaker.on_success()
+    assert breaker.state == 'closed' and breaker.reset_timeout == 10 and breaker.retry_after == 0
+
+
+def test_policy_retries_transient_errors():
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError('dropped')
+        return 'ok'
+
+    policy = retry.RetryPolicy('policy_smoke', attempts=4, base=0.001)
+    assert asyncio.run(policy.call(flaky, host='policy_smoke_host')) == 'ok'
+    assert len(calls) == 3
+    assert retry.get_breaker('policy_smoke_host').failures == 0
+
+
+def test_policy_raises_other_errors_at_once():
+    calls = []
+
+    async def broken():
+        calls.append(1)
+        raise ValueError('bad payload')
+
+    policy = retry.RetryPolicy('policy_smoke', attempts=4, base=0.001)
+    with pytest.raises(ValueError):
+        asyncio.run(policy.call(broken, host='policy_smoke_host'))
+    assert len(calls) == 1
+
+
+def test_policy_sheds_calls_of_a_failing_host(monkeypatch):
+    monkeypatch.setitem(retry.findy_config, 'circuit_breaker', {'threshold': 2, 'reset_timeout': 5})
+
+    async def down():
+        raise ConnectionError('refused')
+
+    policy = retry.RetryPolicy('policy_smoke', attempts=2, base=0.001)
+    with pytest.raises(ConnectionError):
+        asyncio.run(policy.call(down, host='policy_smoke_down'))
+
+    # the circuit is open, the call is rejected without reaching the host
+    with pytest.raises(retry.CircuitOpenError) as error:
+        asyncio.run(policy.call(down, host='policy_smoke_down'))
+    assert 0 < error.value.retry_after <= 5
+
+
+def test_retry_budget():
+    async def down():
+        raise ConnectionError('refused')
+
+    # 1 token, the second retry is not paid for
+    policy = retry.RetryPolicy('policy_smoke', attempts=10, base=0.001, ratio=0, min_tokens=1)
+    calls = []
+
+    async def counted():
+        calls.append(1)
+        await down()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(policy.call(counted, host='policy_smoke_budget'))
+    assert len(calls) == 2